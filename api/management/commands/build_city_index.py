@@ -0,0 +1,22 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.v1.cities import MappedCityIndex
+from api.v1.cities import get_city_index_path
+from api.v1.cities import get_city_rows
+
+
+class Command(BaseCommand):
+    """Build the prebuilt city index files mapped by the workers from the local city catalog"""
+
+    help = 'Write city index files for every language, atomically replacing the files in use'
+
+    def handle(self, *args, **options):
+        for language, _ in settings.LANGUAGES:
+            path = get_city_index_path(language)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            rows = get_city_rows(language)
+            MappedCityIndex.write(path, rows)
+            self.stdout.write(f'Wrote {len(rows)} city names to {path}')
@@ -0,0 +1,55 @@
+import gzip
+import json
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from api.models import City
+
+
+class Command(BaseCommand):
+    """Bulk load the openweathermap city list into the local city catalog"""
+
+    help = 'Load cities from openweathermap city.list.json(.gz), from a local file or url'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default=settings.OPEN_WEATHER_CITY_LIST_URL)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cities = [self.get_city(row) for row in self.read_source(options['source'])]
+        with transaction.atomic():
+            City.objects.all().delete()
+            City.objects.bulk_create(cities, batch_size=options['batch_size'])
+        self.stdout.write(f'Loaded {len(cities)} cities')
+
+    def read_source(self, source):
+        """Read list of cities from a local file or url, gzip compressed or not"""
+        if source.startswith(('http://', 'https://')):
+            response = requests.get(source, timeout=60)
+            try:
+                response.raise_for_status()
+            except requests.RequestException as error:
+                raise CommandError(f'Could not download {source}: {error}')
+            content = response.content
+        else:
+            with open(source, 'rb') as source_file:
+                content = source_file.read()
+        if content[:2] == b'\x1f\x8b':
+            content = gzip.decompress(content)
+        return json.loads(content)
+
+    def get_city(self, row):
+        coord = row.get('coord') or {}
+        return City(
+            id=row['id'],
+            name=row['name'],
+            state=row.get('state') or '',
+            country=row.get('country') or '',
+            population=(row.get('stat') or {}).get('population') or 0,
+            latitude=coord.get('lat'),
+            longitude=coord.get('lon'),
+        )
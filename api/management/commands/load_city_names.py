@@ -0,0 +1,44 @@
+import csv
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import City
+from api.models import CityName
+
+
+class Command(BaseCommand):
+    """Load localized city names for the languages of the app into the local city catalog"""
+
+    help = (
+        'Load localized city names from a GeoNames alternateNames file (alternateNamesV2.txt), '
+        'openweathermap city ids are GeoNames ids'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        languages = {language for language, _ in settings.LANGUAGES}
+        city_ids = set(City.objects.values_list('id', flat=True))
+        names = set()
+        csv.field_size_limit(sys.maxsize)
+        with open(options['source'], encoding='utf-8', newline='') as source:
+            for row in csv.reader(source, delimiter='\t', quoting=csv.QUOTE_NONE):
+                # alternateNameId, geonameid, isolanguage, alternate name, isPreferredName, isShortName,
+                # isColloquial, isHistoric, ...
+                city_id, language, name = int(row[1]), row[2], row[3]
+                is_colloquial, is_historic = row[6:8] if len(row) >= 8 else ('', '')
+                if language in languages and city_id in city_ids and is_colloquial != '1' and is_historic != '1':
+                    names.add((city_id, language, name[:200]))
+
+        with transaction.atomic():
+            CityName.objects.all().delete()
+            CityName.objects.bulk_create(
+                (CityName(city_id=city_id, language=language, name=name) for city_id, language, name in names),
+                batch_size=options['batch_size'],
+            )
+        self.stdout.write(f'Loaded {len(names)} localized city names')
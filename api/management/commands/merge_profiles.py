@@ -0,0 +1,55 @@
+import json
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from weather_finder.profiling import find_profiles
+from weather_finder.profiling import format_collapsed
+from weather_finder.profiling import parse_collapsed
+from weather_finder.profiling import to_speedscope
+
+
+class Command(BaseCommand):
+    """Merge the request profiles written by the profiling middleware into one flame graph per view"""
+
+    help = (
+        'Merge the profiles of PROFILING_DIR per view into speedscope files (https://www.speedscope.app) or '
+        'collapsed stacks for flamegraph.pl'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='directory of the profiles, PROFILING_DIR by default')
+        parser.add_argument('--output', default=None, help='directory of the merged files, <dir>/merged by default')
+        parser.add_argument('--format', choices=['speedscope', 'collapsed'], default='speedscope')
+        parser.add_argument('--delete', action='store_true', help='delete the profiles once merged')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILING_DIR
+        profiles = find_profiles(directory)
+        if not profiles:
+            raise CommandError(f'No profiles in {directory}')
+        output = options['output'] or os.path.join(directory, 'merged')
+        os.makedirs(output, exist_ok=True)
+
+        for view, paths in profiles.items():
+            stacks = Counter()
+            for path in paths:
+                with open(path) as profile_file:
+                    stacks.update(parse_collapsed(profile_file.read()))
+            if options['format'] == 'speedscope':
+                merged_path = os.path.join(output, f'{view}.speedscope.json')
+                content = json.dumps(to_speedscope(view, stacks))
+            else:
+                merged_path = os.path.join(output, f'{view}.collapsed')
+                content = format_collapsed(stacks)
+            with open(merged_path, 'w') as merged_file:
+                merged_file.write(content)
+            if options['delete']:
+                for path in paths:
+                    os.remove(path)
+            self.stdout.write(
+                f'{view}: {len(paths)} profiles, {sum(stacks.values()) / 1000000:.3f}s sampled, {merged_path}'
+            )
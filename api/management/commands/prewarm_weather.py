@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.v1.prewarming import Prewarmer
+
+
+class Command(BaseCommand):
+    """Keep the weather of the most requested cities cached, refreshing it before it goes stale"""
+
+    help = 'Refresh the cache entries of the most requested cities every WEATHER_PREWARM_INTERVAL seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run one cycle and exit')
+
+    def handle(self, *args, **options):
+        prewarmer = Prewarmer()
+        while True:
+            started = time.monotonic()
+            refreshed = prewarmer.run_once()
+            if refreshed is None:
+                self.stdout.write('Another pre-warmer ran this cycle')
+            else:
+                self.stdout.write(f'Refreshed {refreshed} cities')
+            if options['once']:
+                return
+            time.sleep(max(settings.WEATHER_PREWARM_INTERVAL - (time.monotonic() - started), 0))
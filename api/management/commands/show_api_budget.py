@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from api.v1.budget import rate_budget
+
+
+class Command(BaseCommand):
+    """Show how much of the openweathermap call budget is used"""
+
+    help = 'Show the tokens left in the openweathermap call budget and the calls of the current minute by priority'
+
+    def handle(self, *args, **options):
+        usage = rate_budget.get_usage()
+        if usage is None:
+            raise CommandError('The call budget needs a redis cache')
+
+        self.stdout.write(f"Tokens left: {usage['tokens']:.1f} of {usage['capacity']}")
+        for priority, calls in usage['calls'].items():
+            self.stdout.write(f"{priority}: {calls['allowed']} allowed, {calls['denied']} denied this minute")
@@ -0,0 +1,28 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from api.v1.views import CityListView
+from api.v1.views import ForecastView
+from api.v1.views import WeatherDetailsView
+
+
+class Command(BaseCommand):
+    """Drop in-process cache entries of every worker when an api cache version was bumped"""
+
+    help = (
+        'Invalidate in-process caches of all workers if WEATHER_API_CACHE_VERSION, CITY_API_CACHE_VERSION or '
+        'FORECAST_API_CACHE_VERSION changed'
+    )
+
+    def handle(self, *args, **options):
+        for view_class in (WeatherDetailsView, CityListView, ForecastView):
+            version_key = f'cache_version:{view_class.__name__}'
+            version = str(view_class.CACHE_VERSION)
+            if cache.get(version_key) == version:
+                continue
+
+            cache.set(version_key, version, timeout=None)
+            if hasattr(cache, 'invalidate'):
+                for prefix in view_class.CACHE_KEY_PREFIXES:
+                    cache.invalidate(prefix)
+            self.stdout.write(f'{view_class.__name__} cache version changed to {version}')
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=200)),
+                ('state', models.CharField(blank=True, max_length=20)),
+                ('country', models.CharField(blank=True, max_length=2)),
+                ('population', models.PositiveIntegerField(default=0)),
+                ('latitude', models.FloatField(null=True)),
+                ('longitude', models.FloatField(null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'cities',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityName',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=7)),
+                ('name', models.CharField(max_length=200)),
+                (
+                    'city',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name='localized_names', to='api.city'
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('city', 'language', 'name')},
+            },
+        ),
+    ]
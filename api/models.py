@@ -0,0 +1,33 @@
+from django.db import models
+
+
+class City(models.Model):
+    """City from the openweathermap city list, identified by openweathermap city id"""
+
+    id = models.PositiveIntegerField(primary_key=True)
+    name = models.CharField(max_length=200)
+    state = models.CharField(max_length=20, blank=True)
+    country = models.CharField(max_length=2, blank=True)
+    population = models.PositiveIntegerField(default=0)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+
+    class Meta:
+        verbose_name_plural = 'cities'
+
+    def __str__(self):
+        return f'{self.name}, {self.country}'
+
+
+class CityName(models.Model):
+    """Localized name of a city, eg: Munich for München in English"""
+
+    city = models.ForeignKey(City, related_name='localized_names', on_delete=models.CASCADE)
+    language = models.CharField(max_length=7)
+    name = models.CharField(max_length=200)
+
+    class Meta:
+        unique_together = ('city', 'language', 'name')
+
+    def __str__(self):
+        return f'{self.name} ({self.language})'
@@ -0,0 +1,136 @@
+import gzip
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import override_settings
+
+from api.models import City
+from weather_finder.profiling import find_profiles
+from weather_finder.profiling import write_profile
+
+
+class SyncCacheVersionsCommandTestCase(SimpleTestCase):
+    """Tests for sync_cache_versions management command"""
+
+    @mock.patch('api.management.commands.sync_cache_versions.cache')
+    def test_handle_invalidate_local_caches_for_changed_versions(self, mock_cache):
+        """handle: invalidate in-process caches of views whose cache version changed"""
+        # given
+        mock_cache.get.side_effect = lambda key: {'cache_version:WeatherDetailsView': '0'}.get(key, '1')
+        # when
+        call_command('sync_cache_versions', stdout=StringIO())
+        # then
+        mock_cache.set.assert_called_once_with('cache_version:WeatherDetailsView', '1', timeout=None)
+        mock_cache.invalidate.assert_has_calls(
+            [mock.call('weather_data:'), mock.call('weather_record:'), mock.call('weather_body:')]
+        )
+        self.assertEqual(mock_cache.invalidate.call_count, 3)
+
+
+class PrewarmWeatherCommandTestCase(SimpleTestCase):
+    """Tests for prewarm_weather management command"""
+
+    @mock.patch('api.management.commands.prewarm_weather.Prewarmer')
+    def test_handle_run_one_cycle(self, mock_prewarmer):
+        """handle: refresh the popular cities once with --once"""
+        # given
+        mock_prewarmer().run_once.return_value = 3
+        stdout = StringIO()
+        # when
+        call_command('prewarm_weather', '--once', stdout=stdout)
+        # then
+        mock_prewarmer().run_once.assert_called_once_with()
+        self.assertIn('Refreshed 3 cities', stdout.getvalue())
+
+
+class ShowAPIBudgetCommandTestCase(SimpleTestCase):
+    """Tests for show_api_budget management command"""
+
+    @mock.patch('api.management.commands.show_api_budget.rate_budget')
+    def test_handle_show_budget_usage(self, mock_rate_budget):
+        """handle: show the tokens left and the calls of the minute by priority"""
+        # given
+        mock_rate_budget.get_usage.return_value = {
+            'tokens': 4.25,
+            'capacity': 10,
+            'calls': {'weather': {'allowed': 12, 'denied': 0}, 'prewarm': {'allowed': 1, 'denied': 3}},
+        }
+        stdout = StringIO()
+        # when
+        call_command('show_api_budget', stdout=stdout)
+        # then
+        self.assertEqual(
+            stdout.getvalue().splitlines(),
+            [
+                'Tokens left: 4.2 of 10',
+                'weather: 12 allowed, 0 denied this minute',
+                'prewarm: 1 allowed, 3 denied this minute',
+            ],
+        )
+
+
+class MergeProfilesCommandTestCase(SimpleTestCase):
+    """Tests for merge_profiles management command"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        with override_settings(PROFILING_DIR=self.directory):
+            write_profile('api:v1:weather', 'a' * 32, 'main;view 100\nmain;render 20\n')
+            write_profile('api:v1:weather', 'b' * 32, 'main;view 50\n')
+            write_profile('api:v1:city_list', 'c' * 32, 'main;search 10\n')
+
+    def test_handle_merge_profiles_per_view(self):
+        """handle: merge the profiles of each view into collapsed stacks"""
+        # given
+        stdout = StringIO()
+        # when
+        call_command('merge_profiles', '--dir', self.directory, '--format', 'collapsed', '--delete', stdout=stdout)
+        # then
+        with open(os.path.join(self.directory, 'merged', 'api.v1.weather.collapsed')) as merged_file:
+            self.assertEqual(merged_file.read(), 'main;render 20\nmain;view 150\n')
+        self.assertIn('api.v1.weather: 2 profiles, 0.000s sampled', stdout.getvalue())
+        self.assertEqual(find_profiles(self.directory), {})
+
+    def test_handle_write_speedscope_files(self):
+        """handle: write one speedscope profile per view"""
+        # when
+        call_command('merge_profiles', '--dir', self.directory, stdout=StringIO())
+        # then
+        with open(os.path.join(self.directory, 'merged', 'api.v1.city_list.speedscope.json')) as merged_file:
+            profile = json.load(merged_file)
+        self.assertEqual(profile['shared']['frames'], [{'name': 'main'}, {'name': 'search'}])
+        self.assertEqual(profile['profiles'][0]['weights'], [10])
+
+
+class LoadCitiesCommandTestCase(TestCase):
+    """Tests for load_cities management command"""
+
+    def setUp(self):
+        City.objects.create(id=1, name='Stale', country='XX')
+        self.cities = [
+            {'id': 2950159, 'name': 'Berlin', 'state': '', 'country': 'DE', 'coord': {'lon': 13.41, 'lat': 52.52}},
+            {'id': 2643743, 'name': 'London', 'country': 'GB', 'coord': {}, 'stat': {'population': 7556900}},
+        ]
+
+    def test_handle_replace_catalog_with_gzipped_city_list(self):
+        """handle: replace the city catalog with cities from a gzipped city list"""
+        # given
+        with tempfile.NamedTemporaryFile(suffix='.json.gz') as source:
+            source.write(gzip.compress(json.dumps(self.cities).encode()))
+            source.flush()
+            # when
+            call_command('load_cities', source.name, stdout=StringIO())
+        # then
+        self.assertQuerysetEqual(
+            City.objects.order_by('id').values_list('id', 'name', 'country', 'population', 'latitude'),
+            [(2643743, 'London', 'GB', 7556900, None), (2950159, 'Berlin', 'DE', 0, 52.52)],
+            transform=tuple,
+        )
@@ -0,0 +1,226 @@
+import asyncio
+import json
+from http import HTTPStatus
+from unittest import mock
+
+import httpx
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.test import SimpleTestCase
+from django.test import override_settings
+from django.utils.translation import ugettext_lazy as _
+
+from api.v1.async_views import AsyncForecastView
+from api.v1.async_views import AsyncWeatherDetailsView
+from api.v1.caching import CacheEntry
+from api.v1.exceptions import BudgetExceededError
+
+OPEN_WEATHER_MAP_RESPONSE = {
+    'id': 1,
+    'weather': [{'id': 801, 'main': 'Clouds', 'description': 'few clouds', 'icon': '02n'}],
+    'main': {'temp': 32, 'feels_like': 38.18, 'temp_min': 32, 'temp_max': 33, 'pressure': 997, 'humidity': 79},
+    'wind': {'speed': 3.1, 'deg': 150},
+    'name': 'Dubai',
+}
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    WEATHER_LANGUAGE_NEUTRAL_CACHE=True,
+)
+class AsyncWeatherDetailsViewTestCase(SimpleTestCase):
+    """ Tests for AsyncWeatherDetailsView """
+
+    def setUp(self):
+        cache.clear()
+        self.view = AsyncWeatherDetailsView.as_view()
+        self.request = RequestFactory().get('/api/v1/weather/1/')
+        self.upstream_calls = []
+        patcher = mock.patch('api.v1.clients.async_session_pool')
+        self.mock_session_pool = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def mock_upstream(self, status=HTTPStatus.OK, delay=0):
+        """Answer upstream requests with given status after given delay"""
+
+        async def handler(request):
+            self.upstream_calls.append(str(request.url))
+            await asyncio.sleep(delay)
+            return httpx.Response(status, json=OPEN_WEATHER_MAP_RESPONSE)
+
+        self.mock_session_pool.get_client.side_effect = lambda: httpx.AsyncClient(
+            transport=httpx.MockTransport(handler)
+        )
+
+    def test_view_is_async(self):
+        """as_view: return a view recognized as async by django"""
+        # when/then
+        self.assertTrue(asyncio.iscoroutinefunction(self.view))
+
+    def test_get_return_validation_error_for_invalid_language(self):
+        """get: return validation error if the language is not valid"""
+        # given
+        request = RequestFactory().get('/api/v1/weather/1/', {'language': 'invalid'})
+        # when
+        response = async_to_sync(self.view)(request, city_id=1)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('language', json.loads(response.content)['error'])
+
+    def test_get_return_data_from_api_and_cache_result(self):
+        """get: return weather data from the api and store it in cache"""
+        # given
+        self.mock_upstream()
+        # when
+        response = async_to_sync(self.view)(self.request, city_id=1)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        data = json.loads(response.content)
+        self.assertEqual(data['city'], 'Dubai')
+        self.assertEqual(data['wind'], {'speed': '3.1 m/s', 'direction': 'South-southeast'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(self.upstream_calls), 1)
+        self.assertIn('weather?id=1&lang=en', self.upstream_calls[0])
+        self.assertIsInstance(cache.get('weather_record:1', version=1), CacheEntry)
+
+    def test_get_return_data_from_cache(self):
+        """get: return entries stored by the sync views without calling the api"""
+        # given
+        self.mock_upstream()
+        record = {
+            'city': 'Berlin',
+            'condition': 800,
+            'description': 'clear sky',
+            'temperature': {'average': '20°C', 'min': '19°C', 'max': '21°C'},
+            'pressure': '1012 hPa',
+            'humidity': '40%',
+            'wind': {'speed': '1.5 m/s', 'degree': 0},
+        }
+        cache.set('weather_record:1', CacheEntry(record, soft_timeout=600, hard_timeout=3600), version=1)
+        # when
+        response = async_to_sync(self.view)(self.request, city_id=1)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(json.loads(response.content)['city'], 'Berlin')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.upstream_calls, [])
+
+    @override_settings(API_CACHE_ENCODED_RESPONSES=True)
+    def test_get_return_encoded_response_from_cache(self):
+        """get: cache the rendered body of a fetched response and return it as is on the next request"""
+        # given
+        self.mock_upstream()
+        miss = async_to_sync(self.view)(self.request, city_id=1)
+        # when
+        hit = async_to_sync(self.view)(self.request, city_id=1)
+        # then
+        self.assertEqual(hit['X-Cache'], 'HIT')
+        self.assertEqual(hit.content, miss.content)
+        self.assertEqual(json.loads(hit.content)['city'], 'Dubai')
+        self.assertEqual(cache.get('weather_body:en:1', version=1).data, miss.content)
+        self.assertEqual(len(self.upstream_calls), 1)
+
+    def test_get_return_not_modified_for_matching_etag(self):
+        """get: return 304 if the client has the current version of the response"""
+        # given
+        self.mock_upstream()
+        response = async_to_sync(self.view)(self.request, city_id=1)
+        request = RequestFactory().get('/api/v1/weather/1/', HTTP_IF_NONE_MATCH=response['ETag'])
+        # when
+        not_modified = async_to_sync(self.view)(request, city_id=1)
+        # then
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified['X-Cache'], 'HIT')
+        self.assertIn('max-age=', not_modified['Cache-Control'])
+
+    def test_get_return_error_message_if_external_api_fails(self):
+        """get: return error message if external api fails"""
+        # given
+        self.mock_upstream(status=HTTPStatus.SERVICE_UNAVAILABLE)
+        # when
+        response = async_to_sync(self.view)(self.request, city_id=1)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.assertEqual(json.loads(response.content)['error'], _('Something went wrong! Please try again later'))
+
+    @override_settings(OPEN_WEATHER_API_RETRIES=1, OPEN_WEATHER_API_RETRY_BACKOFF=0)
+    def test_get_retry_gateway_error(self):
+        """get: retry the upstream call once if a gateway failed it"""
+        # given
+        self.mock_upstream(status=HTTPStatus.SERVICE_UNAVAILABLE)
+        # when
+        response = async_to_sync(self.view)(self.request, city_id=1)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.assertEqual(len(self.upstream_calls), 2)
+
+    @mock.patch('api.v1.clients.rate_budget')
+    def test_get_return_service_unavailable_without_call_budget(self, mock_rate_budget):
+        """get: return 503 with Retry-After without calling the api if the call budget has no token left"""
+        # given
+        self.mock_upstream()
+        mock_rate_budget.acquire.side_effect = BudgetExceededError('weather', retry_after=3)
+        # when
+        response = async_to_sync(self.view)(self.request, city_id=1)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(self.upstream_calls, [])
+
+    def test_get_coalesce_concurrent_cache_misses(self):
+        """get: concurrent requests for the same city share one upstream call"""
+        # given
+        self.mock_upstream(delay=0.05)
+
+        async def get_many():
+            return await asyncio.gather(*[self.view(self.request, city_id=1) for _ in range(10)])
+
+        # when
+        responses = async_to_sync(get_many)()
+        # then
+        self.assertEqual({response.status_code for response in responses}, {HTTPStatus.OK})
+        self.assertEqual(len(self.upstream_calls), 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AsyncForecastViewTestCase(SimpleTestCase):
+    """ Tests for AsyncForecastView """
+
+    def setUp(self):
+        cache.clear()
+        self.view = AsyncForecastView.as_view()
+        self.request = RequestFactory().get('/api/v1/forecast/1/')
+        self.upstream_calls = []
+        patcher = mock.patch('api.v1.clients.async_session_pool')
+        mock_session_pool = patcher.start()
+        self.addCleanup(patcher.stop)
+        forecast = {
+            'list': [
+                dict(OPEN_WEATHER_MAP_RESPONSE, dt=1596564000 + index * 10800) for index in range(40)
+            ],
+            'city': {'id': 1, 'name': 'Dubai', 'timezone': 14400},
+        }
+
+        async def handler(request):
+            self.upstream_calls.append(str(request.url))
+            return httpx.Response(HTTPStatus.OK, json=forecast)
+
+        mock_session_pool.get_client.side_effect = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_get_return_forecast_from_api_then_from_cache(self):
+        """get: cache the packed forecast of the api and translate it again on the next request"""
+        # given
+        miss = async_to_sync(self.view)(self.request, city_id=1)
+        # when
+        hit = async_to_sync(self.view)(self.request, city_id=1)
+        # then
+        self.assertEqual((miss['X-Cache'], hit['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(hit.content, miss.content)
+        data = json.loads(hit.content)
+        self.assertEqual(len(data['days']), 6)
+        self.assertEqual(len(data['steps']), 40)
+        self.assertIsInstance(cache.get('forecast:1', version=1).data, bytes)
+        self.assertEqual(len(self.upstream_calls), 1)
+        self.assertIn('forecast?id=1', self.upstream_calls[0])
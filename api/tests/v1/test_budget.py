@@ -0,0 +1,128 @@
+from unittest import mock
+
+import fakeredis
+import redis
+from django.test import SimpleTestCase
+from django.test import override_settings
+
+from api.v1.budget import RateBudget
+from api.v1.exceptions import BudgetExceededError
+
+
+@override_settings(
+    OPEN_WEATHER_API_RATE_BUDGET=True,
+    OPEN_WEATHER_API_CALLS_PER_MINUTE=60,
+    OPEN_WEATHER_API_BURST=10,
+    OPEN_WEATHER_API_PRIORITY_RESERVES={'weather': 0, 'autocomplete': 0.2, 'prewarm': 0.5},
+)
+class RateBudgetTestCase(SimpleTestCase):
+    """ Tests for RateBudget """
+
+    def setUp(self):
+        self.budget = RateBudget(key='budget')
+        patcher = mock.patch('api.v1.budget.get_redis_client')
+        self.mock_get_redis_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis = self.mock_get_redis_client.return_value
+        self.script = self.redis.register_script.return_value
+
+    def test_acquire_take_token_of_shared_bucket(self):
+        """acquire: take a token, refilling the bucket at the calls per minute"""
+        # given
+        self.script.return_value = [1, b'7.5', b'0']
+        # when
+        self.budget.acquire('autocomplete')
+        # then
+        self.script.assert_called_once_with(
+            keys=['budget', mock.ANY, 'budget:window'],
+            args=[10, 1.0, 2.0, 'autocomplete', 60, mock.ANY],
+            client=self.redis,
+        )
+        self.assertRegex(self.script.call_args[1]['keys'][1], r'^budget:usage:\d+$')
+
+    @override_settings(OPEN_WEATHER_API_BURST=60)
+    def test_acquire_refill_at_calls_per_minute_if_burst_is_calls_per_minute(self):
+        """acquire: refill the bucket at the calls per minute when the whole minute can be used at once"""
+        # given
+        self.script.return_value = [1, b'59.0', b'0']
+        # when
+        self.budget.acquire('weather')
+        # then
+        self.script.assert_called_once_with(
+            keys=['budget', mock.ANY, 'budget:window'], args=[60, 1.0, 0, 'weather', 60, mock.ANY], client=self.redis
+        )
+
+    @override_settings(OPEN_WEATHER_API_BURST=60)
+    @mock.patch('time.time')
+    def test_acquire_never_allow_more_than_calls_per_minute_in_60_seconds(self, mock_time):
+        """acquire: keep the calls of any 60 seconds within the calls per minute, burst included"""
+        # given
+        self.mock_get_redis_client.return_value = fakeredis.FakeRedis()
+        allowed = []
+        # when
+        for step in range(4 * 180):
+            mock_time.return_value = 1000 + step / 4
+            try:
+                self.budget.acquire('weather')
+            except BudgetExceededError:
+                continue
+            allowed.append(mock_time.return_value)
+        # then
+        self.assertEqual(max(len([call for call in allowed if start <= call < start + 60]) for start in allowed), 60)
+        self.assertGreaterEqual(len(allowed), 3 * 60 - 1)
+
+    def test_acquire_raise_error_until_window_of_calls_per_minute_has_room(self):
+        """acquire: raise BudgetExceededError with the seconds until the oldest call of the window is 60s old"""
+        # given
+        self.script.return_value = [0, b'8.0', b'12.5']
+        # when/then
+        with self.assertRaises(BudgetExceededError) as context:
+            self.budget.acquire('weather')
+        self.assertEqual(context.exception.retry_after, 13)
+
+    def test_acquire_raise_error_if_reserve_of_higher_priorities_reached(self):
+        """acquire: raise BudgetExceededError with the seconds until a token is available for the priority"""
+        # given
+        self.script.return_value = [0, b'4.5', b'0']
+        # when/then
+        with self.assertRaises(BudgetExceededError) as context:
+            self.budget.acquire('prewarm')
+        self.assertEqual(context.exception.priority, 'prewarm')
+        self.assertEqual(context.exception.retry_after, 2)
+
+    def test_acquire_allow_call_if_redis_fails(self):
+        """acquire: allow the call if the budget can not be checked"""
+        # given
+        self.script.side_effect = redis.ConnectionError
+        # when/then
+        self.budget.acquire('weather')
+
+    @override_settings(OPEN_WEATHER_API_RATE_BUDGET=False)
+    def test_acquire_do_nothing_if_disabled(self):
+        """acquire: allow every call if the budget is disabled"""
+        # when
+        self.budget.acquire('weather')
+        # then
+        self.mock_get_redis_client.assert_not_called()
+
+    def test_get_usage_return_tokens_and_calls_by_priority(self):
+        """get_usage: return the refilled tokens left and the calls of the minute by priority"""
+        # given
+        self.redis.hmget.return_value = [b'2.0', b'995.0']
+        self.redis.hgetall.return_value = {b'weather:allowed': b'12', b'prewarm:denied': b'3'}
+        # when
+        actual = self.budget.get_usage(now=1000)
+        # then
+        self.assertEqual(
+            actual,
+            {
+                'tokens': 7.0,
+                'capacity': 10,
+                'calls': {
+                    'weather': {'allowed': 12, 'denied': 0},
+                    'autocomplete': {'allowed': 0, 'denied': 0},
+                    'prewarm': {'allowed': 0, 'denied': 3},
+                },
+            },
+        )
+        self.redis.hgetall.assert_called_once_with('budget:usage:16')
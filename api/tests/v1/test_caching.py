@@ -0,0 +1,98 @@
+import pickle
+
+from django.test import SimpleTestCase
+
+from api.v1.caching import CacheEntry
+from api.v1.caching import compute_etag
+from api.v1.caching import etag_matches
+from api.v1.caching import get_cache_control
+
+
+class CacheEntryTestCase(SimpleTestCase):
+    """Tests for CacheEntry"""
+
+    def test_is_stale_return_false_before_soft_expiry(self):
+        """is_stale: return False before the soft timeout has passed"""
+        # given
+        entry = CacheEntry({'city': 'Berlin'}, soft_timeout=600, hard_timeout=3600, now=0)
+        # when/then
+        self.assertFalse(entry.is_stale(now=599))
+
+    def test_is_stale_return_true_after_soft_expiry(self):
+        """is_stale: return True once the soft timeout has passed"""
+        # given
+        entry = CacheEntry({'city': 'Berlin'}, soft_timeout=600, hard_timeout=3600, now=0)
+        # when/then
+        self.assertTrue(entry.is_stale(now=600))
+
+    def test_hard_expiry_is_never_before_soft_expiry(self):
+        """CacheEntry: hard expiry is at least the soft expiry"""
+        # when
+        entry = CacheEntry({'city': 'Berlin'}, soft_timeout=600, hard_timeout=60, now=0)
+        # then
+        self.assertEqual(entry.hard_expiry, 600)
+
+    def test_pickle_round_trip(self):
+        """CacheEntry: survive pickling through the cache backend"""
+        # given
+        entry = CacheEntry({'city': 'Berlin'}, soft_timeout=600, hard_timeout=3600, now=0)
+        # when
+        actual = pickle.loads(pickle.dumps(entry))
+        # then
+        self.assertEqual(actual.data, {'city': 'Berlin'})
+        self.assertEqual((actual.soft_expiry, actual.hard_expiry), (600, 3600))
+        self.assertEqual(actual.etag, entry.etag)
+
+    def test_unpickle_entry_cached_without_etag(self):
+        """CacheEntry: compute the ETag of entries cached before it was stored with them"""
+        # given
+        entry = CacheEntry.__new__(CacheEntry)
+        # when
+        entry.__setstate__(({'city': 'Berlin'}, 600, 3600))
+        # then
+        self.assertEqual(entry.etag, compute_etag({'city': 'Berlin'}))
+
+    def test_get_cache_control_follow_remaining_lifetime(self):
+        """get_cache_control: fresh until the soft expiry, revalidated in the background until the hard expiry"""
+        # given
+        entry = CacheEntry({'city': 'Berlin'}, soft_timeout=600, hard_timeout=3600, now=0)
+        # when/then
+        self.assertEqual(entry.get_cache_control(now=100), 'public, max-age=500, stale-while-revalidate=3000')
+        self.assertEqual(entry.get_cache_control(now=1000), 'public, max-age=0, stale-while-revalidate=2600')
+        self.assertEqual(entry.get_cache_control(now=4000), 'public, max-age=0, stale-while-revalidate=0')
+
+
+class ETagTestCase(SimpleTestCase):
+    """Tests for compute_etag, etag_matches and get_cache_control"""
+
+    def test_compute_etag_ignore_key_order(self):
+        """compute_etag: return the same ETag for equal data"""
+        # when/then
+        self.assertEqual(compute_etag({'a': 1, 'b': [1, 2]}), compute_etag({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(compute_etag({'a': 1}), compute_etag({'a': 2}))
+
+    def test_compute_etag_hash_encoded_body(self):
+        """compute_etag: hash encoded response bodies as they are"""
+        # when/then
+        self.assertEqual(compute_etag(b'{"a":1}'), compute_etag(b'{"a":1}'))
+        self.assertNotEqual(compute_etag(b'{"a":1}'), compute_etag(b'{"a": 1}'))
+
+    def test_etag_matches(self):
+        """etag_matches: match quoted, weak, listed and wildcard tags"""
+        for if_none_match, expected in (
+            (None, False),
+            ('', False),
+            ('"abc"', True),
+            ('W/"abc"', True),
+            ('"other", "abc"', True),
+            ('*', True),
+            ('"other"', False),
+            ('abc', False),
+        ):
+            with self.subTest(if_none_match=if_none_match):
+                self.assertEqual(etag_matches(if_none_match, '"abc"'), expected)
+
+    def test_get_cache_control_round_down(self):
+        """get_cache_control: never promise more freshness than left"""
+        # when/then
+        self.assertEqual(get_cache_control(10.9, 20.5, now=0.5), 'public, max-age=10, stale-while-revalidate=9')
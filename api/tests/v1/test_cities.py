@@ -0,0 +1,196 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import override_settings
+
+from api.models import City
+from api.models import CityName
+from api.v1.cities import CityIndex
+from api.v1.cities import MappedCityIndex
+from api.v1.cities import get_city_index
+from api.v1.cities import normalize_city_name
+from api.v1.cities import reset_city_indexes
+
+CITIES = [
+    (2950159, 'Berlin', 'DE', 3426354),
+    (5083330, 'Berlin', 'US', 10051),
+    (2950158, 'Berlin Köpenick', 'DE', 0),
+    (2825297, 'Bernau', 'DE', 36000),
+    (2643743, 'London', 'GB', 7556900),
+]
+
+
+class NormalizeCityNameTestCase(SimpleTestCase):
+    """Tests for normalize_city_name"""
+
+    def test_normalize_city_name_return_case_folded_name(self):
+        """normalize_city_name: case fold and collapse whitespace"""
+        # when/then
+        self.assertEqual(normalize_city_name('  New   YORK '), 'new york')
+
+    def test_normalize_city_name_fold_accents(self):
+        """normalize_city_name: fold accents and special letters to their base letters"""
+        # when/then
+        self.assertEqual(normalize_city_name('München'), 'munchen')
+        self.assertEqual(normalize_city_name('Łódź'), 'lodz')
+        self.assertEqual(normalize_city_name('Saint-Étienne'), 'saint etienne')
+        self.assertEqual(normalize_city_name('Straße'), 'strasse')
+
+
+class CityIndexTestCase(SimpleTestCase):
+    """Tests for CityIndex"""
+
+    def setUp(self):
+        self.index = CityIndex(CITIES)
+
+    def test_search_return_cities_starting_with_query(self):
+        """search: return cities whose name starts with query, exact matches by population first"""
+        # given
+        expected = [
+            {'id': 2950159, 'name': 'Berlin, DE'},
+            {'id': 5083330, 'name': 'Berlin, US'},
+            {'id': 2950158, 'name': 'Berlin Köpenick, DE'},
+        ]
+        # when
+        actual = self.index.search('berlin', limit=3)
+        # then
+        self.assertListEqual(actual, expected)
+
+    def test_search_rank_by_population(self):
+        """search: rank prefix matches by population"""
+        # when
+        actual = self.index.search('BER', limit=2)
+        # then
+        self.assertListEqual(actual, [{'id': 2950159, 'name': 'Berlin, DE'}, {'id': 2825297, 'name': 'Bernau, DE'}])
+
+    def test_search_ignore_accents(self):
+        """search: match names regardless of accents"""
+        # when
+        actual = self.index.search('berlin kopenick', limit=1)
+        # then
+        self.assertListEqual(actual, [{'id': 2950158, 'name': 'Berlin Köpenick, DE'}])
+
+    def test_search_return_similar_names_for_typos(self):
+        """search: return cities with similar names if no name starts with the query"""
+        # when
+        actual = self.index.search('Lodnon')
+        # then
+        self.assertEqual(actual[0], {'id': 2643743, 'name': 'London, GB'})
+
+    def test_search_return_each_city_once(self):
+        """search: return a city matching by several names once"""
+        # given
+        index = CityIndex(CITIES + [(2950159, 'Berlino', 'DE', 3426354)])
+        # when
+        actual = index.search('berl', limit=3)
+        # then
+        self.assertListEqual([city['id'] for city in actual], [2950159, 5083330, 2950158])
+
+    def test_search_return_empty_list_for_unknown_city(self):
+        """search: return empty list if no city matches"""
+        # when/then
+        self.assertListEqual(self.index.search('paris'), [])
+        self.assertListEqual(self.index.search('  '), [])
+
+
+class MappedCityIndexTestCase(SimpleTestCase):
+    """Tests for MappedCityIndex"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'city_index.en.bin')
+        MappedCityIndex.write(self.path, CITIES)
+        self.index = MappedCityIndex(self.path)
+
+    def test_search_return_same_results_as_in_memory_index(self):
+        """search: return the same cities as the in-memory index"""
+        # given
+        in_memory_index = CityIndex(CITIES)
+        # when/then
+        self.assertEqual(len(self.index), len(CITIES))
+        for query in ('b', 'Berlin', 'berlin k', 'bern', 'lon', 'Lodnon', 'Bernua', 'paris'):
+            self.assertListEqual(self.index.search(query), in_memory_index.search(query))
+
+    def test_write_replace_index_file_atomically(self):
+        """write: replace the file with a new inode so that mapped indexes stay valid"""
+        # when
+        MappedCityIndex.write(self.path, CITIES[:1])
+        # then
+        self.assertListEqual(self.index.search('london'), [{'id': 2643743, 'name': 'London, GB'}])
+        self.assertListEqual(MappedCityIndex(self.path).search('london'), [])
+        self.assertListEqual(os.listdir(os.path.dirname(self.path)), ['city_index.en.bin'])
+
+    def test_init_raise_error_for_incompatible_file(self):
+        """__init__: raise ValueError if the file is not a city index"""
+        # given
+        with open(self.path, 'wb') as index_file:
+            index_file.write(b'not an index file' * 4)
+        # when/then
+        with self.assertRaises(ValueError):
+            MappedCityIndex(self.path)
+
+
+class GetCityIndexTestCase(TestCase):
+    """Tests for get_city_index"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'city_index.{language}.bin')
+        settings_override = override_settings(CITY_INDEX_PATH=self.path, CITY_INDEX_CHECK_INTERVAL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_city_indexes()
+        self.addCleanup(reset_city_indexes)
+        City.objects.bulk_create(
+            City(id=city_id, name=name, country=country, population=population)
+            for city_id, name, country, population in CITIES
+        )
+
+    def test_get_city_index_build_index_from_database_once(self):
+        """get_city_index: build the index of each language from the catalog once"""
+        # when
+        with mock.patch.object(CityIndex, 'from_database', wraps=CityIndex.from_database) as mock_from_database:
+            index = get_city_index('en')
+            same_index = get_city_index('en')
+            other_index = get_city_index('de')
+        # then
+        self.assertEqual(len(index), 5)
+        self.assertIs(index, same_index)
+        self.assertIsNot(index, other_index)
+        mock_from_database.assert_has_calls([mock.call('en'), mock.call('de')])
+        self.assertEqual(mock_from_database.call_count, 2)
+
+    def test_get_city_index_include_localized_names(self):
+        """get_city_index: find cities by their localized names in the requested language only"""
+        # given
+        City.objects.create(id=2867714, name='München', country='DE', population=1260391)
+        CityName.objects.bulk_create(
+            [
+                CityName(city_id=2867714, language='en', name='Munich'),
+                CityName(city_id=2867714, language='de', name='München'),
+                CityName(city_id=2867714, language='fr', name='Munich'),
+            ]
+        )
+        # when/then
+        self.assertListEqual(get_city_index('en').search('munich'), [{'id': 2867714, 'name': 'Munich, DE'}])
+        self.assertListEqual(get_city_index('en').search('Munchen'), [{'id': 2867714, 'name': 'München, DE'}])
+        self.assertEqual(len(get_city_index('de')), 6)
+
+    def test_get_city_index_map_prebuilt_index_file(self):
+        """get_city_index: map the prebuilt index file and pick up a replaced file"""
+        # given
+        MappedCityIndex.write(self.path.format(language='en'), CITIES[:2])
+        index = get_city_index('en')
+        # when
+        MappedCityIndex.write(self.path.format(language='en'), CITIES)
+        new_index = get_city_index('en')
+        # then
+        self.assertIsInstance(index, MappedCityIndex)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(len(new_index), 5)
+        self.assertIs(get_city_index('en'), new_index)
@@ -3,9 +3,15 @@ from unittest.mock import Mock
 
 import requests
 from django.test import SimpleTestCase
+from django.test import override_settings
 
 from api.v1.clients import OpenWeatherMapCityClient
+from api.v1.clients import OpenWeatherMapForecastClient
+from api.v1.clients import OpenWeatherMapGroupRecordClient
 from api.v1.clients import OpenWeatherMapWeatherClient
+from api.v1.clients import OpenWeatherMapWeatherRecordClient
+from api.v1.exceptions import BudgetExceededError
+from api.v1.exceptions import CircuitOpenError
 from api.v1.exceptions import ExternalAPIError
 
 
@@ -29,25 +35,36 @@ class OpenWeatherMapWeatherClientTestCase(SimpleTestCase):
         # then
         self.assertEqual(actual, expected)
 
-    @mock.patch('api.v1.clients.WeatherResponseSchema')
-    def test_get_serialized_data_return_serialized_data(self, mock_serializer_class):
+    @mock.patch('api.v1.clients.transform_weather_response')
+    def test_get_serialized_data_return_serialized_data(self, mock_transform):
         """get_serialized_data: serialize data returned from openweather api"""
         # given
         expected = {'city': 'Dubai'}
-        mock_serializer_class().dump.return_value = expected
+        mock_transform.return_value = expected
         # when
         actual = self.client.get_serialized_data(data={'name': 'Dubai'})
         # then
         self.assertDictEqual(actual, expected)
 
     @mock.patch.object(OpenWeatherMapWeatherClient, 'get_url')
-    @mock.patch('api.v1.clients.requests')
-    def test_get_data_raise_exception_for_api_error(self, mock_requests, mock_get_url):
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_raise_exception_for_api_error(self, mock_session_pool, mock_get_url):
         """get_data: raise ExternalAPIError if api return non-200 response"""
         # given
         mock_response = Mock()
         mock_response.raise_for_status.side_effect = requests.RequestException
-        mock_requests.get.return_value = mock_response
+        mock_session_pool.session().__enter__().get.return_value = mock_response
+        mock_get_url.return_value = 'http://testurl'
+        # when / then
+        with self.assertRaises(ExternalAPIError):
+            self.client.get_data(city_id=1)
+
+    @mock.patch.object(OpenWeatherMapWeatherClient, 'get_url')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_raise_exception_for_connection_error(self, mock_session_pool, mock_get_url):
+        """get_data: raise ExternalAPIError if api is not reachable"""
+        # given
+        mock_session_pool.session().__enter__().get.side_effect = requests.ConnectionError
         mock_get_url.return_value = 'http://testurl'
         # when / then
         with self.assertRaises(ExternalAPIError):
@@ -55,15 +72,15 @@ class OpenWeatherMapWeatherClientTestCase(SimpleTestCase):
 
     @mock.patch.object(OpenWeatherMapWeatherClient, 'get_serialized_data')
     @mock.patch.object(OpenWeatherMapWeatherClient, 'get_url')
-    @mock.patch('api.v1.clients.requests')
-    def test_get_data_return_serialized_data(self, mock_requests, mock_get_url, mock_get_serialized_data):
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_return_serialized_data(self, mock_session_pool, mock_get_url, mock_get_serialized_data):
         """get_data: fetch data from external api and return serialized data"""
         # given
         expected = {'city': 'Dubai'}
         mock_response = Mock()
         mock_response.raise_for_status.return_value = None
         mock_response.json.return_value = {'name': 'Dubai'}
-        mock_requests.get.return_value = mock_response
+        mock_session_pool.session().__enter__().get.return_value = mock_response
         mock_get_url.return_value = 'http://testurl'
         mock_get_serialized_data.return_value = {'city': 'Dubai'}
         # when
@@ -71,6 +88,191 @@ class OpenWeatherMapWeatherClientTestCase(SimpleTestCase):
         # then
         self.assertDictEqual(actual, expected)
 
+    @mock.patch('api.v1.clients.rate_budget')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_skip_call_without_budget(self, mock_session_pool, mock_rate_budget):
+        """get_data: raise BudgetExceededError without calling the api if the call budget has no token left"""
+        # given
+        mock_rate_budget.acquire.side_effect = BudgetExceededError('weather', retry_after=1)
+        # when / then
+        with self.assertRaises(BudgetExceededError):
+            self.client.get_data(city_id=1)
+        mock_rate_budget.acquire.assert_called_once_with('weather')
+        mock_session_pool.session.assert_not_called()
+
+    @mock.patch('api.v1.clients.circuit_breaker')
+    @mock.patch('api.v1.clients.rate_budget')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_release_probe_without_budget(self, mock_session_pool, mock_rate_budget, mock_circuit_breaker):
+        """get_data: let another call probe the half-open circuit if the probe call has no budget"""
+        # given
+        mock_circuit_breaker.before_call.return_value = True
+        mock_rate_budget.acquire.side_effect = BudgetExceededError('weather', retry_after=1)
+        # when / then
+        with self.assertRaises(BudgetExceededError):
+            self.client.get_data(city_id=1)
+        mock_circuit_breaker.release_probe.assert_called_once_with(True)
+        mock_circuit_breaker.record_success.assert_not_called()
+
+    @mock.patch('api.v1.clients.rate_budget')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_drain_budget_if_api_rate_limited(self, mock_session_pool, mock_rate_budget):
+        """get_data: empty the call budget if openweathermap answers 429"""
+        # given
+        mock_response = Mock(status_code=429)
+        mock_response.raise_for_status.side_effect = requests.HTTPError
+        mock_session_pool.session().__enter__().get.return_value = mock_response
+        # when / then
+        with self.assertRaises(ExternalAPIError):
+            self.client.get_data(city_id=1)
+        mock_rate_budget.drain.assert_called_once_with()
+
+    @override_settings(OPEN_WEATHER_API_RETRIES=1)
+    @mock.patch('api.v1.clients.time.sleep')
+    @mock.patch('api.v1.clients.circuit_breaker')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_retry_connection_error(self, mock_session_pool, mock_circuit_breaker, mock_sleep):
+        """get_data: retry a call that could not reach the api after a jittered backoff"""
+        # given
+        mock_circuit_breaker.before_call.return_value = False
+        mock_response = Mock(status_code=200)
+        mock_response.json.return_value = {'name': 'Dubai'}
+        mock_session_pool.session().__enter__().get.side_effect = [requests.ConnectionError, mock_response]
+        # when
+        with mock.patch.object(OpenWeatherMapWeatherClient, 'get_serialized_data', return_value={'city': 'Dubai'}):
+            actual = self.client.get_data(city_id=1)
+        # then
+        self.assertEqual(actual, {'city': 'Dubai'})
+        mock_sleep.assert_called_once()
+        mock_circuit_breaker.record_success.assert_called_once_with(False)
+        mock_circuit_breaker.record_failure.assert_not_called()
+
+    @override_settings(OPEN_WEATHER_API_RETRIES=1)
+    @mock.patch('api.v1.clients.time.sleep')
+    @mock.patch('api.v1.clients.circuit_breaker')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_record_failure_after_retries(self, mock_session_pool, mock_circuit_breaker, mock_sleep):
+        """get_data: count a failure in the circuit breaker once the retries failed"""
+        # given
+        mock_circuit_breaker.before_call.return_value = True
+        mock_response = Mock(status_code=503)
+        mock_response.raise_for_status.side_effect = requests.HTTPError(response=mock_response)
+        mock_session_pool.session().__enter__().get.return_value = mock_response
+        # when / then
+        with self.assertRaises(ExternalAPIError):
+            self.client.get_data(city_id=1)
+        self.assertEqual(mock_session_pool.session().__enter__().get.call_count, 2)
+        mock_circuit_breaker.record_failure.assert_called_once_with(True)
+
+    @override_settings(OPEN_WEATHER_API_RETRIES=1)
+    @mock.patch('api.v1.clients.circuit_breaker')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_do_not_retry_client_error(self, mock_session_pool, mock_circuit_breaker):
+        """get_data: neither retry nor count as a failure an error caused by the request, eg: unknown city"""
+        # given
+        mock_response = Mock(status_code=404)
+        mock_response.raise_for_status.side_effect = requests.HTTPError(response=mock_response)
+        mock_session_pool.session().__enter__().get.return_value = mock_response
+        # when / then
+        with self.assertRaises(ExternalAPIError):
+            self.client.get_data(city_id=1)
+        mock_session_pool.session().__enter__().get.assert_called_once()
+        mock_circuit_breaker.record_failure.assert_not_called()
+
+    @mock.patch('api.v1.clients.circuit_breaker')
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_fail_fast_if_circuit_open(self, mock_session_pool, mock_circuit_breaker):
+        """get_data: raise CircuitOpenError without calling the api while the circuit is open"""
+        # given
+        mock_circuit_breaker.before_call.side_effect = CircuitOpenError(retry_after=5)
+        # when / then
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_data(city_id=1)
+        mock_session_pool.session.assert_not_called()
+
+
+class OpenWeatherMapWeatherRecordClientTestCase(SimpleTestCase):
+    """Test OpenWeatherMapWeatherRecordClient methods"""
+
+    def setUp(self):
+        self.client = OpenWeatherMapWeatherRecordClient(api_key='test-api-key')
+
+    @mock.patch('api.v1.clients.transform_weather_record')
+    def test_get_serialized_data_return_weather_record(self, mock_transform):
+        """get_serialized_data: serialize data returned from openweather api as language neutral record"""
+        # given
+        expected = {'city': 'Dubai', 'condition': 801}
+        mock_transform.return_value = expected
+        # when
+        actual = self.client.get_serialized_data(data={'name': 'Dubai'})
+        # then
+        self.assertDictEqual(actual, expected)
+
+
+class OpenWeatherMapGroupRecordClientTestCase(SimpleTestCase):
+    """Test OpenWeatherMapGroupRecordClient methods"""
+
+    def setUp(self):
+        self.client = OpenWeatherMapGroupRecordClient(api_key='test-api-key')
+
+    def test_get_url(self):
+        """get_url: return group api url for all given city ids"""
+        # given
+        expected = (
+            'http://api.openweathermap.org/data/2.5/group?id=1,2,3&lang=en&appid=test-api-key&units=metric'
+        )
+        # when
+        actual = self.client.get_url(city_ids=[1, 2, 3])
+        # then
+        self.assertEqual(actual, expected)
+
+    def test_get_serialized_data_return_weather_records_by_city_id(self):
+        """get_serialized_data: serialize every city returned from openweather api as language neutral record"""
+        # given
+        data = {
+            'cnt': 1,
+            'list': [
+                {
+                    'id': 292223,
+                    'weather': [{'id': 801, 'main': 'Clouds', 'description': 'few clouds', 'icon': '02n'}],
+                    'main': {'temp': 32, 'temp_min': 32, 'temp_max': 33, 'pressure': 997, 'humidity': 79},
+                    'wind': {'speed': 3.1, 'deg': 150},
+                    'name': 'Dubai',
+                }
+            ],
+        }
+        # when
+        actual = self.client.get_serialized_data(data)
+        # then
+        self.assertEqual(list(actual), [292223])
+        self.assertEqual(actual[292223]['condition'], 801)
+        self.assertEqual(actual[292223]['wind'], {'speed': '3.1 m/s', 'degree': 150})
+
+
+class OpenWeatherMapForecastClientTestCase(SimpleTestCase):
+    """Test OpenWeatherMapForecastClient methods"""
+
+    def setUp(self):
+        self.client = OpenWeatherMapForecastClient(api_key='test-api-key')
+
+    def test_get_url(self):
+        """get_url: return language neutral forecast api url"""
+        # when
+        actual = self.client.get_url(city_id=1)
+        # then
+        self.assertEqual(
+            actual, 'http://api.openweathermap.org/data/2.5/forecast?id=1&appid=test-api-key&units=metric'
+        )
+
+    @mock.patch('api.v1.clients.Forecast')
+    def test_get_serialized_data_return_forecast(self, mock_forecast):
+        """get_serialized_data: hold the forecast returned from openweather api in columns"""
+        # when
+        actual = self.client.get_serialized_data(data={'list': []})
+        # then
+        self.assertIs(actual, mock_forecast.from_response.return_value)
+        mock_forecast.from_response.assert_called_once_with({'list': []})
+
 
 class OpenWeatherMapCityClientTestCase(SimpleTestCase):
     """Test OpenWeatherMapCityClient methods"""
@@ -91,25 +293,30 @@ class OpenWeatherMapCityClientTestCase(SimpleTestCase):
         # then
         self.assertEqual(actual, expected)
 
-    @mock.patch('api.v1.clients.CityListResponseSchema')
-    def test_get_serialized_data_return_serialized_data(self, mock_serializer_class):
+    def test_priority_is_autocomplete(self):
+        """priority: city searches take the autocomplete share of the call budget"""
+        # when/then
+        self.assertEqual(self.client.priority, 'autocomplete')
+
+    @mock.patch('api.v1.clients.transform_city_list')
+    def test_get_serialized_data_return_serialized_data(self, mock_transform):
         """get_serialized_data: serialize data returned from openweather api"""
         # given
         expected = {'city': 'Dubai'}
-        mock_serializer_class().dump.return_value = expected
+        mock_transform.return_value = expected
         # when
         actual = self.client.get_serialized_data(data={'list': [{'name': 'Dubai'}]})
         # then
         self.assertDictEqual(actual, expected)
 
     @mock.patch.object(OpenWeatherMapCityClient, 'get_url')
-    @mock.patch('api.v1.clients.requests')
-    def test_get_data_raise_exception_for_api_error(self, mock_requests, mock_get_url):
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_raise_exception_for_api_error(self, mock_session_pool, mock_get_url):
         """get_data: raise ExternalAPIError if api return non-200 response"""
         # given
         mock_response = Mock()
         mock_response.raise_for_status.side_effect = requests.RequestException
-        mock_requests.get.return_value = mock_response
+        mock_session_pool.session().__enter__().get.return_value = mock_response
         mock_get_url.return_value = 'http://testurl'
         # when / then
         with self.assertRaises(ExternalAPIError):
@@ -117,15 +324,15 @@ class OpenWeatherMapCityClientTestCase(SimpleTestCase):
 
     @mock.patch.object(OpenWeatherMapCityClient, 'get_serialized_data')
     @mock.patch.object(OpenWeatherMapCityClient, 'get_url')
-    @mock.patch('api.v1.clients.requests')
-    def test_get_data_return_serialized_data(self, mock_requests, mock_get_url, mock_get_serialized_data):
+    @mock.patch('api.v1.clients.session_pool')
+    def test_get_data_return_serialized_data(self, mock_session_pool, mock_get_url, mock_get_serialized_data):
         """get_data: fetch data from external api and return serialized data"""
         # given
         expected = [(100, 'Berlin, DE')]
         mock_response = Mock()
         mock_response.raise_for_status.return_value = None
         mock_response.json.return_value = {'list': [{'name': 'Berlin', 'id': 100, 'country': 'DE'}]}
-        mock_requests.get.return_value = mock_response
+        mock_session_pool.session().__enter__().get.return_value = mock_response
         mock_get_url.return_value = 'http://testurl'
         mock_get_serialized_data.return_value = expected
         # when
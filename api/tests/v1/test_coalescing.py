@@ -0,0 +1,156 @@
+import threading
+from unittest import mock
+from unittest.mock import Mock
+
+import fakeredis
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase
+from django.test import override_settings
+from django_redis.cache import RedisCache
+
+from api.v1.caching import CacheEntry
+from api.v1.coalescing import SingleFlight
+from api.v1.exceptions import ExternalAPIError
+
+
+@override_settings(CACHE_LEASE_WAIT=0.2, CACHE_LEASE_POLL_INTERVAL=0.01)
+class SingleFlightTestCase(SimpleTestCase):
+    """Tests for SingleFlight"""
+
+    def setUp(self):
+        self.cache = LocMemCache('coalescing', {})
+        self.cache.clear()
+        self.single_flight = SingleFlight()
+
+    def test_do_return_fetched_value_and_release_lease(self):
+        """do: fetch value and release the cache lease afterwards"""
+        # given
+        fetch = Mock(return_value={'city': 'Berlin'})
+        # when
+        actual = self.single_flight.do(self.cache, 'weather_data:en:1', 1, fetch)
+        # then
+        self.assertEqual(actual, {'city': 'Berlin'})
+        self.assertIsNone(self.cache.get('lease:weather_data:en:1', version=1))
+        self.assertEqual(self.single_flight.get_stats()['fetches'], 1)
+
+    def test_do_share_in_flight_result_between_threads(self):
+        """do: concurrent callers for the same key share one fetch"""
+        # given
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def fetch():
+            started.set()
+            release.wait(1)
+            return {'city': 'Berlin'}
+
+        def call():
+            results.append(self.single_flight.do(self.cache, 'weather_data:en:1', 1, fetch))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(1)
+        followers = [threading.Thread(target=call) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while self.single_flight.get_stats()['coalesced_local'] < 3:
+            pass
+        # when
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(1)
+        # then
+        self.assertEqual(results, [{'city': 'Berlin'}] * 4)
+        self.assertEqual(self.single_flight.get_stats(), {'fetches': 1, 'coalesced_local': 3, 'coalesced_remote': 0})
+
+    def test_do_raise_fetch_error(self):
+        """do: propagate errors raised while fetching"""
+        # given
+        fetch = Mock(side_effect=ExternalAPIError)
+        # when / then
+        with self.assertRaises(ExternalAPIError):
+            self.single_flight.do(self.cache, 'weather_data:en:1', 1, fetch)
+        self.assertIsNone(self.cache.get('lease:weather_data:en:1', version=1))
+
+    def test_do_wait_for_value_fetched_by_lease_holder(self):
+        """do: wait for the value cached by another process holding the lease"""
+        # given
+        fetch = Mock()
+        self.cache.add('lease:weather_data:en:1', 'other-process', version=1)
+        value = CacheEntry({'city': 'Berlin'}, soft_timeout=60, hard_timeout=120)
+        threading.Timer(0.05, self.cache.set, args=('weather_data:en:1', value), kwargs={'version': 1}).start()
+        # when
+        actual = self.single_flight.do(self.cache, 'weather_data:en:1', 1, fetch)
+        # then
+        self.assertEqual(actual.data, {'city': 'Berlin'})
+        fetch.assert_not_called()
+        self.assertEqual(self.single_flight.get_stats()['coalesced_remote'], 1)
+
+    def test_do_ignore_value_of_other_format_while_waiting(self):
+        """do: keep waiting while the key holds a value that is not a cache entry, then fetch it itself"""
+        # given
+        fetch = Mock(return_value=CacheEntry({'city': 'Berlin'}, soft_timeout=60, hard_timeout=120))
+        self.cache.add('lease:weather_data:en:1', 'other-process', version=1)
+        self.cache.set('weather_data:en:1', {'city': 'Berlin'}, version=1)
+        # when
+        actual = self.single_flight.do(self.cache, 'weather_data:en:1', 1, fetch)
+        # then
+        self.assertIs(actual, fetch.return_value)
+        fetch.assert_called_once_with()
+        self.assertEqual(self.single_flight.get_stats()['coalesced_remote'], 0)
+
+    def test_do_fetch_if_lease_is_not_released_in_time(self):
+        """do: fetch the value itself if the lease holder does not finish in time"""
+        # given
+        fetch = Mock(return_value={'city': 'Berlin'})
+        self.cache.add('lease:weather_data:en:1', 'other-process', version=1)
+        # when
+        actual = self.single_flight.do(self.cache, 'weather_data:en:1', 1, fetch)
+        # then
+        self.assertEqual(actual, {'city': 'Berlin'})
+        fetch.assert_called_once_with()
+
+    def test_do_many_fetch_unleased_keys_and_wait_for_the_others(self):
+        """do_many: fetch the keys nobody is fetching and wait for the entries of the keys leased by others"""
+        # given
+        entry = CacheEntry({'city': 'Berlin'}, soft_timeout=600, hard_timeout=3600)
+        fetch = Mock(return_value=({1: entry}, {}))
+        self.cache.add('lease:weather_record:2', 'other-process', version=1)
+        threading.Timer(0.05, self.cache.set, args=('weather_record:2', entry), kwargs={'version': 1}).start()
+        # when
+        values, errors = self.single_flight.do_many(
+            self.cache, {'weather_record:1': 1, 'weather_record:2': 2}, 1, fetch
+        )
+        # then
+        self.assertEqual({city_id: value.data for city_id, value in values.items()}, {1: entry.data, 2: entry.data})
+        fetch.assert_called_once_with([1])
+        self.assertIsNone(self.cache.get('lease:weather_record:1', version=1))
+        self.assertEqual(self.single_flight.get_stats(), {'fetches': 1, 'coalesced_local': 0, 'coalesced_remote': 1})
+
+    def test_release_keep_lease_taken_by_someone_else(self):
+        """release: only delete the leases still holding the claimed token"""
+        # given
+        leases = self.single_flight.claim(self.cache, ['weather_record:1', 'weather_record:2'], 1)
+        self.cache.set('lease:weather_record:2', 'other-process', version=1)
+        # when
+        self.single_flight.release(self.cache, leases, 1)
+        # then
+        self.assertIsNone(self.cache.get('lease:weather_record:1', version=1))
+        self.assertEqual(self.cache.get('lease:weather_record:2', version=1), 'other-process')
+
+    def test_release_compare_and_delete_leases_in_one_step_on_redis(self):
+        """release: check and delete the leases in a single redis script, keeping a lease taken by someone else"""
+        # given
+        cache = RedisCache('redis://localhost:6379/0', {})
+        cache.client._clients[0] = fakeredis.FakeRedis()
+        leases = self.single_flight.claim(cache, ['weather_record:1', 'weather_record:2'], 1)
+        cache.set('lease:weather_record:2', 'other-process', version=1)
+        with mock.patch.object(cache, 'get_many') as mock_get_many, mock.patch.object(cache, 'get') as mock_get:
+            # when
+            self.single_flight.release(cache, leases, 1)
+        # then
+        mock_get_many.assert_not_called()
+        mock_get.assert_not_called()
+        self.assertIsNone(cache.get('lease:weather_record:1', version=1))
+        self.assertEqual(cache.get('lease:weather_record:2', version=1), 'other-process')
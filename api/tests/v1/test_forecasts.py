@@ -0,0 +1,114 @@
+import json
+import pickle
+import sys
+from array import array
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.v1.forecasts import Forecast
+
+
+def get_step(timestamp, temperature, pressure=1000, humidity=50, degree=90):
+    return {
+        'dt': timestamp,
+        'main': {'temp': temperature, 'feels_like': temperature, 'temp_min': temperature, 'temp_max': temperature,
+                 'pressure': pressure, 'sea_level': pressure, 'grnd_level': pressure, 'humidity': humidity},
+        'weather': [{'id': 801, 'main': 'Clouds', 'description': 'few clouds', 'icon': '02n'}],
+        'clouds': {'all': 20},
+        'wind': {'speed': 3.1, 'deg': degree},
+        'visibility': 10000,
+        'pop': 0,
+        'sys': {'pod': 'n'},
+        'dt_txt': '2020-08-04 18:00:00',
+    }
+
+
+class ForecastTestCase(SimpleTestCase):
+    """Tests for Forecast"""
+
+    def setUp(self):
+        # 2020-08-04 18:00 to 2020-08-05 06:00 UTC, 22:00 to 10:00 in Dubai
+        self.data = {
+            'cod': '200',
+            'cnt': 5,
+            'list': [
+                get_step(1596564000, 30, pressure=996, humidity=70, degree=150),
+                get_step(1596574800, 28, pressure=998, humidity=80, degree=None),
+                get_step(1596585600, 27, pressure=999, humidity=81, degree=359.6),
+                get_step(1596596400, 29, pressure=1000, humidity=75),
+                get_step(1596607200, 35, pressure=1001, humidity=60),
+            ],
+            'city': {'id': 292223, 'name': 'Dubai', 'country': 'AE', 'timezone': 14400},
+        }
+        self.data['list'][1]['wind'].pop('deg')
+
+    def test_from_response_return_columns(self):
+        """from_response: hold every field of the steps in a typed array"""
+        # when
+        forecast = Forecast.from_response(self.data)
+        # then
+        self.assertEqual((forecast.city, forecast.timezone, len(forecast)), ('Dubai', 14400, 5))
+        self.assertEqual(forecast.temperatures, array('f', [30, 28, 27, 29, 35]))
+        self.assertEqual(forecast.wind_degrees, array('h', [150, -1, 0, 90, 90]))
+        self.assertEqual(forecast.conditions, array('H', [801] * 5))
+
+    def test_unpack_return_packed_forecast(self):
+        """unpack: return the forecast given to pack"""
+        # given
+        forecast = Forecast.from_response(self.data)
+        # when
+        actual = Forecast.unpack(forecast.pack())
+        # then
+        self.assertEqual(actual, forecast)
+        self.assertEqual(actual.city, 'Dubai')
+        self.assertEqual(actual.humidities, array('B', [70, 80, 81, 75, 60]))
+
+    def test_unpack_swap_bytes_of_other_byte_order(self):
+        """unpack: read forecasts packed on a machine of the other byte order"""
+        # given
+        forecast = Forecast.from_response(self.data)
+        packed = forecast.pack()
+        other = 'big' if sys.byteorder == 'little' else 'little'
+        with mock.patch('api.v1.forecasts.sys') as mock_sys:
+            mock_sys.byteorder = other
+            # when
+            actual = Forecast.unpack(packed)
+        # then
+        swapped = array('f', forecast.temperatures)
+        swapped.byteswap()
+        self.assertEqual(actual.temperatures, swapped)
+
+    def test_unpack_raise_error_for_other_data(self):
+        """unpack: raise ValueError for bytes that are not a packed forecast"""
+        # when/then
+        with self.assertRaises(ValueError):
+            Forecast.unpack(b'{"city": "Dubai", "steps": []}')
+
+    def test_pack_much_smaller_than_pickled_response(self):
+        """pack: take a fraction of the size of the pickled api response"""
+        # given
+        self.data['list'] = [get_step(1596564000 + step * 10800, 30) for step in range(40)]
+        forecast = Forecast.from_response(self.data)
+        # when
+        packed = forecast.pack()
+        # then
+        self.assertLess(len(packed) * 5, len(pickle.dumps(self.data, pickle.HIGHEST_PROTOCOL)))
+        self.assertLess(len(packed) * 10, len(pickle.dumps(json.dumps(self.data), pickle.HIGHEST_PROTOCOL)))
+
+    def test_get_daily_rollups_group_steps_by_local_day(self):
+        """get_daily_rollups: return min, max and mean of the steps of every day in the timezone of the city"""
+        # given
+        forecast = Forecast.from_response(self.data)
+        # when
+        rollups = forecast.get_daily_rollups()
+        # then
+        self.assertEqual(rollups, [
+            {'day': 18478, 'temperatures': (30, 30, 30), 'pressures': (996, 996, 996), 'humidities': (70, 70, 70)},
+            {
+                'day': 18479,
+                'temperatures': (27, 35, 29.75),
+                'pressures': (998, 1001, 999.5),
+                'humidities': (60, 81, 74),
+            },
+        ])
@@ -0,0 +1,58 @@
+from django.test import SimpleTestCase
+from django.utils import translation
+
+from api.v1.helpers import WIND_DIRECTIONS
+from api.v1.helpers import get_wind_direction
+from api.v1.helpers import get_wind_directions
+
+
+def compute_wind_direction(degree):
+    """Wind direction computed for every call, as it was before the lookup table"""
+    return str(WIND_DIRECTIONS[int((degree / 22.5) + 0.5) % 16])
+
+
+class WindDirectionTestCase(SimpleTestCase):
+    """ Tests for get_wind_direction and get_wind_directions """
+
+    def test_get_wind_direction_match_computed_direction(self):
+        """test that the lookup table gives the computed direction for every degree"""
+        # given
+        degrees = list(range(0, 1081)) + [11.24, 11.25, 348.74, 348.75, 359.9, 0.0]
+        for degree in degrees:
+            with self.subTest(degree=degree):
+                # when
+                actual = get_wind_direction(degree)
+                # then
+                self.assertEqual(actual, compute_wind_direction(degree))
+
+    def test_get_wind_direction_normalize_negative_degree(self):
+        """test that a negative degree gives the direction of the same angle counted clockwise"""
+        for degree in (-1, -90, -180, -270, -360, -11.3):
+            with self.subTest(degree=degree):
+                self.assertEqual(get_wind_direction(degree), get_wind_direction(degree + 360))
+
+    def test_get_wind_direction_return_text(self):
+        """test that the wind direction is resolved to text in the active language"""
+        # when
+        with translation.override('en'):
+            actual = get_wind_direction(150)
+        # then
+        self.assertIs(type(actual), str)
+        self.assertEqual(actual, 'South-southeast')
+
+    def test_get_wind_direction_return_none_for_unknown_degree(self):
+        """test that a missing degree gives no direction"""
+        # when
+        actual = get_wind_direction(None, 'en')
+        # then
+        self.assertIsNone(actual)
+
+    def test_get_wind_directions_return_direction_of_each_degree(self):
+        """test that the vectorized variant gives the same directions as one call per degree"""
+        # given
+        degrees = [0, 150, 359, None, 348.75, -90, 720]
+        expected = [None if degree is None else get_wind_direction(degree, 'en') for degree in degrees]
+        # when
+        actual = get_wind_directions(degrees, 'en')
+        # then
+        self.assertEqual(actual, expected)
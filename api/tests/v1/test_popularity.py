@@ -0,0 +1,77 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.test import override_settings
+
+from api.v1.popularity import PopularityTracker
+
+
+@override_settings(WEATHER_POPULARITY_TRACKING=True)
+class PopularityTrackerTestCase(SimpleTestCase):
+    """ Tests for PopularityTracker """
+
+    def setUp(self):
+        self.tracker = PopularityTracker(key='popularity')
+        patcher = mock.patch('api.v1.popularity.get_redis_client')
+        self.mock_get_redis_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis = self.mock_get_redis_client.return_value
+        self.pipeline = self.redis.pipeline.return_value
+
+    @mock.patch('api.v1.popularity.background_refresher')
+    def test_track_flush_counts_once_per_interval(self, mock_background_refresher):
+        """track: count requests in-process and flush them in the background once per flush interval"""
+        # when
+        self.tracker.track([1, 2], 'en')
+        self.tracker.track([1], 'en')
+        self.tracker.track([1], 'de')
+        # then
+        mock_background_refresher.submit.assert_called_once_with(self.tracker.flush)
+        self.tracker.flush()
+        self.pipeline.zincrby.assert_has_calls(
+            [
+                mock.call('popularity', 2, 'en:1'),
+                mock.call('popularity', 1, 'en:2'),
+                mock.call('popularity', 1, 'de:1'),
+            ],
+            any_order=True,
+        )
+        self.pipeline.execute.assert_called_once_with()
+
+    @override_settings(WEATHER_POPULARITY_TRACKING=False)
+    @mock.patch('api.v1.popularity.background_refresher')
+    def test_track_do_nothing_if_disabled(self, mock_background_refresher):
+        """track: do not count requests if tracking is disabled"""
+        # when
+        self.tracker.track([1], 'en')
+        self.tracker.flush()
+        # then
+        mock_background_refresher.submit.assert_not_called()
+        self.redis.pipeline.assert_not_called()
+
+    def test_top_return_most_requested_cities(self):
+        """top: return city ids and languages of the highest scores"""
+        # given
+        self.redis.zrevrange.return_value = [b'en:292223', b'de:2950159']
+        # when
+        actual = self.tracker.top(2)
+        # then
+        self.assertEqual(actual, [(292223, 'en'), (2950159, 'de')])
+        self.redis.zrevrange.assert_called_once_with('popularity', 0, 1)
+
+    @override_settings(WEATHER_POPULARITY_MAX_CITIES=100)
+    def test_decay_scale_scores_and_trim_set(self):
+        """decay: scale every score and drop the least requested cities"""
+        # when
+        self.tracker.decay(0.5)
+        # then
+        self.pipeline.zunionstore.assert_called_once_with('popularity', {'popularity': 0.5})
+        self.pipeline.zremrangebyrank.assert_called_once_with('popularity', 0, -101)
+
+    def test_without_redis_do_nothing(self):
+        """top/decay: ignore caches other than redis"""
+        # given
+        self.mock_get_redis_client.return_value = None
+        # when/then
+        self.assertEqual(self.tracker.top(10), [])
+        self.tracker.decay(0.5)
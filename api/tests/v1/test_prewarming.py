@@ -0,0 +1,88 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from django.test import override_settings
+
+from api.v1.caching import CacheEntry
+from api.v1.prewarming import Prewarmer
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    WEATHER_PREWARM_INTERVAL=30,
+    WEATHER_PREWARM_LEAD_TIME=60,
+    WEATHER_BATCH_CHUNK_SIZE=2,
+    WEATHER_LANGUAGE_NEUTRAL_CACHE=True,
+)
+class PrewarmerTestCase(SimpleTestCase):
+    """ Tests for Prewarmer """
+
+    def setUp(self):
+        cache.clear()
+        self.prewarmer = Prewarmer()
+        patcher = mock.patch('api.v1.prewarming.popularity')
+        self.mock_popularity = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.prewarmer.view, 'fetch_entries', return_value=({}, {}))
+        self.mock_fetch_entries = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache_entry(self, city_id, soft_timeout):
+        cache.set(
+            f'weather_record:{city_id}', CacheEntry({}, soft_timeout=soft_timeout, hard_timeout=3600), version=1
+        )
+
+    def test_get_due_cities_return_missing_and_soon_stale_entries(self):
+        """get_due_cities: return popular cities without entry or going stale within the lead time"""
+        # given
+        self.mock_popularity.top.return_value = [(1, 'en'), (2, 'en'), (3, 'en'), (2, 'de')]
+        self.cache_entry(1, soft_timeout=30)
+        self.cache_entry(2, soft_timeout=600)
+        # when
+        actual = self.prewarmer.get_due_cities(now=time.time())
+        # then
+        self.assertEqual(actual, [(1, 'en'), (3, 'en')])
+
+    @override_settings(OPEN_WEATHER_API_CALLS_PER_MINUTE=8, WEATHER_PREWARM_RATE_SHARE=0.5)
+    def test_run_once_refresh_due_cities_within_call_budget(self):
+        """run_once: fetch the most requested due cities in group calls, within its share of the rate limit"""
+        # given
+        self.mock_popularity.top.return_value = [(city_id, 'en') for city_id in range(1, 10)]
+        # when
+        self.prewarmer.run_once()
+        # then
+        self.assertEqual(self.prewarmer.get_call_budget(), 2)
+        self.mock_fetch_entries.assert_called_once_with([1, 2, 3, 4], {'language': 'en', 'ids': [1, 2, 3, 4]})
+        self.mock_popularity.decay.assert_called_once_with(mock.ANY)
+
+    def test_run_once_skip_cycle_run_by_another_prewarmer(self):
+        """run_once: do nothing while another pre-warmer holds the lease of the cycle"""
+        # given
+        cache.add('lease:prewarm', 'other')
+        # when
+        actual = self.prewarmer.run_once()
+        # then
+        self.assertIsNone(actual)
+        self.mock_fetch_entries.assert_not_called()
+
+    def test_run_once_run_back_to_back_cycles(self):
+        """run_once: let the next cycle of the same pre-warmer run, started a bit less than an interval later"""
+        # given
+        started = time.time()
+        with mock.patch('time.time', return_value=started):
+            self.prewarmer.run_once()
+        # when
+        with mock.patch('time.time', return_value=started + 29):
+            actual = self.prewarmer.run_once()
+        # then
+        self.assertIsNotNone(actual)
+        self.assertEqual(self.mock_popularity.decay.call_count, 2)
+
+    def test_view_use_prewarm_priority(self):
+        """view: fetch the cities with the pre-warm share of the call budget"""
+        # when
+        client = self.prewarmer.view.get_api_client(language='en')
+        # then
+        self.assertEqual(client.priority, 'prewarm')
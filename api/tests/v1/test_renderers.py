@@ -0,0 +1,54 @@
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.renderers import JSONRenderer
+
+from api.v1.renderers import FastJSONRenderer
+
+
+class FastJSONRendererTestCase(SimpleTestCase):
+    """ Tests for FastJSONRenderer """
+
+    def setUp(self):
+        self.data = {
+            'city': 'Düsseldorf',
+            'temperature': {'average': '32°C', 'min': '32°C', 'max': '33°C'},
+            'wind': {'speed': '3.1 m/s', 'direction': None},
+            'humidity': 79,
+            'ratio': 0.5,
+            'error': _('City not found'),
+            'price': Decimal('1.5'),
+            'separators': 'a\u2028b\u2029c',
+            'list': [{'id': 1, 'name': 'Dubai, AE'}],
+        }
+
+    def test_render_return_json_renderer_output(self):
+        """render: return the same bytes as JSONRenderer"""
+        # when
+        actual = FastJSONRenderer().render(self.data)
+        # then
+        self.assertEqual(actual, JSONRenderer().render(self.data))
+        self.assertEqual(json.loads(actual)['separators'], 'a\u2028b\u2029c')
+
+    def test_render_return_empty_body_for_none(self):
+        """render: return an empty body for no data like JSONRenderer"""
+        # when/then
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_render_fallback_to_json_renderer_for_indented_output(self):
+        """render: indent the output like JSONRenderer if the client asks for it"""
+        # when
+        actual = FastJSONRenderer().render(self.data, 'application/json; indent=4')
+        # then
+        self.assertEqual(actual, JSONRenderer().render(self.data, 'application/json; indent=4'))
+
+    @mock.patch('api.v1.renderers.orjson', None)
+    def test_render_fallback_to_json_renderer_without_orjson(self):
+        """render: encode with JSONRenderer if orjson is not installed"""
+        # when
+        actual = FastJSONRenderer().render(self.data)
+        # then
+        self.assertEqual(actual, JSONRenderer().render(self.data))
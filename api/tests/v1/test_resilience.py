@@ -0,0 +1,203 @@
+from unittest import mock
+
+import redis
+from django.test import SimpleTestCase
+from django.test import override_settings
+
+from api.v1.exceptions import CircuitOpenError
+from api.v1.resilience import CircuitBreaker
+from api.v1.resilience import LatencyTracker
+from api.v1.resilience import get_failure_cause
+from api.v1.resilience import get_retry_delay
+from api.v1.resilience import is_retryable
+from api.v1.resilience import is_upstream_failure
+
+
+class RetryTestCase(SimpleTestCase):
+    """ Tests for retry helpers """
+
+    @override_settings(OPEN_WEATHER_API_RETRY_BACKOFF=0.1)
+    @mock.patch('api.v1.resilience.random.uniform')
+    def test_get_retry_delay_return_jittered_exponential_backoff(self, mock_uniform):
+        """get_retry_delay: return a random delay up to a backoff doubling with every retry"""
+        # when
+        get_retry_delay(3)
+        # then
+        mock_uniform.assert_called_once_with(0, 0.4)
+
+    def test_is_retryable(self):
+        """is_retryable: retry calls that did not reach openweathermap or were failed by a gateway"""
+        self.assertTrue(is_retryable(None, connect_failed=True))
+        self.assertTrue(is_retryable(503, connect_failed=False))
+        self.assertFalse(is_retryable(None, connect_failed=False))
+        self.assertFalse(is_retryable(500, connect_failed=False))
+        self.assertFalse(is_retryable(404, connect_failed=False))
+
+    def test_is_upstream_failure(self):
+        """is_upstream_failure: count server errors and missing responses, not client errors"""
+        self.assertTrue(is_upstream_failure(None))
+        self.assertTrue(is_upstream_failure(502))
+        self.assertFalse(is_upstream_failure(404))
+        self.assertFalse(is_upstream_failure(429))
+
+    def test_get_failure_cause(self):
+        """get_failure_cause: label failed calls by timeout, http status or connection error"""
+        self.assertEqual(get_failure_cause(None, timed_out=True, connection_failed=True), 'timeout')
+        self.assertEqual(get_failure_cause(503, timed_out=False, connection_failed=False), 'http_503')
+        self.assertEqual(get_failure_cause(None, timed_out=False, connection_failed=True), 'connection')
+        self.assertEqual(get_failure_cause(None, timed_out=False, connection_failed=False), 'request')
+
+
+@override_settings(
+    OPEN_WEATHER_API_ADAPTIVE_TIMEOUT=True,
+    OPEN_WEATHER_API_LATENCY_MIN_SAMPLES=20,
+    OPEN_WEATHER_API_MIN_READ_TIMEOUT=0.5,
+    OPEN_WEATHER_API_READ_TIMEOUT=2,
+)
+class LatencyTrackerTestCase(SimpleTestCase):
+    """ Tests for LatencyTracker """
+
+    def setUp(self):
+        self.tracker = LatencyTracker(size=100)
+
+    def test_get_read_timeout_return_configured_timeout_without_enough_samples(self):
+        """get_read_timeout: return OPEN_WEATHER_API_READ_TIMEOUT until enough calls were timed"""
+        # given
+        for _ in range(19):
+            self.tracker.record(0.1)
+        # when/then
+        self.assertEqual(self.tracker.get_read_timeout(), 2)
+
+    def test_get_read_timeout_follow_p99_latency(self):
+        """get_read_timeout: return twice the p99 latency of the last calls, older calls are forgotten"""
+        # given
+        for index in range(200):
+            self.tracker.record(0.3 + index / 1000)
+        # when/then
+        self.assertEqual(self.tracker.get_percentile(99), 0.498)
+        self.assertAlmostEqual(self.tracker.get_read_timeout(), 0.996)
+
+    def test_get_read_timeout_stay_within_bounds(self):
+        """get_read_timeout: never go below the minimum nor above the configured timeout"""
+        # given
+        for _ in range(20):
+            self.tracker.record(0.01)
+        # when/then
+        self.assertEqual(self.tracker.get_read_timeout(), 0.5)
+        for _ in range(20):
+            self.tracker.record(5)
+        self.assertEqual(self.tracker.get_read_timeout(), 2)
+
+    @override_settings(OPEN_WEATHER_API_ADAPTIVE_TIMEOUT=False)
+    def test_get_read_timeout_return_configured_timeout_if_disabled(self):
+        """get_read_timeout: return OPEN_WEATHER_API_READ_TIMEOUT if adaptive timeouts are disabled"""
+        # given
+        for _ in range(20):
+            self.tracker.record(0.1)
+        # when/then
+        self.assertEqual(self.tracker.get_read_timeout(), 2)
+
+
+@override_settings(
+    OPEN_WEATHER_API_CIRCUIT_BREAKER=True,
+    OPEN_WEATHER_API_BREAKER_FAILURES=5,
+    OPEN_WEATHER_API_BREAKER_WINDOW=10,
+    OPEN_WEATHER_API_BREAKER_OPEN_TIMEOUT=15,
+    OPEN_WEATHER_API_READ_TIMEOUT=2,
+)
+class CircuitBreakerTestCase(SimpleTestCase):
+    """ Tests for CircuitBreaker """
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(key='breaker')
+        patcher = mock.patch('api.v1.resilience.get_redis_client')
+        self.mock_get_redis_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis = self.mock_get_redis_client.return_value
+        self.script = self.redis.register_script.return_value
+
+    def test_before_call_allow_call_if_closed(self):
+        """before_call: allow the call if the circuit is closed"""
+        # given
+        self.script.return_value = [1, 0]
+        # when
+        actual = self.breaker.before_call()
+        # then
+        self.assertFalse(actual)
+        self.script.assert_called_once_with(
+            keys=['breaker:open', 'breaker:half_open', 'breaker:probe'], args=[4000], client=self.redis
+        )
+
+    def test_before_call_return_true_for_probe_of_half_open_circuit(self):
+        """before_call: let one call probe a half-open circuit"""
+        # given
+        self.script.return_value = [2, 0]
+        # when/then
+        self.assertTrue(self.breaker.before_call())
+
+    def test_before_call_raise_error_if_open(self):
+        """before_call: fail right away while the circuit is open"""
+        # given
+        self.script.return_value = [0, 2500]
+        # when/then
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.before_call()
+        self.assertEqual(context.exception.retry_after, 3)
+
+    def test_before_call_allow_call_if_redis_fails(self):
+        """before_call: allow the call if the circuit can not be checked"""
+        # given
+        self.script.side_effect = redis.ConnectionError
+        # when/then
+        self.assertFalse(self.breaker.before_call())
+
+    def test_record_failure_count_failure(self):
+        """record_failure: count the failure, the script opens the circuit past the threshold or for a probe"""
+        # given
+        self.script.return_value = 0
+        # when
+        self.breaker.record_failure(probe=True)
+        # then
+        self.script.assert_called_once_with(
+            keys=['breaker:failures', 'breaker:open', 'breaker:half_open', 'breaker:probe'],
+            args=[5, 10, 15, 1],
+            client=self.redis,
+        )
+
+    def test_record_success_close_circuit_after_successful_probe(self):
+        """record_success: close the circuit after a successful probe"""
+        # when
+        self.breaker.record_success()
+        # then
+        self.redis.delete.assert_not_called()
+        # when
+        self.breaker.record_success(probe=True)
+        # then
+        self.redis.delete.assert_called_once_with('breaker:half_open', 'breaker:probe', 'breaker:failures')
+
+    def test_record_success_only_reset_failures_without_probe(self):
+        """record_success: forget the failures seen by the process, leave a half-open circuit to its probe"""
+        # given
+        self.script.return_value = 0
+        self.breaker.record_failure()
+        # when
+        self.breaker.record_success()
+        # then
+        self.redis.delete.assert_called_once_with('breaker:failures')
+
+    def test_release_probe_let_another_call_probe(self):
+        """release_probe: delete the probe lease of a probe call that was not made"""
+        # when
+        self.breaker.release_probe(False)
+        self.breaker.release_probe(True)
+        # then
+        self.redis.delete.assert_called_once_with('breaker:probe')
+
+    @override_settings(OPEN_WEATHER_API_CIRCUIT_BREAKER=False)
+    def test_do_nothing_if_disabled(self):
+        """before_call/record_failure: allow every call if the circuit breaker is disabled"""
+        # when
+        self.assertFalse(self.breaker.before_call())
+        self.breaker.record_failure()
+        # then
+        self.mock_get_redis_client.assert_not_called()
@@ -3,6 +3,7 @@ from django.test import SimpleTestCase
 
 from api.v1.serializers import CityAPIInputySerializer
 from api.v1.serializers import WeatherAPIInputSerializer
+from api.v1.serializers import WeatherBatchAPIInputSerializer
 
 
 class WeatherAPIInputSerializerTestCase(SimpleTestCase):
@@ -49,6 +50,41 @@ class WeatherAPIInputSerializerTestCase(SimpleTestCase):
         self.assertTrue(serializer.data['language'], settings.LANGUAGE_CODE)
 
 
+class WeatherBatchAPIInputSerializerTestCase(SimpleTestCase):
+    """Tests for WeatherBatchAPIInputSerializer"""
+
+    def test_serialize_return_unique_ids_from_comma_separated_list(self):
+        """serialize: return unique city ids from comma separated list in the given order"""
+        # given
+        serializer = WeatherBatchAPIInputSerializer(data={'ids': '3,1,,3, 2'})
+        # when
+        is_valid = serializer.is_valid()
+        # then
+        self.assertTrue(is_valid)
+        self.assertEqual(serializer.data['ids'], [3, 1, 2])
+
+    def test_serialize_return_validation_error_for_invalid_city(self):
+        """serialize: return validation error for invalid city id"""
+        # given
+        serializer = WeatherBatchAPIInputSerializer(data={'ids': '1,invalid'})
+        # when
+        is_valid = serializer.is_valid()
+        # then
+        self.assertFalse(is_valid)
+        self.assertEqual(serializer.errors['ids'][1][0].code, 'invalid')
+
+    def test_serialize_return_validation_error_for_too_many_ids(self):
+        """serialize: return validation error if more than WEATHER_BATCH_MAX_IDS ids are given"""
+        # given
+        ids = ','.join(str(city_id) for city_id in range(settings.WEATHER_BATCH_MAX_IDS + 1))
+        serializer = WeatherBatchAPIInputSerializer(data={'ids': ids})
+        # when
+        is_valid = serializer.is_valid()
+        # then
+        self.assertFalse(is_valid)
+        self.assertEqual(serializer.errors['ids'][0].code, 'max_length')
+
+
 class CityAPIInputySerializerTestCase(SimpleTestCase):
     """Tests for CityAPIInputySerializer"""
 
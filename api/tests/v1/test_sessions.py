@@ -0,0 +1,103 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.test import override_settings
+from prometheus_client import REGISTRY
+
+from api.v1.sessions import SessionPool
+
+
+@override_settings(OPEN_WEATHER_API_POOL_SIZE=2)
+class SessionPoolTestCase(SimpleTestCase):
+    """Tests for SessionPool"""
+
+    def setUp(self):
+        self.pool = SessionPool()
+
+    def test_session_reuse_released_session(self):
+        """session: hand out the same session again once it is released"""
+        # given
+        with self.pool.session() as session:
+            first = session
+        # when
+        with self.pool.session() as session:
+            second = session
+        # then
+        self.assertIs(first, second)
+        self.assertEqual(self.pool.get_stats()['sessions'], 1)
+        self.assertEqual(self.pool.get_stats()['checkouts'], 2)
+
+    def test_session_create_new_session_for_concurrent_use(self):
+        """session: create a separate session while another one is borrowed"""
+        # when
+        with self.pool.session() as first:
+            with self.pool.session() as second:
+                pass
+        # then
+        self.assertIsNot(first, second)
+        self.assertEqual(self.pool.get_stats()['sessions'], 2)
+
+    @mock.patch('api.v1.sessions._count_connections')
+    def test_session_export_opened_and_reused_connections(self, mock_count_connections):
+        """session: count connections opened and reused by the requests of the block in the prometheus metrics"""
+        # given
+        mock_count_connections.side_effect = [(2, 5), (3, 9)]
+        before = {
+            state: REGISTRY.get_sample_value('weather_finder_upstream_connections_total', {'state': state}) or 0
+            for state in ('opened', 'reused')
+        }
+        # when
+        with self.pool.session():
+            pass
+        # then
+        for state, count in (('opened', 1), ('reused', 3)):
+            self.assertEqual(
+                REGISTRY.get_sample_value('weather_finder_upstream_connections_total', {'state': state}),
+                before[state] + count,
+            )
+
+    @mock.patch('api.v1.sessions._count_connections')
+    def test_session_ignore_connections_of_dropped_pools(self, mock_count_connections):
+        """session: count no opened connections when a host pool was dropped while the session was borrowed"""
+        # given
+        mock_count_connections.side_effect = [(3, 9), (1, 2)]
+        before = REGISTRY.get_sample_value('weather_finder_upstream_connections_total', {'state': 'opened'}) or 0
+        # when
+        with self.pool.session():
+            pass
+        # then
+        self.assertEqual(
+            REGISTRY.get_sample_value('weather_finder_upstream_connections_total', {'state': 'opened'}) or 0, before
+        )
+
+    @override_settings(OPEN_WEATHER_API_KEEP_ALIVE=True)
+    def test_session_negotiate_gzip_and_keep_alive(self):
+        """session: send gzip and keep-alive headers"""
+        # when
+        with self.pool.session() as session:
+            headers = session.headers
+        # then
+        self.assertIn('gzip', headers['Accept-Encoding'])
+        self.assertEqual(headers['Connection'], 'keep-alive')
+
+    @override_settings(OPEN_WEATHER_API_CONNECT_TIMEOUT=0.5, OPEN_WEATHER_API_READ_TIMEOUT=2)
+    def test_get_timeout_return_connect_and_read_timeout(self):
+        """get_timeout: return separate connect and read timeouts"""
+        # when/then
+        self.assertEqual(self.pool.get_timeout(), (0.5, 2))
+
+    @mock.patch('api.v1.sessions.os.getpid')
+    def test_session_discard_sessions_after_fork(self, mock_getpid):
+        """session: never reuse sessions inherited from a parent process"""
+        # given
+        mock_getpid.return_value = 1
+        self.pool = SessionPool()
+        with self.pool.session() as session:
+            parent_session = session
+        mock_getpid.return_value = 2
+        # when
+        with self.pool.session() as session:
+            child_session = session
+        # then
+        self.assertIsNot(parent_session, child_session)
+        self.assertEqual(self.pool.get_stats()['sessions'], 1)
@@ -2,8 +2,16 @@ from unittest import mock
 
 from django.test import SimpleTestCase
 
+from api.v1.forecasts import Forecast
 from api.v1.transformers import CityListResponseSchema
+from api.v1.transformers import WeatherRecordSchema
 from api.v1.transformers import WeatherResponseSchema
+from api.v1.transformers import localize_forecast
+from api.v1.transformers import localize_weather_record
+from api.v1.transformers import localize_weather_records
+from api.v1.transformers import transform_city_list
+from api.v1.transformers import transform_weather_record
+from api.v1.transformers import transform_weather_response
 
 
 class OpenWeatherMapResponseSchemaTestCase(SimpleTestCase):
@@ -35,6 +43,55 @@ class OpenWeatherMapResponseSchemaTestCase(SimpleTestCase):
         self.assertDictEqual(actual, expected)
 
 
+class WeatherRecordSchemaTestCase(SimpleTestCase):
+    """ Tests for WeatherRecordSchema """
+
+    def setUp(self):
+        self.data = {
+            'weather': [{'id': 801, 'main': 'Clouds', 'description': 'few clouds', 'icon': '02n'}],
+            'main': {'temp': 32, 'feels_like': 38.18, 'temp_min': 32, 'temp_max': 33, 'pressure': 997, 'humidity': 79},
+            'wind': {'speed': 3.1, 'deg': 150},
+            'name': 'Dubai',
+        }
+
+    def test_serialize_return_language_neutral_record(self):
+        """test that the data is serialized with condition code and wind degree"""
+        # given
+        expected = {
+            'city': 'Dubai',
+            'condition': 801,
+            'temperature': {'average': '32°C', 'min': '32°C', 'max': '33°C'},
+            'pressure': '997 hPa',
+            'humidity': '79%',
+            'wind': {'speed': '3.1 m/s', 'degree': 150},
+            'description': 'few clouds',
+        }
+        # when
+        actual = WeatherRecordSchema().dump(self.data)
+        # then
+        self.assertDictEqual(actual, expected)
+
+    def test_localize_weather_record_return_weather_response(self):
+        """localize_weather_record: return the same response as WeatherResponseSchema"""
+        # given
+        record = WeatherRecordSchema().dump(self.data)
+        expected = WeatherResponseSchema().dump(self.data)
+        # when
+        actual = localize_weather_record(record, 'en')
+        # then
+        self.assertDictEqual(actual, expected)
+
+    def test_localize_weather_record_fallback_to_upstream_description(self):
+        """localize_weather_record: use the upstream description for unknown condition codes"""
+        # given
+        self.data['weather'][0].update({'id': 999, 'description': 'meteor shower'})
+        record = WeatherRecordSchema().dump(self.data)
+        # when
+        actual = localize_weather_record(record, 'en')
+        # then
+        self.assertEqual(actual['description'], 'meteor shower')
+
+
 class CityListResponseSchemaTestCase(SimpleTestCase):
     """Tests for CityListResponseSchema"""
 
@@ -51,3 +108,105 @@ class CityListResponseSchemaTestCase(SimpleTestCase):
         actual = CityListResponseSchema().dump(data)
         # then
         self.assertDictEqual(actual, expected)
+
+
+class TransformersTestCase(SimpleTestCase):
+    """Tests that the transformer functions return the same output as the schemas they replace"""
+
+    def get_weather_data(self, **kwargs):
+        data = {
+            'coord': {'lon': 13.41, 'lat': 52.52},
+            'weather': [{'id': 500, 'main': 'Rain', 'description': 'light rain', 'icon': '10d'}],
+            'main': {'temp': 7.68, 'temp_min': -0.5, 'temp_max': 9, 'pressure': 1012, 'humidity': 87},
+            'wind': {'speed': 5.1, 'deg': 0},
+            'sys': {'country': 'DE'},
+            'id': 2950159,
+            'name': 'Berlin',
+        }
+        data.update(kwargs)
+        return data
+
+    def test_transform_weather_response_return_schema_output(self):
+        """transform_weather_response: return the same output as WeatherResponseSchema for every wind degree"""
+        for degree in range(0, 360, 7):
+            data = self.get_weather_data(wind={'speed': 2, 'deg': degree})
+            with self.subTest(degree=degree):
+                self.assertEqual(transform_weather_response(data), WeatherResponseSchema().dump(data))
+
+    def test_transform_weather_response_return_schema_output_for_missing_city_name(self):
+        """transform_weather_response: leave out or keep empty city name like WeatherResponseSchema"""
+        without_name = self.get_weather_data()
+        del without_name['name']
+        for data in (without_name, self.get_weather_data(name=None)):
+            with self.subTest(data=data):
+                self.assertEqual(transform_weather_response(data), WeatherResponseSchema().dump(data))
+
+    def test_transform_weather_record_return_schema_output(self):
+        """transform_weather_record: return the same output as WeatherRecordSchema"""
+        for data in (self.get_weather_data(), self.get_weather_data(weather=[{'id': 999, 'description': 'haze'}])):
+            with self.subTest(data=data):
+                self.assertEqual(transform_weather_record(data), WeatherRecordSchema().dump(data))
+
+    def test_transform_weather_response_return_no_wind_direction_for_missing_degree(self):
+        """transform_weather_response: calm wind without degree has no direction instead of failing"""
+        data = self.get_weather_data(wind={'speed': 0})
+        self.assertEqual(transform_weather_response(data)['wind'], {'speed': '0 m/s', 'direction': None})
+        self.assertEqual(transform_weather_record(data)['wind'], {'speed': '0 m/s', 'degree': None})
+
+    def test_localize_weather_records_return_localize_weather_record_output(self):
+        """localize_weather_records: return the same output as localize_weather_record for each record"""
+        records = [
+            transform_weather_record(self.get_weather_data(wind={'speed': 2, 'deg': degree}))
+            for degree in (0, 150, 300)
+        ]
+        self.assertEqual(
+            localize_weather_records(records, 'en'), [localize_weather_record(record, 'en') for record in records]
+        )
+
+    def test_transform_city_list_return_schema_output(self):
+        """transform_city_list: return the same output as CityListResponseSchema with many=True"""
+        # given
+        cities = [
+            self.get_weather_data(),
+            self.get_weather_data(id='2643743', name='London', sys={'country': 'GB'}),
+            {'name': 'Paris', 'sys': {'country': 'FR'}},
+        ]
+        # when/then
+        self.assertEqual(transform_city_list(cities), CityListResponseSchema().dump(cities, many=True))
+        self.assertEqual(transform_city_list([]), [])
+
+    def test_localize_forecast_return_daily_rollups_and_steps(self):
+        """localize_forecast: return the days and steps of a forecast with translated descriptions and winds"""
+        # given
+        steps = [
+            {'dt': 1596564000 + index * 10800, 'main': {'temp': temperature, 'pressure': 997, 'humidity': 79},
+             'weather': [{'id': 801}], 'wind': {'speed': 3.1, 'deg': 150}}
+            for index, temperature in enumerate((32.5, 29, 27.5))
+        ]
+        forecast = Forecast.from_response({'list': steps, 'city': {'name': 'Dubai', 'timezone': 0}})
+        # when
+        actual = localize_forecast(forecast, 'en')
+        # then
+        self.assertEqual(actual['city'], 'Dubai')
+        self.assertEqual(actual['days'], [
+            {
+                'date': '2020-08-04',
+                'temperature': {'average': '30°C', 'min': '29°C', 'max': '32°C'},
+                'pressure': '997 hPa',
+                'humidity': '79%',
+            },
+            {
+                'date': '2020-08-05',
+                'temperature': {'average': '27°C', 'min': '27°C', 'max': '27°C'},
+                'pressure': '997 hPa',
+                'humidity': '79%',
+            },
+        ])
+        self.assertEqual(actual['steps'][0], {
+            'time': '2020-08-04T18:00:00Z',
+            'description': 'few clouds',
+            'temperature': '32°C',
+            'pressure': '997 hPa',
+            'humidity': '79%',
+            'wind': {'speed': '3.1 m/s', 'direction': 'South-southeast'},
+        })
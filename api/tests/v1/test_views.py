@@ -1,18 +1,34 @@
+import json
+import threading
+import time
 from http import HTTPStatus
 from unittest import mock
 from unittest.mock import Mock
 
+from django.core.cache import cache
+from django.test import Client
 from django.test import SimpleTestCase
+from django.test import override_settings
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
+from prometheus_client import REGISTRY
 
+from api.v1.caching import CacheEntry
+from api.v1.clients import OpenWeatherMapWeatherClient
+from api.v1.clients import OpenWeatherMapWeatherRecordClient
+from api.v1.coalescing import single_flight
+from api.v1.exceptions import BudgetExceededError
 from api.v1.exceptions import ExternalAPIError
+from api.v1.forecasts import Forecast
 from api.v1.serializers import CityAPIInputySerializer
 from api.v1.serializers import WeatherAPIInputSerializer
 from api.v1.views import CityListView
+from api.v1.views import ForecastView
+from api.v1.views import WeatherBatchView
 from api.v1.views import WeatherDetailsView
 
 
+@override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=True)
 class WeatherDetailsViewTestCase(SimpleTestCase):
     """ Tests for WeatherDetailsView """
 
@@ -20,6 +36,18 @@ class WeatherDetailsViewTestCase(SimpleTestCase):
         self.url = reverse('api:v1:weather', kwargs={'city_id': 1})
         self.view = WeatherDetailsView()
 
+    def get_record(self):
+        return {
+            'city': 'Dubai',
+            'condition': 801,
+            'description': 'few clouds',
+            'temperature': {'average': '32°C', 'min': '32°C', 'max': '33°C'},
+            'pressure': '997 hPa',
+            'humidity': '79%',
+            'wind': {'speed': '3.1 m/s', 'degree': 150},
+        }
+
+    @override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=False)
     def test_get_cache_key_return_cache_key(self):
         """get_cache_key: return cache key to store weather data"""
         # given
@@ -29,6 +57,32 @@ class WeatherDetailsViewTestCase(SimpleTestCase):
         # then
         self.assertEqual(actual, expected)
 
+    def test_get_cache_key_return_language_neutral_cache_key(self):
+        """get_cache_key: return the same cache key for every language in language neutral mode"""
+        # given
+        expected = "weather_record:1"
+        # when
+        actual = self.view.get_cache_key(language='de', city_id=1)
+        # then
+        self.assertEqual(actual, expected)
+
+    @override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=False)
+    def test_get_api_client_return_weather_client(self):
+        """get_api_client: return client fetching weather in the requested language"""
+        # when
+        client = self.view.get_api_client(language='de', city_id=1)
+        # then
+        self.assertIs(type(client), OpenWeatherMapWeatherClient)
+        self.assertEqual(client.language, 'de')
+
+    def test_get_api_client_return_weather_record_client(self):
+        """get_api_client: return client fetching language neutral weather record"""
+        # when
+        client = self.view.get_api_client(language='de', city_id=1)
+        # then
+        self.assertIs(type(client), OpenWeatherMapWeatherRecordClient)
+        self.assertEqual(client.language, 'en')
+
     def test_get_input_serializer_class_return_input_serializer_class(self):
         """get_input_serializer_class: return serializer class for input data"""
         # when/then
@@ -52,6 +106,7 @@ class WeatherDetailsViewTestCase(SimpleTestCase):
         self.assertTrue(response.status_code, HTTPStatus.BAD_REQUEST)
         self.assertTrue(response.data['error'], 'error')
 
+    @override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=False)
     @mock.patch('api.v1.views.cache')
     @mock.patch.object(WeatherDetailsView, 'get_input_serializer_class')
     @mock.patch.object(WeatherDetailsView, 'get_request_data')
@@ -62,13 +117,14 @@ class WeatherDetailsViewTestCase(SimpleTestCase):
         """get: return weather data from cache if available"""
         # given
         expected = {'name': 'Dubai'}
-        mock_cache.get.return_value = expected
+        mock_cache.get.return_value = CacheEntry(expected, soft_timeout=600, hard_timeout=3600)
         mock_get_cache_key.return_value = 'cache-key'
         # when
         response = self.client.get(self.url)
         # then
         self.assertEqual(response.data, expected)
         self.assertTrue(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['X-Cache'], 'HIT')
 
     @mock.patch.object(WeatherDetailsView, 'get_api_client')
     @mock.patch('api.v1.views.cache')
@@ -88,6 +144,21 @@ class WeatherDetailsViewTestCase(SimpleTestCase):
         self.assertEqual(response.data['error'], _('Something went wrong! Please try again later'))
         self.assertTrue(response.status_code, HTTPStatus.INTERNAL_SERVER_ERROR)
 
+    @mock.patch.object(WeatherDetailsView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_service_unavailable_without_call_budget(self, mock_cache, mock_get_api_client):
+        """get: return 503 with Retry-After if the call budget has no token left for the request"""
+        # given
+        mock_cache.get.return_value = None
+        mock_get_api_client().get_data.side_effect = BudgetExceededError('weather', retry_after=3)
+        # when
+        response = self.client.get(self.url)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data['error'], _('Something went wrong! Please try again later'))
+        self.assertEqual(response['Retry-After'], '3')
+
+    @override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=False)
     @mock.patch.object(WeatherDetailsView, 'get_api_client')
     @mock.patch('api.v1.views.cache')
     @mock.patch.object(WeatherDetailsView, 'get_input_serializer_class')
@@ -107,12 +178,510 @@ class WeatherDetailsViewTestCase(SimpleTestCase):
         # then
         self.assertEqual(response.data, expected)
         self.assertTrue(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['X-Cache'], 'MISS')
         mock_cache.set.assert_called_once_with(
             cache_key,
-            expected,
-            timeout=600,
+            mock.ANY,
+            timeout=3600,
             version=1,
         )
+        entry = mock_cache.set.call_args[0][1]
+        self.assertEqual(entry.data, expected)
+        self.assertFalse(entry.is_stale())
+
+    @override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=False)
+    @mock.patch('api.v1.views.background_refresher')
+    @mock.patch('api.v1.views.cache')
+    @mock.patch.object(WeatherDetailsView, 'get_cache_key')
+    def test_get_return_stale_data_and_refresh_in_background(
+        self, mock_get_cache_key, mock_cache, mock_background_refresher
+    ):
+        """get: return stale weather data from cache and refresh it in the background"""
+        # given
+        expected = {'name': 'Dubai'}
+        mock_cache.get.return_value = CacheEntry(expected, soft_timeout=600, hard_timeout=3600, now=0)
+        mock_get_cache_key.return_value = 'cache-key'
+        # when
+        response = self.client.get(self.url)
+        # then
+        self.assertEqual(response.data, expected)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['X-Cache'], 'STALE')
+        mock_background_refresher.submit.assert_called_once_with(
+            mock.ANY, 'cache-key', {'city_id': 1, 'language': 'en'}, {'cache-key': mock.ANY}
+        )
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        WEATHER_LANGUAGE_NEUTRAL_CACHE=False,
+    )
+    @mock.patch('api.v1.views.background_refresher')
+    @mock.patch.object(WeatherDetailsView, 'get_api_client')
+    @mock.patch.object(WeatherDetailsView, 'get_cache_key')
+    def test_get_refresh_stale_data_once_for_concurrent_requests(
+        self, mock_get_cache_key, mock_get_api_client, mock_background_refresher
+    ):
+        """get: call the api once for concurrent stale hits, including refreshes queued after the first one"""
+        # given
+        cache.clear()
+        cache.set('cache-key', CacheEntry({'name': 'Dubai'}, soft_timeout=600, hard_timeout=3600, now=0), version=1)
+        mock_get_cache_key.return_value = 'cache-key'
+        mock_get_api_client().get_data.return_value = {'name': 'Dubai'}
+        mock_get_api_client.reset_mock()
+        responses = []
+        requests = [threading.Thread(target=lambda: responses.append(Client().get(self.url))) for _ in range(20)]
+        # when
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join(2)
+        for refresh, *args in [call[0] for call in mock_background_refresher.submit.call_args_list]:
+            refresh(*args)
+        # then
+        self.assertEqual([response['X-Cache'] for response in responses], ['STALE'] * 20)
+        mock_background_refresher.submit.assert_called_once()
+        mock_get_api_client().get_data.assert_called_once()
+        self.assertFalse(cache.get('cache-key', version=1).is_stale())
+        self.assertIsNone(cache.get('lease:cache-key', version=1))
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        WEATHER_LANGUAGE_NEUTRAL_CACHE=False,
+    )
+    @mock.patch.object(WeatherDetailsView, 'get_api_client')
+    def test_refresh_response_skip_entry_refreshed_meanwhile(self, mock_get_api_client):
+        """refresh_response: not call the api if the entry was refreshed since it was read stale"""
+        # given
+        cache.clear()
+        cache.set('cache-key', CacheEntry({'name': 'Dubai'}, soft_timeout=600, hard_timeout=3600), version=1)
+        leases = single_flight.claim(cache, ['cache-key'], 1)
+        # when
+        self.view.refresh_response('cache-key', {'city_id': 1, 'language': 'en'}, leases)
+        # then
+        mock_get_api_client().get_data.assert_not_called()
+        self.assertIsNone(cache.get('lease:cache-key', version=1))
+
+    @mock.patch.object(WeatherDetailsView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_refresh_response_keep_stale_data_if_external_api_fails(self, mock_cache, mock_get_api_client):
+        """refresh_response: keep the stale cache entry if external api fails"""
+        # given
+        mock_get_api_client().get_data.side_effect = ExternalAPIError
+        # when
+        self.view.refresh_response('cache-key', {'city_id': 1, 'language': 'en'}, {'cache-key': 'token'})
+        # then
+        mock_cache.set.assert_not_called()
+
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_localized_weather_record_from_cache(self, mock_cache):
+        """get: return cached language neutral weather record translated to the requested language"""
+        # given
+        record = {
+            'city': 'Dubai',
+            'condition': 801,
+            'description': 'few clouds',
+            'temperature': {'average': '32°C', 'min': '32°C', 'max': '33°C'},
+            'pressure': '997 hPa',
+            'humidity': '79%',
+            'wind': {'speed': '3.1 m/s', 'degree': 150},
+        }
+        mock_cache.get.return_value = CacheEntry(record, soft_timeout=600, hard_timeout=3600)
+        # when
+        response = self.client.get(self.url)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['description'], 'few clouds')
+        self.assertEqual(response.data['wind'], {'speed': '3.1 m/s', 'direction': 'South-southeast'})
+        mock_cache.get.assert_called_once_with('weather_record:1', version=1)
+
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_etag_and_cache_control_of_cache_entry(self, mock_cache):
+        """get: return the ETag of the entry per language and a Cache-Control following its remaining lifetime"""
+        # given
+        entry = CacheEntry(self.get_record(), soft_timeout=600, hard_timeout=3600)
+        mock_cache.get.return_value = entry
+        # when
+        response = self.client.get(self.url)
+        # then
+        self.assertEqual(response['ETag'], f'"{entry.etag}-en"')
+        self.assertEqual(self.view.get_etag(entry, {'city_id': 1, 'language': 'de'}), f'"{entry.etag}-de"')
+        self.assertRegex(response['Cache-Control'], r'^public, max-age=(599|600), stale-while-revalidate=3000$')
+
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_not_modified_for_matching_etag(self, mock_cache):
+        """get: return 304 without body if the client has the current version of the response"""
+        # given
+        entry = CacheEntry(self.get_record(), soft_timeout=600, hard_timeout=3600)
+        mock_cache.get.return_value = entry
+        # when
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{entry.etag}-en"')
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], f'"{entry.etag}-en"')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_data_for_outdated_etag(self, mock_cache):
+        """get: return the response if the client has an older version of it"""
+        # given
+        mock_cache.get.return_value = CacheEntry(self.get_record(), soft_timeout=600, hard_timeout=3600)
+        # when
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"outdated-en"')
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['city'], 'Dubai')
+
+    @mock.patch('api.v1.views.cache')
+    def test_get_count_cache_status(self, mock_cache):
+        """get: count the cache status of the response in the metrics"""
+        # given
+        mock_cache.get.return_value = CacheEntry(self.get_record(), soft_timeout=600, hard_timeout=3600)
+        labels = {'view': 'WeatherDetailsView', 'status': 'HIT'}
+        before = REGISTRY.get_sample_value('weather_finder_cache_requests_total', labels) or 0
+        # when
+        self.client.get(self.url)
+        # then
+        self.assertEqual(REGISTRY.get_sample_value('weather_finder_cache_requests_total', labels), before + 1)
+
+    @mock.patch('api.v1.views.popularity')
+    @mock.patch('api.v1.views.cache')
+    def test_get_track_requested_city(self, mock_cache, mock_popularity):
+        """get: count the request in the popularity of the city for the pre-warmer"""
+        # given
+        mock_cache.get.return_value = CacheEntry(self.get_record(), soft_timeout=600, hard_timeout=3600)
+        # when
+        self.client.get(self.url)
+        # then
+        mock_popularity.track.assert_called_once_with([1], 'en')
+
+    @override_settings(API_CACHE_ENCODED_RESPONSES=True)
+    def test_get_cache_key_return_encoded_response_cache_key(self):
+        """get_cache_key: return a cache key per language for encoded responses"""
+        # when
+        actual = self.view.get_cache_key(language='de', city_id=1)
+        # then
+        self.assertEqual(actual, 'weather_body:de:1')
+
+    @override_settings(API_CACHE_ENCODED_RESPONSES=True)
+    @mock.patch.object(WeatherDetailsView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_cache_encoded_response_and_return_it_as_is(self, mock_cache, mock_get_api_client):
+        """get: cache the rendered body of a fetched weather record and return cached bodies without encoding"""
+        # given
+        record = {
+            'city': 'Dubai',
+            'condition': 801,
+            'description': 'few clouds',
+            'temperature': {'average': '32°C', 'min': '32°C', 'max': '33°C'},
+            'pressure': '997 hPa',
+            'humidity': '79%',
+            'wind': {'speed': '3.1 m/s', 'degree': 150},
+        }
+        mock_cache.get.return_value = None
+        mock_get_api_client().get_data.return_value = record
+        # when
+        response = self.client.get(self.url)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(response.content)['wind'], {'speed': '3.1 m/s', 'direction': 'South-southeast'})
+        mock_cache.set.assert_called_once_with('weather_body:en:1', mock.ANY, timeout=3600, version=1)
+        entry = mock_cache.set.call_args[0][1]
+        self.assertEqual(entry.data, response.content)
+
+        # given
+        mock_cache.get.return_value = entry
+        # when
+        with mock.patch.object(WeatherDetailsView, 'encode') as mock_encode:
+            response = self.client.get(self.url)
+        # then
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, entry.data)
+        mock_encode.assert_not_called()
+
+
+@override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=True)
+class WeatherBatchViewTestCase(SimpleTestCase):
+    """ Tests for WeatherBatchView """
+
+    def setUp(self):
+        self.url = reverse('api:v1:weather_batch')
+        self.record = {
+            'city': 'Dubai',
+            'condition': 801,
+            'description': 'few clouds',
+            'temperature': {'average': '32°C', 'min': '32°C', 'max': '33°C'},
+            'pressure': '997 hPa',
+            'humidity': '79%',
+            'wind': {'speed': '3.1 m/s', 'degree': 150},
+        }
+
+    def test_get_return_validation_error_for_invalid_ids(self):
+        """get: return validation error if the city ids are not valid"""
+        # when
+        response = self.client.get(self.url, {'ids': '1,invalid'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('ids', response.data['error'])
+
+    @mock.patch.object(WeatherBatchView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_data_from_cache_in_one_round_trip(self, mock_cache, mock_get_api_client):
+        """get: return every city from one cache get_many without calling the api"""
+        # given
+        entry = CacheEntry(self.record, soft_timeout=600, hard_timeout=3600)
+        mock_cache.get_many.return_value = {'weather_record:1': entry, 'weather_record:2': entry}
+        # when
+        response = self.client.get(self.url, {'ids': '1,2'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(list(response.data), ['1', '2'])
+        self.assertEqual(response.data['2']['wind'], {'speed': '3.1 m/s', 'direction': 'South-southeast'})
+        mock_cache.get_many.assert_called_once_with(['weather_record:1', 'weather_record:2'], version=1)
+        mock_get_api_client().get_data.assert_not_called()
+
+    @override_settings(WEATHER_BATCH_CHUNK_SIZE=2)
+    @mock.patch.object(WeatherBatchView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_fetch_misses_in_chunks_and_cache_result(self, mock_cache, mock_get_api_client):
+        """get: fetch the cache misses in chunks from the api and store them with one set_many"""
+        # given
+        entry = CacheEntry(self.record, soft_timeout=600, hard_timeout=3600)
+        mock_cache.get_many.return_value = {'weather_record:1': entry}
+        mock_get_api_client().get_data.side_effect = lambda city_ids: {
+            city_id: self.record for city_id in city_ids
+        }
+        # when
+        response = self.client.get(self.url, {'ids': '1,2,3,4'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(sorted(response.data), ['1', '2', '3', '4'])
+        mock_get_api_client().get_data.assert_has_calls(
+            [mock.call(city_ids=[2, 3]), mock.call(city_ids=[4])], any_order=True
+        )
+        stored = mock_cache.set_many.call_args[0][0]
+        self.assertEqual(sorted(stored), ['weather_record:2', 'weather_record:3', 'weather_record:4'])
+        self.assertEqual(mock_cache.set_many.call_args[1], {'timeout': 3600, 'version': 1})
+
+    @override_settings(WEATHER_BATCH_CHUNK_SIZE=2)
+    @mock.patch.object(WeatherBatchView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_error_per_city(self, mock_cache, mock_get_api_client):
+        """get: return an error for the cities that could not be fetched and data for the others"""
+        # given
+        mock_cache.get_many.return_value = {}
+
+        def get_data(city_ids):
+            if 3 in city_ids:
+                raise ExternalAPIError
+            return {1: self.record}
+
+        mock_get_api_client().get_data.side_effect = get_data
+        # when
+        response = self.client.get(self.url, {'ids': '1,2,3'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['1']['city'], 'Dubai')
+        self.assertEqual(response.data['2'], {'error': _('City not found')})
+        self.assertEqual(response.data['3'], {'error': _('Something went wrong! Please try again later')})
+        self.assertEqual(list(mock_cache.set_many.call_args[0][0]), ['weather_record:1'])
+
+    @mock.patch('api.v1.views.background_refresher')
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_stale_data_and_refresh_in_background(self, mock_cache, mock_background_refresher):
+        """get: return stale cache entries and refresh them in the background"""
+        # given
+        stale_entry = CacheEntry(self.record, soft_timeout=600, hard_timeout=3600, now=0)
+        fresh_entry = CacheEntry(self.record, soft_timeout=600, hard_timeout=3600)
+        mock_cache.get_many.return_value = {'weather_record:1': stale_entry, 'weather_record:2': fresh_entry}
+        # when
+        response = self.client.get(self.url, {'ids': '1,2'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(sorted(response.data), ['1', '2'])
+        mock_background_refresher.submit.assert_called_once_with(
+            mock.ANY, [1], {'language': 'en', 'ids': [1, 2]}, {'weather_record:1': mock.ANY}
+        )
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('api.v1.views.background_refresher')
+    @mock.patch.object(WeatherBatchView, 'get_api_client')
+    def test_get_refresh_stale_entries_once_for_concurrent_requests(
+        self, mock_get_api_client, mock_background_refresher
+    ):
+        """get: queue one refresh of a stale city for concurrent requests, until the refresh is done"""
+        # given
+        cache.clear()
+        cache.set('weather_record:1', CacheEntry(self.record, soft_timeout=600, hard_timeout=3600, now=0), version=1)
+        mock_get_api_client().get_data.return_value = {1: self.record}
+        # when
+        responses = [self.client.get(self.url, {'ids': '1'}) for _ in range(2)]
+        refresh, *args = mock_background_refresher.submit.call_args[0]
+        refresh(*args)
+        # then
+        self.assertEqual([response.data['1']['city'] for response in responses], ['Dubai', 'Dubai'])
+        mock_background_refresher.submit.assert_called_once()
+        mock_get_api_client().get_data.assert_called_once_with(city_ids=[1])
+        self.assertFalse(cache.get('weather_record:1', version=1).is_stale())
+        self.assertIsNone(cache.get('lease:weather_record:1', version=1))
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        CACHE_LEASE_POLL_INTERVAL=0.01,
+    )
+    @mock.patch.object(WeatherBatchView, 'get_api_client')
+    def test_get_fetch_misses_once_for_concurrent_requests(self, mock_get_api_client):
+        """get: fetch a missing city once for concurrent requests, the others wait for its cache entry"""
+        # given
+        cache.clear()
+        started = threading.Event()
+        release = threading.Event()
+
+        def get_data(city_ids):
+            started.set()
+            release.wait(1)
+            return {city_id: self.record for city_id in city_ids}
+
+        mock_get_api_client().get_data.side_effect = get_data
+        claim = single_flight.claim
+        claims = []
+
+        def claim_lease(*args):
+            leases = claim(*args)
+            claims.append(leases)
+            return leases
+
+        responses = []
+        requests = [
+            threading.Thread(target=lambda: responses.append(Client().get(self.url, {'ids': '1'})))
+            for _ in range(2)
+        ]
+        with mock.patch.object(single_flight, 'claim', side_effect=claim_lease):
+            requests[0].start()
+            started.wait(1)
+            requests[1].start()
+            while len(claims) < 2:
+                time.sleep(0.001)
+            # when
+            release.set()
+            for request in requests:
+                request.join(2)
+        # then
+        self.assertEqual([response.data['1']['city'] for response in responses], ['Dubai', 'Dubai'])
+        mock_get_api_client().get_data.assert_called_once_with(city_ids=[1])
+
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_not_modified_for_matching_etag(self, mock_cache):
+        """get: return an ETag covering every city and 304 if the client has the current version"""
+        # given
+        mock_cache.get_many.return_value = {
+            'weather_record:1': CacheEntry(self.record, soft_timeout=600, hard_timeout=3600),
+            'weather_record:2': CacheEntry(dict(self.record, city='Berlin'), soft_timeout=600, hard_timeout=3600),
+        }
+        response = self.client.get(self.url, {'ids': '1,2'})
+        # when
+        not_modified = self.client.get(self.url, {'ids': '1,2'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        other_cities = self.client.get(self.url, {'ids': '2,1'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        # then
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified['Cache-Control'], response['Cache-Control'])
+        self.assertEqual(other_cities.status_code, HTTPStatus.OK)
+
+    @mock.patch.object(WeatherBatchView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_no_etag_with_errors(self, mock_cache, mock_get_api_client):
+        """get: do not let clients cache responses with errors"""
+        # given
+        mock_cache.get_many.return_value = {}
+        mock_get_api_client().get_data.return_value = {}
+        # when
+        response = self.client.get(self.url, {'ids': '1'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    @override_settings(API_CACHE_ENCODED_RESPONSES=True)
+    @mock.patch.object(WeatherBatchView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_splice_encoded_responses(self, mock_cache, mock_get_api_client):
+        """get: build the response from the cached bodies and cache the bodies of fetched cities"""
+        # given
+        body = b'{"city":"Dubai"}'
+        mock_cache.get_many.return_value = {'weather_body:en:1': CacheEntry(body, soft_timeout=600, hard_timeout=3600)}
+        mock_get_api_client().get_data.return_value = {2: self.record}
+        # when
+        response = self.client.get(self.url, {'ids': '1,2,3'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        data = json.loads(response.content)
+        self.assertEqual(list(data), ['1', '2', '3'])
+        self.assertEqual(data['1'], {'city': 'Dubai'})
+        self.assertEqual(data['2']['wind'], {'speed': '3.1 m/s', 'direction': 'South-southeast'})
+        self.assertEqual(data['3'], {'error': 'City not found'})
+        stored = mock_cache.set_many.call_args[0][0]
+        self.assertEqual(json.loads(stored['weather_body:en:2'].data), data['2'])
+
+
+class ForecastViewTestCase(SimpleTestCase):
+    """ Tests for ForecastView """
+
+    def setUp(self):
+        self.url = reverse('api:v1:forecast', kwargs={'city_id': 1})
+        self.view = ForecastView()
+
+    def get_forecast(self):
+        steps = [
+            {'dt': 1596564000 + index * 10800, 'main': {'temp': 32, 'pressure': 997, 'humidity': 79},
+             'weather': [{'id': 801}], 'wind': {'speed': 3.1, 'deg': 150}}
+            for index in range(3)
+        ]
+        return Forecast.from_response({'list': steps, 'city': {'name': 'Dubai', 'timezone': 14400}})
+
+    def test_get_cache_key_return_language_neutral_cache_key(self):
+        """get_cache_key: return the same cache key for every language"""
+        # when/then
+        self.assertEqual(self.view.get_cache_key(language='de', city_id=1), 'forecast:1')
+
+    @override_settings(API_CACHE_ENCODED_RESPONSES=True)
+    @mock.patch.object(ForecastView, 'get_api_client')
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_forecast_from_api_and_cache_packed_forecast(self, mock_cache, mock_get_api_client):
+        """get: return forecast hitting api and cache it packed, also when responses are cached encoded"""
+        # given
+        forecast = self.get_forecast()
+        mock_cache.get.return_value = None
+        mock_get_api_client().get_data.return_value = forecast
+        # when
+        response = self.client.get(self.url)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['city'], 'Dubai')
+        mock_cache.set.assert_called_once_with('forecast:1', mock.ANY, timeout=10800, version=1)
+        self.assertEqual(mock_cache.set.call_args[0][1].data, forecast.pack())
+
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_localized_forecast_from_cache(self, mock_cache):
+        """get: return cached packed forecast rolled up per day and translated to the requested language"""
+        # given
+        entry = CacheEntry(self.get_forecast().pack(), soft_timeout=1800, hard_timeout=10800)
+        mock_cache.get.return_value = entry
+        # when
+        response = self.client.get(self.url)
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response['ETag'], f'"{entry.etag}-en"')
+        self.assertEqual([day['date'] for day in response.data['days']], ['2020-08-04', '2020-08-05'])
+        self.assertEqual(len(response.data['steps']), 3)
+        self.assertEqual(
+            response.data['steps'][0]['wind'], {'speed': '3.1 m/s', 'direction': 'South-southeast'}
+        )
+        mock_cache.get.assert_called_once_with('forecast:1', version=1)
 
 
 class CityListViewTestCase(SimpleTestCase):
@@ -131,6 +700,12 @@ class CityListViewTestCase(SimpleTestCase):
         # then
         self.assertEqual(actual, expected)
 
+    def test_get_cache_key_return_normalized_query(self):
+        """get_cache_key: return the same cache key for spellings with or without accents"""
+        # when/then
+        self.assertEqual(self.view.get_cache_key(language='de', query=' München'), 'city_list:de:munchen')
+        self.assertEqual(self.view.get_cache_key(language='de', query='MUNCHEN'), 'city_list:de:munchen')
+
     def test_get_input_serializer_class_return_input_serializer_class(self):
         """get_input_serializer_class: return serializer class for input data"""
         # when/then
@@ -164,7 +739,7 @@ class CityListViewTestCase(SimpleTestCase):
         """get: return city list from cache if available"""
         # given
         expected = [(1, 'Berlin, DE')]
-        mock_cache.get.return_value = expected
+        mock_cache.get.return_value = CacheEntry(expected, soft_timeout=600, hard_timeout=3600)
         mock_get_cache_key.return_value = 'cache-key'
         # when
         response = self.client.get(self.url)
@@ -211,7 +786,26 @@ class CityListViewTestCase(SimpleTestCase):
         self.assertTrue(response.status_code, HTTPStatus.OK)
         mock_cache.set.assert_called_once_with(
             cache_key,
-            expected,
-            timeout=600,
+            mock.ANY,
+            timeout=3600,
             version=1,
         )
+        entry = mock_cache.set.call_args[0][1]
+        self.assertEqual(entry.data, expected)
+        self.assertFalse(entry.is_stale())
+
+    @override_settings(CITY_LIST_SOURCE='local')
+    @mock.patch('api.v1.clients.get_city_index')
+    @mock.patch('api.v1.views.cache')
+    def test_get_return_cities_from_local_catalog(self, mock_cache, mock_get_city_index):
+        """get: search the local city catalog without cache or openweathermap"""
+        # given
+        expected = [{'id': 2950159, 'name': 'Berlin, DE'}]
+        mock_get_city_index().search.return_value = expected
+        # when
+        response = self.client.get(self.url, {'query': 'Berlin'})
+        # then
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, expected)
+        mock_get_city_index().search.assert_called_with('Berlin', limit=10)
+        mock_cache.get.assert_not_called()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from http import HTTPStatus
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from django.utils.translation import ugettext_lazy as _
+from django.views import View
+from rest_framework.request import Request
+
+from api.v1.caching import CacheEntry
+from api.v1.caching import async_cache
+from api.v1.caching import etag_matches
+from api.v1.clients import AsyncOpenWeatherMapClient
+from api.v1.clients import BaseOpenWeatherMapClient
+from api.v1.coalescing import async_single_flight
+from api.v1.exceptions import ExternalAPIError
+from api.v1.exceptions import UpstreamUnavailableError
+from api.v1.views import CityListView
+from api.v1.views import ForecastView
+from api.v1.views import WeatherDetailsView
+from weather_finder.metrics import CACHE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# keep a reference to background refreshes until they are done, the event loop only keeps weak references
+_background_tasks = set()
+
+
+class AsyncWeatherAPIView(View):
+    """
+    Async counterpart of BaseWeatherAPIView, meant to be served by the ASGI app
+
+    Cache keys, input validation, api clients and response data come from the sync `view_class`, so both views
+    share their cache entries. Upstream requests and redis calls are awaited instead of blocking a thread.
+    """
+
+    view_class = None
+    http_method_names = ['get', 'options']
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Django < 4.1 only recognizes async function views, mark the class based view as one
+        view._is_coroutine = asyncio.coroutines._is_coroutine
+        return view
+
+    def render(self, data, status=HTTPStatus.OK):
+        """Render response data with the renderer of the sync views"""
+        renderer = self.view_class.renderer_classes[0]()
+        return HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+
+    def render_entry(self, view, entry, input_data, cache_status):
+        """Render the response for a cache entry like BaseWeatherAPIView.get_cached_response"""
+        etag = view.get_etag(entry, input_data)
+        if etag_matches(self.request.META.get('HTTP_IF_NONE_MATCH'), etag):
+            response = HttpResponseNotModified()
+        elif view.is_encoded(entry):
+            response = HttpResponse(entry.data, content_type=self.view_class.renderer_classes[0].media_type)
+        else:
+            response = self.render(view.get_response_data(entry.data, input_data))
+        response['ETag'] = etag
+        response['Cache-Control'] = entry.get_cache_control()
+        response['X-Cache'] = cache_status
+        return response
+
+    async def get(self, request, **kwargs):
+        view = self.view_class()
+        request_data = view.get_request_data(Request(request), **kwargs)
+        serializer_class = view.get_input_serializer_class()
+        serializer = serializer_class(data=request_data)
+        if not serializer.is_valid():
+            logger.error('Weather API request received with invalid data %s', kwargs)
+            return self.render({'error': serializer.errors}, status=HTTPStatus.BAD_REQUEST)
+
+        input_data = serializer.data
+        view.track_request(input_data)
+        if not view.should_cache():
+            data = await self.call_api(view, input_data)
+            return self.render(view.get_response_data(data, input_data))
+
+        cache_key = view.get_cache_key(**input_data)
+        with CACHE_LATENCY.labels('get').time():
+            entry = await async_cache.get(cache_key, version=view.CACHE_VERSION)
+        if isinstance(entry, CacheEntry):
+            cache_status = 'HIT'
+            if entry.is_stale():
+                cache_status = 'STALE'
+                task = asyncio.ensure_future(self.refresh_response(view, cache_key, input_data))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+            view.count_cache_status(cache_status)
+            return self.render_entry(view, entry, input_data, cache_status)
+
+        view.count_cache_status('MISS')
+        try:
+            entry = await async_single_flight.do(
+                async_cache, cache_key, view.CACHE_VERSION, lambda: self.fetch_response(view, cache_key, input_data)
+            )
+        except UpstreamUnavailableError as error:
+            logger.warning('OpenWeatherMap can not be called for params %s', input_data)
+            response = self.render(
+                {'error': _('Something went wrong! Please try again later')}, status=HTTPStatus.SERVICE_UNAVAILABLE,
+            )
+            response['X-Cache'] = 'MISS'
+            response['Retry-After'] = str(error.retry_after)
+            return response
+        except ExternalAPIError:
+            logger.error('External API returned invalid response for params %s', input_data)
+            response = self.render(
+                {'error': _('Something went wrong! Please try again later')}, status=HTTPStatus.INTERNAL_SERVER_ERROR,
+            )
+            response['X-Cache'] = 'MISS'
+            return response
+        return self.render_entry(view, entry, input_data, 'MISS')
+
+    async def call_api(self, view, input_data):
+        """Call the api client of the sync view, on the event loop if it talks to openweathermap"""
+        client = view.get_api_client(**input_data)
+        if isinstance(client, BaseOpenWeatherMapClient):
+            return await AsyncOpenWeatherMapClient(client).get_data(**input_data)
+        # in-process clients may hit the database, which is not allowed on the event loop
+        return await sync_to_async(client.get_data)(**input_data)
+
+    async def fetch_response(self, view, cache_key, input_data):
+        """Fetch response from openweathermap api and store it in cache"""
+        entry = CacheEntry(
+            view.get_entry_data(await self.call_api(view, input_data), input_data),
+            soft_timeout=int(view.CACHE_TIMEOUT),
+            hard_timeout=int(view.CACHE_HARD_TIMEOUT),
+        )
+        with CACHE_LATENCY.labels('set').time():
+            await async_cache.set(
+                cache_key, entry, timeout=int(view.CACHE_HARD_TIMEOUT), version=int(view.CACHE_VERSION)
+            )
+        return entry
+
+    async def refresh_response(self, view, cache_key, input_data):
+        """Refresh stale cache entry in the background, keep serving the stale entry if the api fails"""
+        try:
+            await async_single_flight.do(
+                async_cache,
+                cache_key,
+                view.CACHE_VERSION,
+                lambda: self.fetch_response(view, cache_key, input_data),
+                wait=False,
+            )
+        except ExternalAPIError:
+            logger.warning('Could not refresh stale cache entry %s, serving stale data', cache_key)
+
+
+class AsyncWeatherDetailsView(AsyncWeatherAPIView):
+    """
+    Async view to retrieve weather data for given city and language using openweathermap weather api
+    """
+
+    view_class = WeatherDetailsView
+
+
+class AsyncCityListView(AsyncWeatherAPIView):
+    """
+    Async view to retrieve city lists for given query using openweathermap bulk api
+    """
+
+    view_class = CityListView
+
+
+class AsyncForecastView(AsyncWeatherAPIView):
+    """
+    Async view to retrieve the forecast for given city and language using openweathermap forecast api
+    """
+
+    view_class = ForecastView
@@ -0,0 +1,173 @@
+import logging
+import math
+import time
+import uuid
+
+import redis
+from django.conf import settings
+
+from api.v1.caching import get_redis_client
+from api.v1.exceptions import BudgetExceededError
+from weather_finder.metrics import UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Refill the bucket for the time elapsed on the redis clock, then take a token if the priority leaves at least
+# its reserve in the bucket and the calls allowed in the last 60 seconds, logged in a sorted set, stay below the
+# calls per minute. Counts allowed and denied calls per priority in the usage hash of the minute.
+ACQUIRE_SCRIPT = """
+-- redis < 5 needs effects replication to write after reading the clock
+if redis.replicate_commands then redis.replicate_commands() end
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local calls_per_minute = tonumber(ARGV[5])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', tostring(now - 60))
+local allowed = 0
+local wait = 0
+if redis.call('ZCARD', KEYS[3]) >= calls_per_minute then
+    local oldest = redis.call('ZRANGE', KEYS[3], 0, 0, 'WITHSCORES')
+    wait = tonumber(oldest[2]) + 60 - now
+elseif tokens - 1 >= reserve then
+    tokens = tokens - 1
+    allowed = 1
+    redis.call('ZADD', KEYS[3], tostring(now), ARGV[6])
+    redis.call('EXPIRE', KEYS[3], 61)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+redis.call('HINCRBY', KEYS[2], ARGV[4] .. (allowed == 1 and ':allowed' or ':denied'), 1)
+redis.call('EXPIRE', KEYS[2], 3600)
+return {allowed, tostring(tokens), tostring(wait)}
+"""
+
+# Empty the bucket, eg: when openweathermap answered 429 to a call the budget allowed
+DRAIN_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local clock = redis.call('TIME')
+redis.call('HMSET', KEYS[1], 'tokens', '0', 'updated', tostring(tonumber(clock[1]) + tonumber(clock[2]) / 1000000))
+"""
+
+
+class RateBudget:
+    """
+    Token bucket in redis shared by all workers, checked before every openweathermap call
+
+    The bucket refills at OPEN_WEATHER_API_CALLS_PER_MINUTE and holds at most OPEN_WEATHER_API_BURST tokens,
+    the calls that can be made at once after a quiet period. The calls allowed in the last 60 seconds are logged
+    as well, so a burst on top of the refill never takes any 60 seconds over the calls per minute.
+
+    Every call has a priority: a call is only allowed if it leaves the reserve of its priority (a share of the
+    bucket, OPEN_WEATHER_API_PRIORITY_RESERVES) for the calls of higher priorities, so autocomplete and pre-warm
+    calls are shed first when the budget runs low. Without redis, or when redis fails, calls are allowed.
+    """
+
+    def __init__(self, key='owm_budget'):
+        self.key = key
+        self._acquire = None
+        self._drain = None
+
+    def get_capacity(self):
+        """Return the number of tokens of a full bucket"""
+        return min(settings.OPEN_WEATHER_API_BURST, settings.OPEN_WEATHER_API_CALLS_PER_MINUTE)
+
+    def get_refill_rate(self):
+        """Return the number of tokens added per second, the capacity only caps the burst"""
+        return settings.OPEN_WEATHER_API_CALLS_PER_MINUTE / 60
+
+    def get_reserve(self, priority):
+        """Return the number of tokens a call of given priority must leave in the bucket"""
+        return settings.OPEN_WEATHER_API_PRIORITY_RESERVES[priority] * self.get_capacity()
+
+    def get_window_key(self):
+        """Return the key of the sorted set of the calls allowed in the last 60 seconds"""
+        return f'{self.key}:window'
+
+    def get_usage_key(self, now=None):
+        """Return the key of the usage hash of the current minute"""
+        return f'{self.key}:usage:{int((time.time() if now is None else now) // 60)}'
+
+    def acquire(self, priority):
+        """
+        Take a token for one openweathermap call
+
+        Args:
+            priority: priority class of the call, a key of OPEN_WEATHER_API_PRIORITY_RESERVES
+        Raises:
+            BudgetExceededError: if the call would use tokens reserved for higher priorities
+        """
+        if not settings.OPEN_WEATHER_API_RATE_BUDGET:
+            return
+        client = get_redis_client()
+        if client is None:
+            return
+        if self._acquire is None:
+            self._acquire = client.register_script(ACQUIRE_SCRIPT)
+        reserve = self.get_reserve(priority)
+        rate = self.get_refill_rate()
+        try:
+            allowed, tokens, wait = self._acquire(
+                keys=[self.key, self.get_usage_key(), self.get_window_key()],
+                args=[
+                    self.get_capacity(),
+                    rate,
+                    reserve,
+                    priority,
+                    settings.OPEN_WEATHER_API_CALLS_PER_MINUTE,
+                    uuid.uuid4().hex,
+                ],
+                client=client,
+            )
+        except redis.RedisError:
+            logger.warning('Could not check the openweathermap call budget, allowing the call')
+            return
+        if not allowed:
+            retry_after = math.ceil(max((reserve + 1 - float(tokens)) / rate, float(wait)))
+            UPSTREAM_ERRORS.labels('budget').inc()
+            raise BudgetExceededError(priority, retry_after=retry_after)
+
+    def drain(self):
+        """Empty the bucket, the next calls wait for it to refill"""
+        client = get_redis_client()
+        if client is None:
+            return
+        if self._drain is None:
+            self._drain = client.register_script(DRAIN_SCRIPT)
+        try:
+            self._drain(keys=[self.key], client=client)
+        except redis.RedisError:
+            logger.warning('Could not drain the openweathermap call budget')
+
+    def get_usage(self, now=None):
+        """
+        Get the state of the budget
+
+        Returns: dict of the tokens left, the bucket capacity and the allowed and denied calls per priority
+            during the current minute, None without redis
+        """
+        client = get_redis_client()
+        if client is None:
+            return None
+        now = time.time() if now is None else now
+        tokens, updated = client.hmget(self.key, 'tokens', 'updated')
+        capacity = self.get_capacity()
+        if tokens is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, float(tokens) + max(now - float(updated), 0) * self.get_refill_rate())
+        calls = {
+            priority: {'allowed': 0, 'denied': 0} for priority in settings.OPEN_WEATHER_API_PRIORITY_RESERVES
+        }
+        for field, count in client.hgetall(self.get_usage_key(now)).items():
+            priority, outcome = field.decode().split(':')
+            calls.setdefault(priority, {'allowed': 0, 'denied': 0})[outcome] = int(count)
+        return {'tokens': tokens, 'capacity': capacity, 'calls': calls}
+
+
+rate_budget = RateBudget()
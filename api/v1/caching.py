@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from django_redis.cache import RedisCache
+
+# Delete the keys that still hold the given values, in one step so that no other process can set them in between
+COMPARE_AND_DELETE_SCRIPT = """
+local deleted = 0
+for index, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[index] then
+        deleted = deleted + redis.call('DEL', key)
+    end
+end
+return deleted
+"""
+
+
+def compute_etag(data):
+    """
+    Compute a strong ETag for cached data
+
+    Args:
+        data: encoded response body, or data to hash in its canonical JSON form
+    Returns: hex digest of the data, without the quotes of the ETag header
+    """
+    if not isinstance(data, bytes):
+        data = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """Return True if an If-None-Match header matches given quoted ETag, weak tags match as RFC 7232 asks"""
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in etags)
+
+
+def get_cache_control(soft_expiry, hard_expiry, now=None):
+    """
+    Build a Cache-Control header following the remaining lifetime of cached data
+
+    Args:
+        soft_expiry: timestamp after which the data is stale
+        hard_expiry: timestamp after which the data is dropped from cache
+    Returns: header value, fresh until the soft expiry and usable while revalidating until the hard expiry
+    """
+    now = time.time() if now is None else now
+    max_age = max(int(soft_expiry - now), 0)
+    stale_while_revalidate = max(int(hard_expiry - max(now, soft_expiry)), 0)
+    return f'public, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}'
+
+
+class CacheEntry:
+    """
+    Cached api response with a soft expiry
+
+    The entry is stored with the hard timeout of the view. Once the soft expiry is reached the data is still
+    served, but considered stale and refreshed in the background. The ETag of the data is computed once and
+    stored with it.
+    """
+
+    __slots__ = ('data', 'soft_expiry', 'hard_expiry', 'etag')
+
+    def __init__(self, data, soft_timeout, hard_timeout, now=None):
+        now = time.time() if now is None else now
+        self.data = data
+        self.soft_expiry = now + soft_timeout
+        self.hard_expiry = now + max(hard_timeout, soft_timeout)
+        self.etag = compute_etag(data)
+
+    def __getstate__(self):
+        return self.data, self.soft_expiry, self.hard_expiry, self.etag
+
+    def __setstate__(self, state):
+        self.data, self.soft_expiry, self.hard_expiry = state[:3]
+        # entries cached before ETags were stored get theirs on load
+        self.etag = state[3] if len(state) > 3 else compute_etag(self.data)
+
+    def is_stale(self, now=None):
+        """Return True if the soft expiry of the entry has passed"""
+        return (time.time() if now is None else now) >= self.soft_expiry
+
+    def get_cache_control(self, now=None):
+        """Return the Cache-Control header of a response built from the entry"""
+        return get_cache_control(self.soft_expiry, self.hard_expiry, now)
+
+
+class LazyThreadPool:
+    """Bounded pool of threads created lazily in each process, sized by the given setting"""
+
+    def __init__(self, workers_setting, thread_name_prefix):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.workers_setting = workers_setting
+        self.thread_name_prefix = thread_name_prefix
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, self.workers_setting), thread_name_prefix=self.thread_name_prefix
+                )
+        return self._executor.submit(fn, *args, **kwargs)
+
+
+# refreshes stale cache entries
+background_refresher = LazyThreadPool('CACHE_REFRESH_WORKERS', 'cache-refresh')
+# fetches chunks of batch requests from openweathermap in parallel
+batch_fetcher = LazyThreadPool('WEATHER_BATCH_WORKERS', 'batch-fetch')
+
+
+def get_redis_client(alias=DEFAULT_CACHE_ALIAS):
+    """
+    Get the redis client behind a django cache, for data structures the cache api does not offer
+
+    Args:
+        alias: cache alias, the redis cache of a TwoTierCache is used
+    Returns: redis client, None if the cache is not a redis cache
+    """
+    backend = caches[alias]
+    backend = getattr(backend, 'l2', backend)
+    if not isinstance(backend, RedisCache):
+        return None
+    return backend.client.get_client(write=True)
+
+
+def get_redis_backend(cache):
+    """
+    Get the django-redis cache behind a django cache
+
+    Args:
+        cache: django cache, or the proxy of the default cache. The redis cache of a TwoTierCache is used
+    Returns: django-redis cache, None if the cache is not a redis cache
+    """
+    backend = getattr(cache, 'l2', cache)
+    client = getattr(backend, 'client', None)
+    if client is None or not hasattr(client, 'get_client'):
+        return None
+    return backend
+
+
+def compare_and_delete(cache, values, version=None):
+    """
+    Delete the keys of a django cache that still hold the given values
+
+    Atomic on redis caches, other backends read and delete the keys in two steps.
+
+    Args:
+        cache: django cache
+        values: dict of cache keys to the value they must still hold to be deleted
+        version: cache version of the keys
+    """
+    if not values:
+        return
+    backend = get_redis_backend(cache)
+    if backend is None:
+        current = cache.get_many(list(values), version=version)
+        cache.delete_many([key for key, value in values.items() if current.get(key) == value], version=version)
+        return
+    keys = [backend.client.make_key(key, version=version) for key in values]
+    args = [backend.client.encode(value) for value in values.values()]
+    backend.client.get_client(write=True).eval(COMPARE_AND_DELETE_SCRIPT, len(keys), *keys, *args)
+
+
+class AsyncCache:
+    """
+    Async access to a django cache
+
+    Redis caches are queried with redis.asyncio, using the key format and serialization of django-redis so that
+    entries are shared with the sync views. Other backends are called in a thread. The async path skips the
+    in-process L1 of TwoTierCache and reads and writes its redis cache directly.
+    """
+
+    def __init__(self, alias=DEFAULT_CACHE_ALIAS):
+        self.alias = alias
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _backend(self):
+        backend = caches[self.alias]
+        return getattr(backend, 'l2', backend)
+
+    def _redis(self, backend):
+        """Return redis.asyncio client of the running event loop, None if the backend is not a redis cache"""
+        if not isinstance(backend, RedisCache):
+            return None
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            # imported on first use, only the async views need redis.asyncio
+            import redis.asyncio
+
+            # the first server of LOCATION is the one django-redis writes to
+            client = self._clients[loop] = redis.asyncio.from_url(backend.client._server[0])
+        return client
+
+    async def get(self, key, default=None, version=None):
+        backend = self._backend()
+        client = self._redis(backend)
+        if client is None:
+            return await sync_to_async(backend.get)(key, default, version=version)
+        value = await client.get(backend.client.make_key(key, version=version))
+        return default if value is None else backend.client.decode(value)
+
+    async def get_many(self, keys, version=None):
+        backend = self._backend()
+        client = self._redis(backend)
+        if client is None:
+            return await sync_to_async(backend.get_many)(keys, version=version)
+        if not keys:
+            return {}
+        values = await client.mget([backend.client.make_key(key, version=version) for key in keys])
+        return {key: backend.client.decode(value) for key, value in zip(keys, values) if value is not None}
+
+    async def set(self, key, value, timeout, version=None):
+        backend = self._backend()
+        client = self._redis(backend)
+        if client is None:
+            return await sync_to_async(backend.set)(key, value, timeout=timeout, version=version)
+        await client.set(backend.client.make_key(key, version=version), backend.client.encode(value), ex=timeout)
+
+    async def add(self, key, value, timeout, version=None):
+        backend = self._backend()
+        client = self._redis(backend)
+        if client is None:
+            return await sync_to_async(backend.add)(key, value, timeout=timeout, version=version)
+        return bool(
+            await client.set(
+                backend.client.make_key(key, version=version), backend.client.encode(value), ex=timeout, nx=True
+            )
+        )
+
+    async def compare_and_delete(self, values, version=None):
+        """Delete the keys that still hold the given values, see `compare_and_delete`"""
+        backend = self._backend()
+        client = self._redis(backend)
+        if client is None:
+            return await sync_to_async(compare_and_delete)(backend, values, version=version)
+        if not values:
+            return
+        keys = [backend.client.make_key(key, version=version) for key in values]
+        args = [backend.client.encode(value) for value in values.values()]
+        await client.eval(COMPARE_AND_DELETE_SCRIPT, len(keys), *keys, *args)
+
+    async def delete(self, key, version=None):
+        backend = self._backend()
+        client = self._redis(backend)
+        if client is None:
+            return await sync_to_async(backend.delete)(key, version=version)
+        return bool(await client.delete(backend.client.make_key(key, version=version)))
+
+
+async_cache = AsyncCache()
@@ -0,0 +1,409 @@
+import heapq
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections import defaultdict
+
+from django.conf import settings
+
+from api.models import City
+from api.models import CityName
+
+# letters without a unicode decomposition to their ascii base letter
+_FOLDED_LETTERS = str.maketrans(
+    {'ł': 'l', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'ħ': 'h', 'ı': 'i', 'æ': 'ae', 'œ': 'oe', 'þ': 'th', '-': ' ', "'": ' '}
+)
+
+
+def normalize_city_name(name):
+    """
+    Normalize city name for search: case and accent insensitive, with collapsed whitespace
+
+    Args:
+        name: city name or search query
+    Returns: normalized name. eg: munchen for München
+    """
+    name = unicodedata.normalize('NFKD', name.casefold())
+    name = ''.join(char for char in name if not unicodedata.combining(char)).translate(_FOLDED_LETTERS)
+    return ' '.join(name.split())
+
+
+def get_trigrams(key):
+    """Return the set of trigrams of a normalized name, padded to weigh the start of the name"""
+    padded = f'  {key} '
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+def get_trigram_code(trigram):
+    """Pack a trigram into one integer, three 21 bit code points"""
+    return (ord(trigram[0]) << 42) | (ord(trigram[1]) << 21) | ord(trigram[2])
+
+
+def get_similarity(trigrams, other_trigrams):
+    """Return jaccard similarity of two trigram sets"""
+    shared = len(trigrams & other_trigrams)
+    return shared / (len(trigrams) + len(other_trigrams) - shared)
+
+
+def get_city_rows(language):
+    """
+    Return city rows for the index of given language: every city with its catalog name
+    and its localized names in that language
+
+    Returns: list of (id, name, country, population) tuples
+    """
+    cities = {
+        city_id: (name, country, population)
+        for city_id, name, country, population in City.objects.values_list('id', 'name', 'country', 'population')
+    }
+    rows = [(city_id, name, country, population) for city_id, (name, country, population) in cities.items()]
+    for city_id, name in CityName.objects.filter(language=language).values_list('city_id', 'name').iterator():
+        catalog_name, country, population = cities[city_id]
+        if normalize_city_name(name) != normalize_city_name(catalog_name):
+            rows.append((city_id, name, country, population))
+    return rows
+
+
+class BaseCityIndex:
+    """
+    Search index over the local city catalog
+
+    Cities are kept sorted by normalized name, so all names starting with a prefix form one contiguous range
+    found with two binary searches. Matches are ranked by exact match first, then population. If the prefix
+    search finds too few cities, names sharing the most trigrams with the query are added, ranked by similarity.
+    Subclasses provide `keys`, `populations` and `ids` sequences, `get_postings`, `get_key` and `get_name`.
+    """
+
+    keys = populations = ids = ()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode_key(self, key):
+        """Return normalized name in the representation used by `keys`"""
+        return key
+
+    def get_key(self, position):
+        """Return normalized name of the city at given position"""
+        return self.keys[position]
+
+    def get_name(self, position):
+        """Return display name of the city at given position. eg: Berlin, DE"""
+        raise NotImplementedError
+
+    def get_postings(self, trigram):
+        """Return positions of the names containing trigram"""
+        raise NotImplementedError
+
+    def get_range(self, prefix):
+        """Return start and end positions of names starting with prefix"""
+        start = bisect_left(self.keys, self.encode_key(prefix), 0, len(self))
+        end = bisect_left(self.keys, self.encode_key(prefix + '\U0010ffff'), start, len(self))
+        return start, end
+
+    def search_prefix(self, prefix, limit):
+        """Return positions of the best names starting with prefix"""
+        start, end = self.get_range(prefix)
+        exact_end = bisect_left(self.keys, self.encode_key(prefix + '\0'), start, end)
+        # exact matches come first and are already sorted by population, rank the rest of the range
+        positions = list(range(start, min(exact_end, start + limit)))
+        if len(positions) < limit:
+            positions += heapq.nsmallest(
+                limit - len(positions), range(exact_end, end), key=lambda position: -self.populations[position]
+            )
+        return positions
+
+    def search_similar(self, key, limit):
+        """Return positions of the names most similar to key"""
+        trigrams = get_trigrams(key)
+        postings = sorted((self.get_postings(trigram) for trigram in trigrams), key=len)
+        # the most common trigrams match a large share of all names and barely help finding candidates
+        counts = Counter()
+        for trigram_postings in postings:
+            if counts and len(trigram_postings) > settings.CITY_SEARCH_MAX_POSTINGS:
+                break
+            counts.update(trigram_postings)
+
+        scored = []
+        for position, _ in counts.most_common(settings.CITY_SEARCH_CANDIDATES):
+            similarity = get_similarity(trigrams, get_trigrams(self.get_key(position)))
+            if similarity >= settings.CITY_SEARCH_MIN_SIMILARITY:
+                scored.append((-similarity, -self.populations[position], position))
+        return [position for _, _, position in heapq.nsmallest(limit, scored)]
+
+    def search(self, query, limit=10):
+        """
+        Search cities by name: names starting with the query first, then similar names
+
+        Args:
+            query: search query
+            limit: maximum number of cities to return
+        Returns: list of cities in the format of CityListResponseSchema, best match first
+        """
+        key = normalize_city_name(query)
+        if not key:
+            return []
+
+        results = {}
+        # catalog and localized names of a city can both match, fetch extra positions to fill the limit
+        positions = self.search_prefix(key, limit * 2)
+        if len(positions) < limit:
+            positions += self.search_similar(key, limit * 2)
+        for position in positions:
+            city_id = self.ids[position]
+            if city_id not in results:
+                results[city_id] = {'id': city_id, 'name': self.get_name(position)}
+                if len(results) == limit:
+                    break
+        return list(results.values())
+
+
+class CityIndex(BaseCityIndex):
+    """In-memory city index built from the catalog in each process"""
+
+    def __init__(self, cities):
+        """
+        Args:
+            cities: iterable of (id, name, country, population) tuples
+        """
+        rows = sorted(
+            (normalize_city_name(name), -population, city_id, name, country)
+            for city_id, name, country, population in cities
+        )
+        self.keys = [row[0] for row in rows]
+        self.populations = [-row[1] for row in rows]
+        self.ids = [row[2] for row in rows]
+        self.names = [f'{row[3]}, {row[4]}' for row in rows]
+        self.postings = defaultdict(lambda: array('I'))
+        for position, key in enumerate(self.keys):
+            for trigram in get_trigrams(key):
+                self.postings[trigram].append(position)
+        self.postings.default_factory = None
+
+    @classmethod
+    def from_database(cls, language):
+        """Build index for given language from cities stored in the database"""
+        return cls(get_city_rows(language))
+
+    def get_name(self, position):
+        return self.names[position]
+
+    def get_postings(self, trigram):
+        return self.postings.get(trigram, ())
+
+
+class _Blob:
+    """Sequence view over variable length byte strings stored in a blob with an offsets array"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return bytes(self.blob[self.offsets[position]:self.offsets[position + 1]])
+
+
+class MappedCityIndex(BaseCityIndex):
+    """
+    City index read from a prebuilt file mapped read-only into memory
+
+    The file is shared by all worker processes through the OS page cache and searched in place. Layout after the
+    header, each section padded to 8 bytes: key offsets, keys, name offsets, names (uint32 offsets and utf-8
+    blobs), ids and populations (uint32), country codes (2 bytes), sorted trigram codes (uint64), trigram
+    posting offsets and postings (uint32). Keys are normalized names sorted as utf-8 bytes.
+    """
+
+    MAGIC = b'WFCI'
+    FORMAT_VERSION = 2
+    HEADER = struct.Struct('<4sHBxIIIII4x')
+
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self.stat = os.fstat(index_file.fileno())
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, little_endian, count, keys_size, names_size, trigrams, postings = self.HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != self.MAGIC or version != self.FORMAT_VERSION or little_endian != (sys.byteorder == 'little'):
+            raise ValueError(f'{path} is not a compatible city index file')
+
+        view = memoryview(self._mmap)
+        sizes = (
+            4 * (count + 1),
+            keys_size,
+            4 * (count + 1),
+            names_size,
+            4 * count,
+            4 * count,
+            2 * count,
+            8 * trigrams,
+            4 * (trigrams + 1),
+            4 * postings,
+        )
+        sections = []
+        offset = self.HEADER.size
+        for size in sizes:
+            sections.append(view[offset:offset + size])
+            offset += _padded(size)
+
+        self.keys = _Blob(sections[1], sections[0].cast('I'))
+        self.names = _Blob(sections[3], sections[2].cast('I'))
+        self.ids = sections[4].cast('I')
+        self.populations = sections[5].cast('I')
+        self.countries = sections[6]
+        self.trigram_codes = sections[7].cast('Q')
+        self.posting_offsets = sections[8].cast('I')
+        self.posting_positions = sections[9].cast('I')
+
+    def encode_key(self, key):
+        return key.encode()
+
+    def get_key(self, position):
+        return self.keys[position].decode()
+
+    def get_name(self, position):
+        country = bytes(self.countries[position * 2:position * 2 + 2]).rstrip(b'\0').decode()
+        return f'{self.names[position].decode()}, {country}'
+
+    def get_postings(self, trigram):
+        code = get_trigram_code(trigram)
+        position = bisect_left(self.trigram_codes, code)
+        if position == len(self.trigram_codes) or self.trigram_codes[position] != code:
+            return ()
+        return self.posting_positions[self.posting_offsets[position]:self.posting_offsets[position + 1]]
+
+    @classmethod
+    def write(cls, path, cities):
+        """
+        Write city index file, replacing the previous file atomically
+
+        Args:
+            path: index file path
+            cities: iterable of (id, name, country, population) tuples
+        """
+        rows = sorted(
+            (normalize_city_name(name).encode(), -population, city_id, name.encode(), country)
+            for city_id, name, country, population in cities
+        )
+        key_offsets, keys = _pack_blob(row[0] for row in rows)
+        name_offsets, names = _pack_blob(row[3] for row in rows)
+        ids = array('I', (row[2] for row in rows))
+        populations = array('I', (-row[1] for row in rows))
+        countries = b''.join(row[4].encode('ascii')[:2].ljust(2, b'\0') for row in rows)
+
+        postings = defaultdict(lambda: array('I'))
+        for position, row in enumerate(rows):
+            for trigram in get_trigrams(row[0].decode()):
+                postings[get_trigram_code(trigram)].append(position)
+        trigram_codes = array('Q', sorted(postings))
+        posting_offsets = array('I', [0])
+        posting_positions = array('I')
+        for code in trigram_codes:
+            posting_positions.extend(postings[code])
+            posting_offsets.append(len(posting_positions))
+
+        header = cls.HEADER.pack(
+            cls.MAGIC,
+            cls.FORMAT_VERSION,
+            sys.byteorder == 'little',
+            len(rows),
+            len(keys),
+            len(names),
+            len(trigram_codes),
+            len(posting_positions),
+        )
+        sections = (
+            key_offsets.tobytes(),
+            keys,
+            name_offsets.tobytes(),
+            names,
+            ids.tobytes(),
+            populations.tobytes(),
+            countries,
+            trigram_codes.tobytes(),
+            posting_offsets.tobytes(),
+            posting_positions.tobytes(),
+        )
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as index_file:
+            index_file.write(header)
+            for section in sections:
+                index_file.write(section)
+                index_file.write(b'\0' * (_padded(len(section)) - len(section)))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temporary_path, path)
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+def _pack_blob(values):
+    """Concatenate byte strings into a blob, returning uint32 offsets array and the blob"""
+    offsets = array('I', [0])
+    parts = []
+    for value in values:
+        parts.append(value)
+        offsets.append(offsets[-1] + len(value))
+    return offsets, b''.join(parts)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_city_index_path(language):
+    """Return path of the prebuilt city index file for given language"""
+    return settings.CITY_INDEX_PATH.format(language=language)
+
+
+def _load_city_index(language, current=None):
+    """
+    Load city index for given language
+
+    The prebuilt index file is mapped if it exists, a new file swapped in with `MappedCityIndex.write` is picked
+    up on the next check. Without a file the index is built from the database once.
+    """
+    try:
+        stat = os.stat(get_city_index_path(language))
+    except FileNotFoundError:
+        if isinstance(current, CityIndex):
+            return current
+        return CityIndex.from_database(language)
+
+    if isinstance(current, MappedCityIndex) and (current.stat.st_ino, current.stat.st_mtime_ns) == (
+        stat.st_ino,
+        stat.st_mtime_ns,
+    ):
+        return current
+    return MappedCityIndex(get_city_index_path(language))
+
+
+def get_city_index(language):
+    """Return city index for given language, loading it on first use and when the index file was replaced"""
+    now = time.monotonic()
+    item = _indexes.get(language)
+    if item is None or item[0] <= now:
+        with _indexes_lock:
+            item = _indexes.get(language)
+            if item is None or item[0] <= now:
+                index = _load_city_index(language, item and item[1])
+                item = _indexes[language] = (now + settings.CITY_INDEX_CHECK_INTERVAL, index)
+    return item[1]
+
+
+def reset_city_indexes():
+    """Drop indexes loaded in this process, they are loaded again on next use"""
+    with _indexes_lock:
+        _indexes.clear()
@@ -1,22 +1,54 @@
+import asyncio
 import logging
+import time
+from http import HTTPStatus
 
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from requests import ConnectionError as RequestsConnectionError
 from requests import RequestException
+from requests import Timeout
 
+from api.v1.budget import rate_budget
+from api.v1.cities import get_city_index
+from api.v1.exceptions import BudgetExceededError
 from api.v1.exceptions import ExternalAPIError
-from api.v1.transformers import CityListResponseSchema
-from api.v1.transformers import WeatherResponseSchema
+from api.v1.forecasts import Forecast
+from api.v1.resilience import circuit_breaker
+from api.v1.resilience import get_failure_cause
+from api.v1.resilience import get_retry_delay
+from api.v1.resilience import is_retryable
+from api.v1.resilience import is_upstream_failure
+from api.v1.resilience import upstream_latency
+from api.v1.sessions import async_session_pool
+from api.v1.sessions import session_pool
+from api.v1.transformers import transform_city_list
+from api.v1.transformers import transform_weather_record
+from api.v1.transformers import transform_weather_response
+from weather_finder.metrics import UPSTREAM_ERRORS
+from weather_finder.metrics import UPSTREAM_LATENCY
 
 logger = logging.getLogger(__name__)
 
 
 class BaseOpenWeatherMapClient:
-    """Base client class to communicate with openweathermap apis"""
+    """
+    Base client class to communicate with openweathermap apis
 
-    def __init__(self, api_key, language=settings.LANGUAGE_CODE):
+    Every call takes a token of the shared call budget for the priority of the client first, and fails right away
+    while the circuit breaker is open. Read timeouts follow the recent latency of openweathermap. Calls that did
+    not reach it or were failed by a gateway are retried OPEN_WEATHER_API_RETRIES times with jittered backoff,
+    all of them are idempotent GET requests.
+    """
+
+    PRIORITY = 'weather'
+    # openweathermap api called, the label of the upstream metrics
+    ENDPOINT = None
+
+    def __init__(self, api_key, language=settings.LANGUAGE_CODE, priority=None):
         self.api_key = api_key
         self.language = language
+        self.priority = priority or self.PRIORITY
 
     def get_url(self, *args, **kwargs):
         """Return url to hit openweathermap api"""
@@ -26,23 +58,112 @@ class BaseOpenWeatherMapClient:
         """Serialize data returned from the openweathermap api"""
         raise NotImplementedError
 
+    def record_latency(self, started):
+        """Record the duration of a call started at given monotonic time"""
+        elapsed = time.monotonic() - started
+        upstream_latency.record(elapsed)
+        UPSTREAM_LATENCY.labels(self.ENDPOINT).observe(elapsed)
+
     def get_data(self, *args, **kwargs):
         """Get data from openweather api"""
         url = self.get_url(*args, **kwargs)
-        response = requests.get(url, timeout=settings.OPEN_WEATHER_API_TIMEOUT)
-        try:
-            response.raise_for_status()
-        except RequestException:
-            logger.exception('OpenWeatherMap request failed')
-            raise ExternalAPIError
-
+        probe = circuit_breaker.before_call()
+        attempt = 0
+        while True:
+            try:
+                rate_budget.acquire(self.priority)
+            except BudgetExceededError:
+                circuit_breaker.release_probe(probe)
+                raise
+            started = time.monotonic()
+            try:
+                with session_pool.session() as session:
+                    response = session.get(url, timeout=session_pool.get_timeout())
+                self.record_latency(started)
+                if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+                    rate_budget.drain()
+                response.raise_for_status()
+                break
+            except RequestException as error:
+                timed_out = isinstance(error, Timeout)
+                if timed_out:
+                    self.record_latency(started)
+                status = error.response.status_code if error.response is not None else None
+                connection_failed = isinstance(error, RequestsConnectionError)
+                if attempt < settings.OPEN_WEATHER_API_RETRIES and is_retryable(status, connection_failed):
+                    attempt += 1
+                    time.sleep(get_retry_delay(attempt))
+                    continue
+                if is_upstream_failure(status):
+                    circuit_breaker.record_failure(probe)
+                else:
+                    circuit_breaker.record_success(probe)
+                UPSTREAM_ERRORS.labels(get_failure_cause(status, timed_out, connection_failed)).inc()
+                logger.exception('OpenWeatherMap request failed')
+                raise ExternalAPIError
+
+        circuit_breaker.record_success(probe)
         data = response.json()
         return self.get_serialized_data(data)
 
 
+class AsyncOpenWeatherMapClient:
+    """Send the requests of an openweathermap client through the pooled async http client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get_data(self, *args, **kwargs):
+        """Get data from openweather api without blocking the event loop"""
+        # imported on first use, only the async views need httpx
+        import httpx
+
+        url = self.client.get_url(*args, **kwargs)
+        # circuit breaker and call budget are checked in redis with the sync client
+        probe = await sync_to_async(circuit_breaker.before_call, thread_sensitive=False)()
+        attempt = 0
+        while True:
+            try:
+                await sync_to_async(rate_budget.acquire, thread_sensitive=False)(self.client.priority)
+            except BudgetExceededError:
+                await sync_to_async(circuit_breaker.release_probe, thread_sensitive=False)(probe)
+                raise
+            started = time.monotonic()
+            try:
+                response = await async_session_pool.get_client().get(url, timeout=async_session_pool.get_timeout())
+                self.client.record_latency(started)
+                if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+                    await sync_to_async(rate_budget.drain, thread_sensitive=False)()
+                response.raise_for_status()
+                break
+            except httpx.HTTPError as error:
+                timed_out = isinstance(error, httpx.TimeoutException)
+                if timed_out:
+                    self.client.record_latency(started)
+                status = error.response.status_code if isinstance(error, httpx.HTTPStatusError) else None
+                connection_failed = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt < settings.OPEN_WEATHER_API_RETRIES and is_retryable(status, connection_failed):
+                    attempt += 1
+                    await asyncio.sleep(get_retry_delay(attempt))
+                    continue
+                if is_upstream_failure(status):
+                    await sync_to_async(circuit_breaker.record_failure, thread_sensitive=False)(probe)
+                else:
+                    await sync_to_async(circuit_breaker.record_success, thread_sensitive=False)(probe)
+                UPSTREAM_ERRORS.labels(get_failure_cause(status, timed_out, connection_failed)).inc()
+                logger.exception('OpenWeatherMap request failed')
+                raise ExternalAPIError
+
+        await sync_to_async(circuit_breaker.record_success, thread_sensitive=False)(probe)
+        data = response.json()
+        return self.client.get_serialized_data(data)
+
+
 class OpenWeatherMapWeatherClient(BaseOpenWeatherMapClient):
     """Client class to get the weather details for given city using openweathermap api"""
 
+    ENDPOINT = 'weather'
+
     def get_url(self, *args, **kwargs):
         return (
             f"{settings.OPEN_WEATHER_API_BASE_URL}weather?id={kwargs['city_id']}"
@@ -50,16 +171,80 @@ class OpenWeatherMapWeatherClient(BaseOpenWeatherMapClient):
         )
 
     def get_serialized_data(self, data):
-        return WeatherResponseSchema().dump(data)
+        return transform_weather_response(data, self.language)
+
+
+class OpenWeatherMapWeatherRecordClient(OpenWeatherMapWeatherClient):
+    """Client class to get the language neutral weather record for given city using openweathermap api"""
+
+    def get_serialized_data(self, data):
+        return transform_weather_record(data)
+
+
+class OpenWeatherMapGroupClient(BaseOpenWeatherMapClient):
+    """Client class to get the weather details for up to 20 cities in one call using openweathermap group api"""
+
+    ENDPOINT = 'group'
+
+    def get_url(self, *args, **kwargs):
+        city_ids = ','.join(str(city_id) for city_id in kwargs['city_ids'])
+        return (
+            f"{settings.OPEN_WEATHER_API_BASE_URL}group?id={city_ids}"
+            f"&lang={self.language}&appid={self.api_key}&units=metric"
+        )
+
+    def get_serialized_data(self, data):
+        """Return serialized weather details by city id"""
+        return {item['id']: self.serialize_item(item) for item in data['list']}
+
+    def serialize_item(self, data):
+        """Serialize the weather details of one city of the group"""
+        return transform_weather_response(data, self.language)
+
+
+class OpenWeatherMapGroupRecordClient(OpenWeatherMapGroupClient):
+    """Client class to get language neutral weather records for up to 20 cities using openweathermap group api"""
+
+    def serialize_item(self, data):
+        return transform_weather_record(data)
+
+
+class OpenWeatherMapForecastClient(BaseOpenWeatherMapClient):
+    """Client class to get the 5 day / 3 hour forecast for given city using openweathermap forecast api"""
+
+    ENDPOINT = 'forecast'
+
+    def get_url(self, *args, **kwargs):
+        return (
+            f"{settings.OPEN_WEATHER_API_BASE_URL}forecast?id={kwargs['city_id']}"
+            f"&appid={self.api_key}&units=metric"
+        )
+
+    def get_serialized_data(self, data):
+        return Forecast.from_response(data)
 
 
 class OpenWeatherMapCityClient(BaseOpenWeatherMapClient):
     """Client class to get the list of cities using openweathermap api"""
 
+    PRIORITY = 'autocomplete'
+    ENDPOINT = 'find'
+
     def get_url(self, *args, **kwargs):
         return (
             f"{settings.OPEN_WEATHER_API_BASE_URL}find?q={kwargs['query']}&lang={self.language}&appid={self.api_key}"
         )
 
     def get_serialized_data(self, data):
-        return CityListResponseSchema().dump(data['list'], many=True)
+        return transform_city_list(data['list'])
+
+
+class LocalCityClient:
+    """Client class to search the list of cities in the local city catalog, without calling openweathermap"""
+
+    def __init__(self, language=settings.LANGUAGE_CODE):
+        self.language = language
+
+    def get_data(self, *args, **kwargs):
+        """Get cities whose name starts with the query"""
+        return get_city_index(self.language).search(kwargs['query'], limit=settings.CITY_SEARCH_LIMIT)
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from api.v1.caching import CacheEntry
+from api.v1.caching import compare_and_delete
+from weather_finder.metrics import COALESCED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """In-flight fetch shared by all threads waiting on the same cache key"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent cache misses for the same key into a single upstream fetch
+
+    Within a process, threads missing the same key wait for the first one and share its result.
+    Across processes and hosts, a short lease stored in the shared cache (SET NX on redis) lets exactly
+    one fetcher refresh the key while the others poll the cache for a moment before giving up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.fetches = 0
+        self.coalesced_local = 0
+        self.coalesced_remote = 0
+
+    def do(self, cache, key, version, fetch, wait=True):
+        """
+        Return the result of `fetch` for given cache key, running it at most once at a time
+
+        Args:
+            cache: django cache holding the value and the lease
+            key: cache key of the value being fetched
+            version: cache version of the value being fetched
+            fetch: callable that fetches the value and stores it in the cache
+            wait: wait for the value if another process holds the lease, otherwise return None right away
+        Returns: fetched value
+        """
+        call_key = (key, version)
+        with self._lock:
+            call = self._calls.get(call_key)
+            leader = call is None
+            if leader:
+                call = self._calls[call_key] = _Call()
+            else:
+                self.coalesced_local += 1
+                COALESCED_REQUESTS.labels('local').inc()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._fetch_with_lease(cache, key, version, fetch, wait)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[call_key]
+            call.event.set()
+        return call.result
+
+    def _fetch_with_lease(self, cache, key, version, fetch, wait):
+        """Fetch the value if no other process holds the lease, otherwise wait for its result"""
+        lease_key = f'lease:{key}'
+        token = uuid.uuid4().hex
+        if cache.add(lease_key, token, timeout=settings.CACHE_LEASE_TIMEOUT, version=version):
+            try:
+                return self._fetch(fetch)
+            finally:
+                self.release(cache, {key: token}, version)
+
+        if not wait:
+            return None
+        deadline = time.monotonic() + settings.CACHE_LEASE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(settings.CACHE_LEASE_POLL_INTERVAL)
+            value = cache.get(key, version=version)
+            # entries of an older format may still be cached under the key, only the new entry ends the wait
+            if isinstance(value, CacheEntry):
+                with self._lock:
+                    self.coalesced_remote += 1
+                COALESCED_REQUESTS.labels('remote').inc()
+                return value
+
+        logger.warning('Cache lease for %s was not released in time, fetching anyway', key)
+        return self._fetch(fetch)
+
+    def _fetch(self, fetch):
+        with self._lock:
+            self.fetches += 1
+        return fetch()
+
+    def claim(self, cache, keys, version):
+        """
+        Take the lease of every given cache key no other thread or process is fetching
+
+        Returns: dict of the claimed keys to the token releasing their lease
+        """
+        leases = {}
+        for key in keys:
+            token = uuid.uuid4().hex
+            if cache.add(f'lease:{key}', token, timeout=settings.CACHE_LEASE_TIMEOUT, version=version):
+                leases[key] = token
+        return leases
+
+    def release(self, cache, leases, version):
+        """Release leases returned by `claim`, unless they expired and were taken by someone else since"""
+        compare_and_delete(cache, {f'lease:{key}': token for key, token in leases.items()}, version=version)
+
+    def do_many(self, cache, keys, version, fetch, wait=True):
+        """
+        Fetch the values of many cache keys at once, leaving out the keys another thread or process is fetching
+
+        The keys leased by others are polled for until CACHE_LEASE_WAIT and fetched anyway after that, like `do`.
+
+        Args:
+            cache: django cache holding the values and the leases
+            keys: dict of the cache keys of the values to the ids given to `fetch`. eg: city ids
+            version: cache version of the values being fetched
+            fetch: callable given a list of ids, fetching their values and storing them in the cache. Returns
+                values by id and errors by id
+            wait: wait for the values of keys leased by others, otherwise leave them out
+        Returns: values by id, the cached CacheEntry for the keys fetched by others, and errors by id
+        """
+        leases = self.claim(cache, keys, version)
+        values, errors = {}, {}
+        if leases:
+            try:
+                values, errors = self._fetch(lambda: fetch([keys[key] for key in leases]))
+            finally:
+                self.release(cache, leases, version)
+
+        waiting = [key for key in keys if key not in leases]
+        if not waiting or not wait:
+            return values, errors
+        deadline = time.monotonic() + settings.CACHE_LEASE_WAIT
+        while waiting and time.monotonic() < deadline:
+            time.sleep(settings.CACHE_LEASE_POLL_INTERVAL)
+            cached = cache.get_many(waiting, version=version)
+            for key, value in cached.items():
+                if isinstance(value, CacheEntry):
+                    values[keys[key]] = value
+                    with self._lock:
+                        self.coalesced_remote += 1
+                    COALESCED_REQUESTS.labels('remote').inc()
+            waiting = [key for key in waiting if keys[key] not in values]
+
+        if waiting:
+            logger.warning('Cache leases for %s were not released in time, fetching anyway', waiting)
+            fetched, fetch_errors = self._fetch(lambda: fetch([keys[key] for key in waiting]))
+            values.update(fetched)
+            errors.update(fetch_errors)
+        return values, errors
+
+    def get_stats(self):
+        """Return number of upstream fetches and coalesced requests for this process"""
+        return {
+            'fetches': self.fetches,
+            'coalesced_local': self.coalesced_local,
+            'coalesced_remote': self.coalesced_remote,
+        }
+
+
+single_flight = SingleFlight()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    Coalesce concurrent cache misses for the same key into a single upstream fetch, for async views
+
+    Same as SingleFlight with the waiting done on the event loop: coroutines missing the same key await the
+    first one, other processes are kept out with the same lease in the shared cache.
+    """
+
+    async def do(self, cache, key, version, fetch, wait=True):
+        """
+        Return the result of `fetch` for given cache key, running it at most once at a time
+
+        Args:
+            cache: AsyncCache holding the value and the lease
+            key: cache key of the value being fetched
+            version: cache version of the value being fetched
+            fetch: coroutine function that fetches the value and stores it in the cache
+            wait: wait for the value if another process holds the lease, otherwise return None right away
+        Returns: fetched value
+        """
+        call_key = (asyncio.get_running_loop(), key, version)
+        call = self._calls.get(call_key)
+        if call is not None:
+            self.coalesced_local += 1
+            COALESCED_REQUESTS.labels('local').inc()
+            return await asyncio.shield(call)
+
+        call = self._calls[call_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._fetch_with_lease(cache, key, version, fetch, wait)
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as error:
+            call.set_exception(error)
+            # followers re-raise the error, do not report it as never retrieved when there are none
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            del self._calls[call_key]
+        return result
+
+    async def _fetch_with_lease(self, cache, key, version, fetch, wait):
+        """Fetch the value if no other process holds the lease, otherwise wait for its result"""
+        lease_key = f'lease:{key}'
+        token = uuid.uuid4().hex
+        if await cache.add(lease_key, token, timeout=settings.CACHE_LEASE_TIMEOUT, version=version):
+            try:
+                return await self._fetch(fetch)
+            finally:
+                await cache.compare_and_delete({lease_key: token}, version=version)
+
+        if not wait:
+            return None
+        deadline = time.monotonic() + settings.CACHE_LEASE_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.CACHE_LEASE_POLL_INTERVAL)
+            value = await cache.get(key, version=version)
+            if isinstance(value, CacheEntry):
+                self.coalesced_remote += 1
+                COALESCED_REQUESTS.labels('remote').inc()
+                return value
+
+        logger.warning('Cache lease for %s was not released in time, fetching anyway', key)
+        return await self._fetch(fetch)
+
+    async def _fetch(self, fetch):
+        self.fetches += 1
+        return await fetch()
+
+
+async_single_flight = AsyncSingleFlight()
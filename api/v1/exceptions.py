@@ -1,2 +1,22 @@
 class ExternalAPIError(Exception):
     pass
+
+
+class UpstreamUnavailableError(ExternalAPIError):
+    """The openweathermap call was not made, it can be retried after `retry_after` seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class BudgetExceededError(UpstreamUnavailableError):
+    """The openweathermap call budget has no token left for the priority of the call"""
+
+    def __init__(self, priority, retry_after):
+        super().__init__(retry_after)
+        self.priority = priority
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """The circuit breaker of the openweathermap api is open"""
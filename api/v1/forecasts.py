@@ -0,0 +1,124 @@
+import struct
+import sys
+from array import array
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# columns of a forecast and the typecode of their array, in the order they are packed
+COLUMNS = (
+    # unix time of the step
+    ('timestamps', 'I'),
+    # °C
+    ('temperatures', 'f'),
+    # hPa
+    ('pressures', 'H'),
+    # %
+    ('humidities', 'B'),
+    # m/s
+    ('wind_speeds', 'f'),
+    # degree, -1 if unknown
+    ('wind_degrees', 'h'),
+    # openweathermap weather condition code
+    ('conditions', 'H'),
+)
+
+
+class Forecast:
+    """
+    Steps of an openweathermap 5 day / 3 hour forecast, one typed array per field instead of a dict per step
+
+    Packs to a few hundred bytes: a header, the utf-8 city name and the raw bytes of every column. Translatable
+    fields are kept as condition codes and wind degrees, see `localize_forecast` in transformers.
+    """
+
+    MAGIC = b'WFFC'
+    FORMAT_VERSION = 1
+    # magic, format version, little endian, number of steps, utc offset of the city in seconds, city name size
+    HEADER = struct.Struct('<4sBBHiH')
+
+    def __init__(self, city, timezone, **columns):
+        self.city = city
+        self.timezone = timezone
+        for name, typecode in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __eq__(self, other):
+        return isinstance(other, Forecast) and self.pack() == other.pack()
+
+    @classmethod
+    def from_response(cls, data):
+        """Build forecast from openweathermap forecast api response"""
+        steps = data['list']
+        return cls(
+            city=data['city'].get('name') or '',
+            timezone=data['city'].get('timezone', 0),
+            timestamps=array('I', [step['dt'] for step in steps]),
+            temperatures=array('f', [step['main']['temp'] for step in steps]),
+            pressures=array('H', [step['main']['pressure'] for step in steps]),
+            humidities=array('B', [step['main']['humidity'] for step in steps]),
+            wind_speeds=array('f', [step['wind']['speed'] for step in steps]),
+            wind_degrees=array('h', [_get_degree(step['wind']) for step in steps]),
+            conditions=array('H', [step['weather'][0]['id'] for step in steps]),
+        )
+
+    def pack(self):
+        """Return the forecast as bytes, in the byte order of this machine"""
+        city = self.city.encode()
+        header = self.HEADER.pack(
+            self.MAGIC, self.FORMAT_VERSION, sys.byteorder == 'little', len(self), self.timezone, len(city),
+        )
+        return b''.join([header, city, *(getattr(self, name).tobytes() for name, typecode in COLUMNS)])
+
+    @classmethod
+    def unpack(cls, packed):
+        """Build forecast from bytes returned by `pack`, packed on a machine of any byte order"""
+        magic, version, little_endian, count, timezone, city_size = cls.HEADER.unpack_from(packed)
+        if magic != cls.MAGIC or version != cls.FORMAT_VERSION:
+            raise ValueError('Not a packed forecast')
+        offset = cls.HEADER.size
+        city = packed[offset:offset + city_size].decode()
+        offset += city_size
+        columns = {}
+        for name, typecode in COLUMNS:
+            column = array(typecode)
+            size = column.itemsize * count
+            column.frombytes(packed[offset:offset + size])
+            if little_endian != (sys.byteorder == 'little'):
+                column.byteswap()
+            columns[name] = column
+            offset += size
+        return cls(city, timezone, **columns)
+
+    def get_day_slices(self):
+        """
+        Split the steps by day in the timezone of the city
+
+        Returns: list of (day number since epoch, slice of the steps of the day)
+        """
+        days = [(timestamp + self.timezone) // SECONDS_PER_DAY for timestamp in self.timestamps]
+        starts = [index for index in range(len(days)) if index == 0 or days[index] != days[index - 1]]
+        return [(days[start], slice(start, stop)) for start, stop in zip(starts, starts[1:] + [len(days)])]
+
+    def get_daily_rollups(self):
+        """
+        Compute min, max and mean of the temperature, pressure and humidity of every day
+
+        Returns: list of dicts with the day number since epoch and a (min, max, mean) tuple per field
+        """
+        rollups = []
+        for day, steps in self.get_day_slices():
+            rollup = {'day': day}
+            for name in ('temperatures', 'pressures', 'humidities'):
+                values = getattr(self, name)[steps]
+                rollup[name] = (min(values), max(values), sum(values) / len(values))
+            rollups.append(rollup)
+        return rollups
+
+
+def _get_degree(wind):
+    """Return wind degree of a forecast step, -1 if unknown"""
+    degree = wind.get('deg')
+    return -1 if degree is None else round(degree) % 360
@@ -1,31 +1,153 @@
+from django.conf import settings
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 
 
-def get_wind_direction(degree):
+WIND_DIRECTIONS = (
+    _('North'),
+    _('North-northeast'),
+    _('Northeast'),
+    _('East-northeast'),
+    _('East'),
+    _('East-southeast'),
+    _('Southeast'),
+    _('South-southeast'),
+    _('South'),
+    _('South-southwest'),
+    _('Southwest'),
+    _('West-southwest'),
+    _('West'),
+    _('West-northwest'),
+    _('Northwest'),
+    _('North-northwest'),
+)
+
+# language -> (16 translated wind directions, translated wind direction of every degree 0-359)
+_wind_direction_tables = {}
+
+
+def get_wind_direction_table(language=None):
+    """
+    Get translated wind directions of a language, built once for every language in settings.LANGUAGES
+
+    Args:
+        language: language code, active language by default
+    Returns: tuple of the 16 wind directions and tuple of the wind direction of every degree from 0 to 359
+    """
+    language = language or translation.get_language() or settings.LANGUAGE_CODE
+    tables = _wind_direction_tables.get(language)
+    if tables is None:
+        for code in {code for code, name in settings.LANGUAGES} | {language}:
+            with translation.override(code):
+                directions = tuple(str(direction) for direction in WIND_DIRECTIONS)
+            degrees = tuple(directions[int((degree % 360 / 22.5) + 0.5) % 16] for degree in range(360))
+            _wind_direction_tables[code] = directions, degrees
+        tables = _wind_direction_tables[language]
+    return tables
+
+
+def get_wind_direction(degree, language=None):
     """
     Get wind direction from degree
 
     Args:
-        degree: wind direction in degree
-    Returns: wind direction. eg: Southeast
-    """
-    val = int((degree / 22.5) + 0.5)
-    directions = [
-        _('North'),
-        _('North-northeast'),
-        _('Northeast'),
-        _('East-northeast'),
-        _('East'),
-        _('East-southeast'),
-        _('Southeast'),
-        _('South-southeast'),
-        _('South'),
-        _('South-southwest'),
-        _('Southwest'),
-        _('West-southwest'),
-        _('West'),
-        _('West-northwest'),
-        _('Northwest'),
-        _('North-northwest'),
+        degree: wind direction in degree, None if unknown
+        language: language code of the wind direction, active language by default
+    Returns: wind direction. eg: Southeast, None if the degree is unknown
+    """
+    if degree is None:
+        return None
+    directions, degrees = get_wind_direction_table(language)
+    if isinstance(degree, int):
+        return degrees[degree % 360]
+    return directions[int((degree % 360 / 22.5) + 0.5) % 16]
+
+
+def get_wind_directions(degrees, language=None):
+    """
+    Get wind directions of many degrees at once, eg: for the cities of a batch or the steps of a forecast
+
+    Args:
+        degrees: sequence of wind directions in degree, None if unknown
+        language: language code of the wind directions, active language by default
+    Returns: list of wind directions, None where the degree is unknown
+    """
+    directions, table = get_wind_direction_table(language)
+    return [
+        table[degree % 360] if isinstance(degree, int)
+        else None if degree is None
+        else directions[int((degree % 360 / 22.5) + 0.5) % 16]
+        for degree in degrees
     ]
-    return directions[(val % 16)]
+
+
+# OpenWeatherMap condition codes, see https://openweathermap.org/weather-conditions
+WEATHER_CONDITIONS = {
+    200: _('thunderstorm with light rain'),
+    201: _('thunderstorm with rain'),
+    202: _('thunderstorm with heavy rain'),
+    210: _('light thunderstorm'),
+    211: _('thunderstorm'),
+    212: _('heavy thunderstorm'),
+    221: _('ragged thunderstorm'),
+    230: _('thunderstorm with light drizzle'),
+    231: _('thunderstorm with drizzle'),
+    232: _('thunderstorm with heavy drizzle'),
+    300: _('light intensity drizzle'),
+    301: _('drizzle'),
+    302: _('heavy intensity drizzle'),
+    310: _('light intensity drizzle rain'),
+    311: _('drizzle rain'),
+    312: _('heavy intensity drizzle rain'),
+    313: _('shower rain and drizzle'),
+    314: _('heavy shower rain and drizzle'),
+    321: _('shower drizzle'),
+    500: _('light rain'),
+    501: _('moderate rain'),
+    502: _('heavy intensity rain'),
+    503: _('very heavy rain'),
+    504: _('extreme rain'),
+    511: _('freezing rain'),
+    520: _('light intensity shower rain'),
+    521: _('shower rain'),
+    522: _('heavy intensity shower rain'),
+    531: _('ragged shower rain'),
+    600: _('light snow'),
+    601: _('snow'),
+    602: _('heavy snow'),
+    611: _('sleet'),
+    612: _('light shower sleet'),
+    613: _('shower sleet'),
+    615: _('light rain and snow'),
+    616: _('rain and snow'),
+    620: _('light shower snow'),
+    621: _('shower snow'),
+    622: _('heavy shower snow'),
+    701: _('mist'),
+    711: _('smoke'),
+    721: _('haze'),
+    731: _('sand/dust whirls'),
+    741: _('fog'),
+    751: _('sand'),
+    761: _('dust'),
+    762: _('volcanic ash'),
+    771: _('squalls'),
+    781: _('tornado'),
+    800: _('clear sky'),
+    801: _('few clouds'),
+    802: _('scattered clouds'),
+    803: _('broken clouds'),
+    804: _('overcast clouds'),
+}
+
+
+def get_weather_description(condition, default=None):
+    """
+    Get translatable weather description from openweathermap condition code
+
+    Args:
+        condition: openweathermap weather condition code. eg: 801
+        default: description to return for unknown condition codes
+    Returns: weather description. eg: few clouds
+    """
+    return WEATHER_CONDITIONS.get(condition, default)
@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+import redis
+from django.conf import settings
+
+from api.v1.caching import background_refresher
+from api.v1.caching import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class PopularityTracker:
+    """
+    Count weather requests per city and language in a redis sorted set shared by all workers
+
+    Requests are counted in-process and flushed to redis in one pipeline every WEATHER_POPULARITY_FLUSH_INTERVAL
+    seconds from a background thread, so the request path never waits on redis. Scores are decayed by the
+    pre-warmer, recent requests weigh more than old ones.
+    """
+
+    def __init__(self, key='weather_popularity'):
+        self.key = key
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._flush_at = 0
+
+    def track(self, city_ids, language):
+        """
+        Count a request for the weather of given cities
+
+        Args:
+            city_ids: ids of the requested cities
+            language: requested language code
+        """
+        if not settings.WEATHER_POPULARITY_TRACKING:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._counts.update(f'{language}:{city_id}' for city_id in city_ids)
+            due = now >= self._flush_at
+            if due:
+                self._flush_at = now + settings.WEATHER_POPULARITY_FLUSH_INTERVAL
+        if due:
+            background_refresher.submit(self.flush)
+
+    def flush(self):
+        """Add the requests counted since the last flush to the sorted set"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        client = get_redis_client()
+        if client is None or not counts:
+            return
+        pipeline = client.pipeline(transaction=False)
+        for member, count in counts.items():
+            pipeline.zincrby(self.key, count, member)
+        try:
+            pipeline.execute()
+        except redis.RedisError:
+            logger.warning('Could not store the popularity of %s cities', len(counts))
+
+    def top(self, count):
+        """
+        Get the most requested cities
+
+        Args:
+            count: maximum number of cities to return
+        Returns: list of (city id, language) tuples, the most requested first
+        """
+        client = get_redis_client()
+        if client is None:
+            return []
+        top = []
+        for member in client.zrevrange(self.key, 0, count - 1):
+            language, city_id = member.decode().split(':')
+            top.append((int(city_id), language))
+        return top
+
+    def decay(self, factor):
+        """
+        Scale down every score and forget the least requested cities beyond WEATHER_POPULARITY_MAX_CITIES
+
+        Args:
+            factor: multiplier of the scores, between 0 and 1
+        """
+        client = get_redis_client()
+        if client is None:
+            return
+        pipeline = client.pipeline(transaction=False)
+        pipeline.zunionstore(self.key, {self.key: factor})
+        pipeline.zremrangebyrank(self.key, 0, -settings.WEATHER_POPULARITY_MAX_CITIES - 1)
+        pipeline.execute()
+
+
+popularity = PopularityTracker()
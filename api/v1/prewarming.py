@@ -0,0 +1,96 @@
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.v1.caching import CacheEntry
+from api.v1.popularity import popularity
+from api.v1.views import WeatherBatchView
+
+logger = logging.getLogger(__name__)
+
+
+class PrewarmBatchView(WeatherBatchView):
+    """Batch view whose openweathermap calls use the pre-warm priority of the call budget"""
+
+    def get_api_client(self, **kwargs):
+        client = super().get_api_client(**kwargs)
+        client.priority = 'prewarm'
+        return client
+
+
+class Prewarmer:
+    """
+    Refresh the cache entries of the most requested cities before they go stale
+
+    Every cycle the WEATHER_PREWARM_TOP most requested cities whose entry is missing or goes stale within
+    WEATHER_PREWARM_LEAD_TIME seconds are fetched with the group api, like the misses of batch requests. A cycle
+    makes at most WEATHER_PREWARM_RATE_SHARE of the OPEN_WEATHER_API_CALLS_PER_MINUTE calls allowed during
+    WEATHER_PREWARM_INTERVAL, the most requested cities first, and is the first to be shed by the call budget
+    when user requests need the calls. A lease in the shared cache lets one pre-warmer run per cycle when several
+    are started, it expires WEATHER_PREWARM_LEASE_MARGIN seconds before the next cycle.
+    """
+
+    def __init__(self):
+        self.view = PrewarmBatchView()
+
+    def get_call_budget(self):
+        """Return the number of group api calls one cycle may make"""
+        calls = settings.OPEN_WEATHER_API_CALLS_PER_MINUTE * settings.WEATHER_PREWARM_RATE_SHARE
+        return max(int(calls * settings.WEATHER_PREWARM_INTERVAL / 60), 1)
+
+    def get_due_cities(self, now=None):
+        """
+        Get the most requested cities whose cache entry is missing or goes stale soon
+
+        Returns: list of (city id, language) tuples, the most requested first, one per cache entry
+        """
+        now = time.time() if now is None else now
+        cities = {}
+        for city_id, language in popularity.top(settings.WEATHER_PREWARM_TOP):
+            # language neutral entries are shared by every language
+            cities.setdefault(self.view.get_cache_key(city_id=city_id, language=language), (city_id, language))
+        cached = cache.get_many(list(cities), version=self.view.CACHE_VERSION)
+        deadline = now + settings.WEATHER_PREWARM_LEAD_TIME
+        return [
+            city
+            for cache_key, city in cities.items()
+            if not isinstance(cached.get(cache_key), CacheEntry) or cached[cache_key].soft_expiry <= deadline
+        ]
+
+    def run_once(self, now=None):
+        """
+        Run one pre-warm cycle
+
+        Returns: number of refreshed cache entries, None if another pre-warmer holds the lease of this cycle
+        """
+        # kept until the cycle is over to keep other pre-warmers out, gone by the time the next cycle starts
+        lease_timeout = max(settings.WEATHER_PREWARM_INTERVAL - settings.WEATHER_PREWARM_LEASE_MARGIN, 1)
+        if not cache.add('lease:prewarm', uuid.uuid4().hex, timeout=lease_timeout):
+            return None
+        popularity.decay(0.5 ** (settings.WEATHER_PREWARM_INTERVAL / settings.WEATHER_POPULARITY_HALF_LIFE))
+
+        chunk_size = settings.WEATHER_BATCH_CHUNK_SIZE
+        budget = self.get_call_budget()
+        calls = 0
+        city_ids = {}
+        for city_id, language in self.get_due_cities(now):
+            language_city_ids = city_ids.setdefault(language, [])
+            if len(language_city_ids) % chunk_size == 0:
+                # the city needs a new group api call
+                if calls == budget:
+                    continue
+                calls += 1
+            language_city_ids.append(city_id)
+
+        refreshed = 0
+        for language, language_city_ids in city_ids.items():
+            if not language_city_ids:
+                continue
+            entries, errors = self.view.fetch_entries(
+                language_city_ids, {'language': language, 'ids': language_city_ids}
+            )
+            refreshed += len(entries)
+        return refreshed
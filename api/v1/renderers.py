@@ -0,0 +1,50 @@
+import time
+
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+from weather_finder.metrics import RENDER_LATENCY
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson escapes neither of them, JSONRenderer does to keep the output a strict javascript subset
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it is installed
+
+    The output is the compact UTF-8 JSON of JSONRenderer. Indented output asked by the client, non default
+    UNICODE_JSON/COMPACT_JSON settings and installs without orjson fall back to JSONRenderer.
+    """
+
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into JSON, returning a bytestring"""
+        started = time.perf_counter()
+        ret = self.render_json(data, accepted_media_type, renderer_context)
+        RENDER_LATENCY.observe(time.perf_counter() - started)
+        return ret
+
+    def render_json(self, data, accepted_media_type=None, renderer_context=None):
+        """Encode `data` with orjson, or with JSONRenderer if the output would differ"""
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # lazy translations, decimals, dates... are encoded by the default of JSONRenderer
+        ret = orjson.dumps(data, default=self.encoder.default, option=orjson.OPT_NON_STR_KEYS)
+        if LINE_SEPARATOR in ret or PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret
@@ -0,0 +1,239 @@
+import logging
+import math
+import random
+from collections import deque
+
+import redis
+from django.conf import settings
+
+from api.v1.caching import get_redis_client
+from api.v1.exceptions import CircuitOpenError
+from weather_finder.metrics import UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# responses worth another attempt, the request may well succeed on another upstream server
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+# Return 1 if the circuit is closed, 2 if the caller is the probe of a half-open circuit, otherwise 0 and the
+# milliseconds until the circuit half-opens
+ALLOW_SCRIPT = """
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    return {0, ttl}
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return {1, 0}
+end
+if redis.call('SET', KEYS[3], '1', 'NX', 'PX', ARGV[1]) then
+    return {2, 0}
+end
+return {0, redis.call('PTTL', KEYS[3])}
+"""
+
+# Count a failure, open the circuit after ARGV[1] failures within ARGV[2] seconds or if the probe failed
+FAILURE_SCRIPT = """
+local failures = redis.call('INCR', KEYS[1])
+if failures == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if ARGV[4] == '1' or failures >= tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+    redis.call('SET', KEYS[3], '1', 'EX', 86400)
+    redis.call('DEL', KEYS[1], KEYS[4])
+    return 1
+end
+return 0
+"""
+
+
+def get_retry_delay(attempt):
+    """
+    Get the seconds to wait before retrying a failed call, exponential backoff with full jitter
+
+    Args:
+        attempt: number of the retry, starting at 1
+    """
+    return random.uniform(0, settings.OPEN_WEATHER_API_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+def is_retryable(status, connect_failed):
+    """
+    Return True if a failed call can be retried: the request never reached openweathermap or a gateway failed
+
+    Args:
+        status: http status of the response, None if there is no response
+        connect_failed: the connection could not be opened
+    """
+    return connect_failed or status in RETRYABLE_STATUSES
+
+
+def is_upstream_failure(status):
+    """Return True if a failed call says openweathermap is unhealthy, unlike eg: an unknown city"""
+    return status is None or status >= 500
+
+
+def get_failure_cause(status, timed_out, connection_failed):
+    """Return the cause of a failed call, the label of the upstream error metrics"""
+    if timed_out:
+        return 'timeout'
+    if status is not None:
+        return f'http_{status}'
+    if connection_failed:
+        return 'connection'
+    return 'request'
+
+
+class LatencyTracker:
+    """
+    Latencies of the last openweathermap calls of the process, read timeouts follow their p99
+
+    Once OPEN_WEATHER_API_LATENCY_MIN_SAMPLES calls were timed the read timeout is twice their p99, between
+    OPEN_WEATHER_API_MIN_READ_TIMEOUT and OPEN_WEATHER_API_READ_TIMEOUT. Timed out calls count with the time
+    they waited, so the timeout grows back when openweathermap slows down.
+    """
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        """Add the duration of a call"""
+        self._samples.append(seconds)
+
+    def get_percentile(self, percentile):
+        """Return given percentile of the recorded durations, None without enough samples"""
+        samples = sorted(self._samples)
+        if len(samples) < settings.OPEN_WEATHER_API_LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(math.ceil(len(samples) * percentile / 100), len(samples)) - 1]
+
+    def get_read_timeout(self):
+        """Return the read timeout of the next call"""
+        if not settings.OPEN_WEATHER_API_ADAPTIVE_TIMEOUT:
+            return settings.OPEN_WEATHER_API_READ_TIMEOUT
+        p99 = self.get_percentile(99)
+        if p99 is None:
+            return settings.OPEN_WEATHER_API_READ_TIMEOUT
+        return min(max(p99 * 2, settings.OPEN_WEATHER_API_MIN_READ_TIMEOUT), settings.OPEN_WEATHER_API_READ_TIMEOUT)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker around openweathermap calls, its state is shared by all workers in redis
+
+    After OPEN_WEATHER_API_BREAKER_FAILURES failed calls within OPEN_WEATHER_API_BREAKER_WINDOW seconds the
+    circuit opens: calls fail right away for OPEN_WEATHER_API_BREAKER_OPEN_TIMEOUT seconds instead of waiting on a
+    degraded api. The circuit then half-opens, a single call probes the api and closes the circuit if it succeeds
+    or opens it again. A success of a worker that saw failures resets the count, only the probe closes the
+    circuit. A probe that could not be sent releases its lease for the next call. Without redis, or when redis
+    fails, calls are allowed.
+    """
+
+    def __init__(self, key='owm_breaker'):
+        self.keys = [f'{key}:open', f'{key}:half_open', f'{key}:probe', f'{key}:failures']
+        self._allow = None
+        self._failure = None
+        # this process saw failures that a success should reset
+        self._failed = False
+
+    def before_call(self):
+        """
+        Check that a call may be made
+
+        Returns: True if the call probes a half-open circuit
+        Raises:
+            CircuitOpenError: if the circuit is open, or half-open and probed by another call
+        """
+        if not settings.OPEN_WEATHER_API_CIRCUIT_BREAKER:
+            return False
+        client = get_redis_client()
+        if client is None:
+            return False
+        if self._allow is None:
+            self._allow = client.register_script(ALLOW_SCRIPT)
+        try:
+            state, retry_after_ms = self._allow(
+                keys=self.keys[:3], args=[int(settings.OPEN_WEATHER_API_READ_TIMEOUT * 2000)], client=client
+            )
+        except redis.RedisError:
+            logger.warning('Could not check the openweathermap circuit breaker, allowing the call')
+            return False
+        if state == 0:
+            UPSTREAM_ERRORS.labels('circuit_open').inc()
+            raise CircuitOpenError(retry_after=max(math.ceil(retry_after_ms / 1000), 1))
+        return state == 2
+
+    def record_success(self, probe=False):
+        """
+        Close the circuit after a successful probe, forget the failures seen by this process otherwise
+
+        Calls that were in flight when the circuit opened do not close it, nor release the lease of the probe.
+
+        Args:
+            probe: the call was the probe of a half-open circuit
+        """
+        if not (probe or self._failed) or not settings.OPEN_WEATHER_API_CIRCUIT_BREAKER:
+            return
+        self._failed = False
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            client.delete(*(self.keys[1:] if probe else self.keys[3:]))
+        except redis.RedisError:
+            logger.warning('Could not close the openweathermap circuit breaker')
+
+    def release_probe(self, probe):
+        """
+        Let another call probe the half-open circuit, when the probe call could not be made
+
+        Args:
+            probe: the call was the probe of a half-open circuit, nothing to release otherwise
+        """
+        if not probe or not settings.OPEN_WEATHER_API_CIRCUIT_BREAKER:
+            return
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            client.delete(self.keys[2])
+        except redis.RedisError:
+            logger.warning('Could not release the probe of the openweathermap circuit breaker')
+
+    def record_failure(self, probe=False):
+        """
+        Count a failed call, open the circuit if there were too many or the probe failed
+
+        Args:
+            probe: the call was the probe of a half-open circuit
+        """
+        if not settings.OPEN_WEATHER_API_CIRCUIT_BREAKER:
+            return
+        self._failed = True
+        client = get_redis_client()
+        if client is None:
+            return
+        if self._failure is None:
+            self._failure = client.register_script(FAILURE_SCRIPT)
+        try:
+            opened = self._failure(
+                keys=self.keys[3:] + self.keys[:3],
+                args=[
+                    settings.OPEN_WEATHER_API_BREAKER_FAILURES,
+                    settings.OPEN_WEATHER_API_BREAKER_WINDOW,
+                    settings.OPEN_WEATHER_API_BREAKER_OPEN_TIMEOUT,
+                    int(probe),
+                ],
+                client=client,
+            )
+        except redis.RedisError:
+            logger.warning('Could not record a failure in the openweathermap circuit breaker')
+            return
+        if opened:
+            logger.warning(
+                'OpenWeatherMap circuit opened for %s seconds', settings.OPEN_WEATHER_API_BREAKER_OPEN_TIMEOUT
+            )
+
+
+upstream_latency = LatencyTracker()
+circuit_breaker = CircuitBreaker()
@@ -3,6 +3,18 @@ from rest_framework import fields
 from rest_framework import serializers
 
 
+class CommaSeparatedIntegerListField(fields.ListField):
+    """List of integers given as comma separated query param, eg: ?ids=1,2,3"""
+
+    child = fields.IntegerField()
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [data]
+        values = [value.strip() for item in data for value in str(item).split(',') if value.strip()]
+        return super().to_internal_value(values)
+
+
 class BaseAPIInputSerializer(serializers.Serializer):
     """Base API input serializer with common fields"""
 
@@ -18,6 +30,18 @@ class WeatherAPIInputSerializer(BaseAPIInputSerializer):
     city_id = fields.IntegerField()
 
 
+class WeatherBatchAPIInputSerializer(BaseAPIInputSerializer):
+    """
+    Serializer class to validate list of city ids input
+    Duplicate ids are dropped, the order of the first occurrences is kept
+    """
+
+    ids = CommaSeparatedIntegerListField(allow_empty=False, max_length=settings.WEATHER_BATCH_MAX_IDS)
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
 class CityAPIInputySerializer(BaseAPIInputSerializer):
     """
     Serializer class to validate city name query
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import queue
+import threading
+import weakref
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from api.v1.resilience import upstream_latency
+from weather_finder.metrics import UPSTREAM_CONNECTIONS
+
+
+class SessionPool:
+    """
+    Per-process, thread-safe pool of keep-alive requests sessions
+
+    Sessions are created lazily up to `OPEN_WEATHER_API_POOL_SIZE` and handed out to one thread at a time,
+    so the underlying TCP connections to openweathermap are reused across requests instead of being
+    opened for every cache miss.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._sessions = []
+        self.checkouts = 0
+
+    def _create_session(self):
+        """Create a new session with keep-alive connection pool and gzip negotiation"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.OPEN_WEATHER_API_POOL_CONNECTIONS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(
+            {
+                'Accept-Encoding': 'gzip, deflate',
+                'Connection': 'keep-alive' if settings.OPEN_WEATHER_API_KEEP_ALIVE else 'close',
+            }
+        )
+        return session
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # sessions inherited from the parent process share sockets with it, never reuse them after fork
+                self._reset()
+            self.checkouts += 1
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if len(self._sessions) < settings.OPEN_WEATHER_API_POOL_SIZE:
+                    session = self._create_session()
+                    self._sessions.append(session)
+                    return session
+        return self._idle.get()
+
+    def _release(self, session):
+        if session in self._sessions:
+            self._idle.put(session)
+
+    @contextmanager
+    def session(self):
+        """Borrow a session from the pool for the duration of the block"""
+        session = self._acquire()
+        connections, requests_sent = _count_connections(session)
+        try:
+            yield session
+        finally:
+            # counted before the release, afterwards another thread may already send requests with the session
+            connections_after, requests_after = _count_connections(session)
+            self._release(session)
+            # the counts go down when urllib3 drops the pool of a host, never let the metrics replace the result
+            opened = max(connections_after - connections, 0)
+            UPSTREAM_CONNECTIONS.labels('opened').inc(opened)
+            UPSTREAM_CONNECTIONS.labels('reused').inc(max(requests_after - requests_sent - opened, 0))
+
+    def get_timeout(self):
+        """Return (connect, read) timeout tuple for upstream requests, the read timeout follows upstream latency"""
+        return settings.OPEN_WEATHER_API_CONNECT_TIMEOUT, upstream_latency.get_read_timeout()
+
+    def get_stats(self):
+        """Return session and connection reuse counters for this process, also exported as prometheus metrics"""
+        connections = requests_sent = 0
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session_connections, session_requests = _count_connections(session)
+            connections += session_connections
+            requests_sent += session_requests
+        return {
+            'sessions': len(sessions),
+            'checkouts': self.checkouts,
+            'requests': requests_sent,
+            'connections_opened': connections,
+            'connections_reused': max(requests_sent - connections, 0),
+        }
+
+
+def _count_connections(session):
+    """Return (connections opened, requests sent) by the connection pools of a session"""
+    connections = requests_sent = 0
+    pools = session.get_adapter('http://').poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+    return connections, requests_sent
+
+
+session_pool = SessionPool()
+
+
+class AsyncSessionPool:
+    """
+    Pooled async http client for upstream requests, one per event loop
+
+    A single client multiplexes up to `OPEN_WEATHER_API_ASYNC_MAX_CONNECTIONS` keep-alive connections, so one
+    process can wait on thousands of slow upstream calls without holding a thread for each of them.
+    """
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _create_client(self):
+        # imported on first use, only the async views need httpx
+        import httpx
+
+        max_connections = settings.OPEN_WEATHER_API_ASYNC_MAX_CONNECTIONS
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections if settings.OPEN_WEATHER_API_KEEP_ALIVE else 0,
+            ),
+            timeout=httpx.Timeout(
+                settings.OPEN_WEATHER_API_READ_TIMEOUT, connect=settings.OPEN_WEATHER_API_CONNECT_TIMEOUT
+            ),
+            headers={'Accept-Encoding': 'gzip, deflate'},
+        )
+
+    def get_timeout(self):
+        """Return the timeout of upstream requests, the read timeout follows upstream latency"""
+        import httpx
+
+        return httpx.Timeout(upstream_latency.get_read_timeout(), connect=settings.OPEN_WEATHER_API_CONNECT_TIMEOUT)
+
+    def get_client(self):
+        """Return the client of the running event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = self._create_client()
+        return client
+
+
+async_session_pool = AsyncSessionPool()
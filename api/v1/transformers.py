@@ -1,7 +1,13 @@
+import time
+
+from django.utils import translation
 from marshmallow import Schema
 from marshmallow import fields
 
+from api.v1.forecasts import SECONDS_PER_DAY
+from api.v1.helpers import get_weather_description
 from api.v1.helpers import get_wind_direction
+from api.v1.helpers import get_wind_directions
 
 
 class WeatherResponseSchema(Schema):
@@ -31,7 +37,153 @@ class WeatherResponseSchema(Schema):
         return f"{data['main']['humidity']}%"
 
     def get_wind(self, data):
-        return {'speed': f"{data['wind']['speed']} m/s", 'direction': get_wind_direction(data['wind']['deg'])}
+        return {'speed': f"{data['wind']['speed']} m/s", 'direction': get_wind_direction(data['wind'].get('deg'))}
+
+
+class WeatherRecordSchema(WeatherResponseSchema):
+    """
+    Schema class to format openweathermap weather response as a language neutral record
+
+    Translatable fields are kept as openweathermap condition code and wind degree,
+    use `localize_weather_record` to build the weather response for a language.
+    """
+
+    condition = fields.Method('get_condition')
+
+    def get_condition(self, data):
+        return data['weather'][0]['id']
+
+    def get_wind(self, data):
+        return {'speed': f"{data['wind']['speed']} m/s", 'degree': data['wind'].get('deg')}
+
+
+def _transform_weather(data):
+    """Format the fields shared by weather responses and records"""
+    main = data['main']
+    weather = {}
+    if 'name' in data:
+        weather['city'] = None if data['name'] is None else str(data['name'])
+    weather['description'] = data['weather'][0]['description']
+    weather['temperature'] = {
+        'average': f"{int(main['temp'])}°C",
+        'min': f"{int(main['temp_min'])}°C",
+        'max': f"{int(main['temp_max'])}°C",
+    }
+    weather['pressure'] = f"{main['pressure']} hPa"
+    weather['humidity'] = f"{main['humidity']}%"
+    return weather
+
+
+def transform_weather_response(data, language=None):
+    """
+    Format openweathermap weather response, same output as `WeatherResponseSchema().dump(data)`
+
+    Plain functions are used on the request path, no schema is built and no field is looked up per call.
+    The wind direction is translated to given language, the active one by default.
+    """
+    response = _transform_weather(data)
+    response['wind'] = {
+        'speed': f"{data['wind']['speed']} m/s",
+        'direction': get_wind_direction(data['wind'].get('deg'), language),
+    }
+    return response
+
+
+def transform_weather_record(data):
+    """Format openweathermap weather response as language neutral record, same output as WeatherRecordSchema"""
+    record = _transform_weather(data)
+    record['condition'] = data['weather'][0]['id']
+    record['wind'] = {'speed': f"{data['wind']['speed']} m/s", 'degree': data['wind'].get('deg')}
+    return record
+
+
+def localize_weather_record(record, language):
+    """
+    Build weather response from language neutral weather record
+
+    Args:
+        record: weather record serialized with WeatherRecordSchema
+        language: language code to translate description and wind direction to
+    Returns: weather response in the format of WeatherResponseSchema
+    """
+    wind = record['wind']
+    with translation.override(language):
+        return {
+            'city': record['city'],
+            'description': str(get_weather_description(record['condition'], record['description'])),
+            'temperature': record['temperature'],
+            'pressure': record['pressure'],
+            'humidity': record['humidity'],
+            'wind': {'speed': wind['speed'], 'direction': get_wind_direction(wind['degree'], language)},
+        }
+
+
+def localize_weather_records(records, language):
+    """
+    Build weather responses from many language neutral weather records at once
+
+    Args:
+        records: list of weather records serialized with WeatherRecordSchema
+        language: language code to translate descriptions and wind directions to
+    Returns: list of weather responses in the format of WeatherResponseSchema
+    """
+    directions = get_wind_directions([record['wind']['degree'] for record in records], language)
+    with translation.override(language):
+        return [
+            {
+                'city': record['city'],
+                'description': str(get_weather_description(record['condition'], record['description'])),
+                'temperature': record['temperature'],
+                'pressure': record['pressure'],
+                'humidity': record['humidity'],
+                'wind': {'speed': record['wind']['speed'], 'direction': direction},
+            }
+            for record, direction in zip(records, directions)
+        ]
+
+
+def localize_forecast(forecast, language):
+    """
+    Build forecast response from a forecast, with daily rollups of its steps
+
+    Args:
+        forecast: Forecast of a city
+        language: language code to translate descriptions and wind directions to
+    Returns: forecast response: city, the min, max and average temperature, pressure and humidity of every day
+        and the details of every step
+    """
+    directions = get_wind_directions([None if degree < 0 else degree for degree in forecast.wind_degrees], language)
+    with translation.override(language):
+        descriptions = {condition: get_weather_description(condition) for condition in set(forecast.conditions)}
+        descriptions = {condition: None if text is None else str(text) for condition, text in descriptions.items()}
+    days = [
+        {
+            'date': time.strftime('%Y-%m-%d', time.gmtime(rollup['day'] * SECONDS_PER_DAY)),
+            'temperature': {
+                'average': f"{int(rollup['temperatures'][2])}°C",
+                'min': f"{int(rollup['temperatures'][0])}°C",
+                'max': f"{int(rollup['temperatures'][1])}°C",
+            },
+            'pressure': f"{round(rollup['pressures'][2])} hPa",
+            'humidity': f"{round(rollup['humidities'][2])}%",
+        }
+        for rollup in forecast.get_daily_rollups()
+    ]
+    steps = [
+        {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp)),
+            'description': descriptions[condition],
+            'temperature': f"{int(temperature)}°C",
+            'pressure': f"{pressure} hPa",
+            'humidity': f"{humidity}%",
+            'wind': {'speed': f"{round(speed, 2)} m/s", 'direction': direction},
+        }
+        for timestamp, condition, temperature, pressure, humidity, speed, direction in zip(
+            forecast.timestamps, forecast.conditions, forecast.temperatures, forecast.pressures,
+            forecast.humidities, forecast.wind_speeds, directions,
+        )
+    ]
+    return {'city': forecast.city, 'days': days, 'steps': steps}
 
 
 class CityListResponseSchema(Schema):
@@ -42,3 +194,15 @@ class CityListResponseSchema(Schema):
 
     def get_name(self, data):
         return f"{data['name']}, {data['sys']['country']}"
+
+
+def transform_city_list(cities):
+    """Format openweathermap city list, same output as `CityListResponseSchema().dump(cities, many=True)`"""
+    rows = []
+    for city in cities:
+        row = {}
+        if 'id' in city:
+            row['id'] = None if city['id'] is None else int(city['id'])
+        row['name'] = f"{city['name']}, {city['sys']['country']}"
+        rows.append(row)
+    return rows
@@ -1,9 +1,28 @@
+from django.conf import settings
 from django.urls import path
 
 from api.v1.views import CityListView
+from api.v1.views import ForecastView
+from api.v1.views import WeatherBatchView
 from api.v1.views import WeatherDetailsView
 
+if settings.API_ASYNC_VIEWS:
+    # the async views and the async http and redis clients are only loaded when served
+    from api.v1.async_views import AsyncCityListView
+    from api.v1.async_views import AsyncForecastView
+    from api.v1.async_views import AsyncWeatherDetailsView
+
+    weather_view = AsyncWeatherDetailsView.as_view()
+    city_list_view = AsyncCityListView.as_view()
+    forecast_view = AsyncForecastView.as_view()
+else:
+    weather_view = WeatherDetailsView.as_view()
+    city_list_view = CityListView.as_view()
+    forecast_view = ForecastView.as_view()
+
 urlpatterns = [
-    path('weather/<int:city_id>/', WeatherDetailsView.as_view(), name='weather'),
-    path('cities/', CityListView.as_view(), name='city_list'),
+    path('weather/', WeatherBatchView.as_view(), name='weather_batch'),
+    path('weather/<int:city_id>/', weather_view, name='weather'),
+    path('cities/', city_list_view, name='city_list'),
+    path('forecast/<int:city_id>/', forecast_view, name='forecast'),
 ]
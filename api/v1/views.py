@@ -3,15 +3,39 @@ from http import HTTPStatus
 
 from django.conf import settings
 from django.core.cache import cache
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 from django.utils.translation import ugettext_lazy as _
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.v1.caching import CacheEntry
+from api.v1.caching import background_refresher
+from api.v1.caching import batch_fetcher
+from api.v1.caching import compute_etag
+from api.v1.caching import etag_matches
+from api.v1.caching import get_cache_control
+from api.v1.cities import normalize_city_name
+from api.v1.clients import LocalCityClient
 from api.v1.clients import OpenWeatherMapCityClient
+from api.v1.clients import OpenWeatherMapForecastClient
+from api.v1.clients import OpenWeatherMapGroupClient
+from api.v1.clients import OpenWeatherMapGroupRecordClient
 from api.v1.clients import OpenWeatherMapWeatherClient
+from api.v1.clients import OpenWeatherMapWeatherRecordClient
+from api.v1.coalescing import single_flight
 from api.v1.exceptions import ExternalAPIError
+from api.v1.exceptions import UpstreamUnavailableError
+from api.v1.forecasts import Forecast
+from api.v1.popularity import popularity
 from api.v1.serializers import CityAPIInputySerializer
 from api.v1.serializers import WeatherAPIInputSerializer
+from api.v1.serializers import WeatherBatchAPIInputSerializer
+from api.v1.transformers import localize_forecast
+from api.v1.transformers import localize_weather_record
+from api.v1.transformers import localize_weather_records
+from weather_finder.metrics import CACHE_LATENCY
+from weather_finder.metrics import CACHE_REQUESTS
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +43,22 @@ logger = logging.getLogger(__name__)
 class BaseWeatherAPIView(APIView):
     """
     Base view for external api requests to openweathermap
+
+    Cached responses carry an X-Cache header: HIT, STALE (served while refreshed in the background) or MISS.
+    With API_CACHE_ENCODED_RESPONSES the rendered response body is cached and returned as is on hits.
+    They also carry the ETag stored with the entry, answering 304 to a matching If-None-Match, and a
+    Cache-Control header following the remaining lifetime of the entry. Misses answer 503 with a Retry-After
+    header when openweathermap can not be called: the call budget has no token left for them or the circuit
+    breaker is open.
     """
 
     CACHE_VERSION = 1
     CACHE_TIMEOUT = 100
+    CACHE_HARD_TIMEOUT = 100
+    CACHE_KEY_PREFIXES = ()
+    # public endpoints: no authentication, which would load the user of the session cookie, nor permission checks
+    authentication_classes = ()
+    permission_classes = ()
 
     def get_cache_key(self, **kwargs):
         """Generate cache key to store response"""
@@ -40,6 +76,53 @@ class BaseWeatherAPIView(APIView):
         """Get openweathermap api client class"""
         raise NotImplementedError
 
+    def get_response_data(self, data, input_data):
+        """Build response data from cached data"""
+        return data
+
+    def get_entry_data(self, data, input_data):
+        """Build the data to cache from api client data, the rendered response body if responses are cached encoded"""
+        if settings.API_CACHE_ENCODED_RESPONSES:
+            return self.encode(self.get_response_data(data, input_data))
+        return data
+
+    def encode(self, data):
+        """Render response data to the JSON body returned by the api"""
+        return self.renderer_classes[0]().render(data)
+
+    def get_etag(self, entry, input_data):
+        """Return the ETag header of the response for a cache entry"""
+        return f'"{entry.etag}"'
+
+    def is_encoded(self, entry):
+        """Return True if a cache entry holds the rendered response body"""
+        return isinstance(entry.data, bytes)
+
+    def get_cached_response(self, entry, input_data, cache_status):
+        """Return the response for a cache entry, its body as is if it was cached encoded"""
+        etag = self.get_etag(entry, input_data)
+        if etag_matches(self.request.META.get('HTTP_IF_NONE_MATCH'), etag):
+            response = HttpResponseNotModified()
+        elif self.is_encoded(entry):
+            response = HttpResponse(entry.data, content_type=self.renderer_classes[0].media_type)
+        else:
+            response = Response(data=self.get_response_data(entry.data, input_data), status=HTTPStatus.OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = entry.get_cache_control()
+        response['X-Cache'] = cache_status
+        return response
+
+    def should_cache(self):
+        """Return False if the api client is cheap enough to be called on every request"""
+        return True
+
+    def track_request(self, input_data):
+        """Count a valid request, eg: for the pre-warmer"""
+
+    def count_cache_status(self, cache_status, count=1):
+        """Count cached data served with given X-Cache status in the metrics"""
+        CACHE_REQUESTS.labels(type(self).__name__, cache_status).inc(count)
+
     def get(self, request, **kwargs):
         request_data = self.get_request_data(request, **kwargs)
         serializer_class = self.get_input_serializer_class()
@@ -48,26 +131,82 @@ class BaseWeatherAPIView(APIView):
             logger.error('Weather API request received with invalid data %s', kwargs)
             return Response(data={'error': serializer.errors}, status=HTTPStatus.BAD_REQUEST)
 
-        input_data = serializer.data
+        self.track_request(serializer.data)
+        return self.get_response(serializer.data)
+
+    def get_response(self, input_data):
+        """Return response for validated input data, from cache if available"""
+        if not self.should_cache():
+            response = self.get_api_client(**input_data).get_data(**input_data)
+            return Response(data=self.get_response_data(response, input_data), status=HTTPStatus.OK)
+
         cache_key = self.get_cache_key(**input_data)
-        response = cache.get(cache_key, version=self.CACHE_VERSION)
-        if response:
-            return Response(data=response, status=HTTPStatus.OK)
+        with CACHE_LATENCY.labels('get').time():
+            entry = cache.get(cache_key, version=self.CACHE_VERSION)
+        if isinstance(entry, CacheEntry):
+            cache_status = 'HIT'
+            if entry.is_stale():
+                cache_status = 'STALE'
+                # queue a single refresh, the requests that find the entry leased serve it stale meanwhile
+                leases = single_flight.claim(cache, [cache_key], self.CACHE_VERSION)
+                if leases:
+                    background_refresher.submit(self.refresh_response, cache_key, input_data, leases)
+            self.count_cache_status(cache_status)
+            return self.get_cached_response(entry, input_data, cache_status)
 
-        client = self.get_api_client(**input_data)
+        self.count_cache_status('MISS')
         try:
-            response = client.get_data(**input_data)
+            entry = single_flight.do(
+                cache, cache_key, self.CACHE_VERSION, lambda: self.fetch_response(cache_key, input_data)
+            )
+        except UpstreamUnavailableError as error:
+            logger.warning('OpenWeatherMap can not be called for params %s', input_data)
+            return Response(
+                data={'error': _('Something went wrong! Please try again later')},
+                status=HTTPStatus.SERVICE_UNAVAILABLE,
+                headers={'X-Cache': 'MISS', 'Retry-After': str(error.retry_after)},
+            )
         except ExternalAPIError:
             logger.error('External API returned invalid response for params %s', input_data)
             return Response(
                 data={'error': _('Something went wrong! Please try again later')},
                 status=HTTPStatus.INTERNAL_SERVER_ERROR,
+                headers={'X-Cache': 'MISS'},
             )
-        else:
+        return self.get_cached_response(entry, input_data, 'MISS')
+
+    def fetch_response(self, cache_key, input_data):
+        """Fetch response from openweathermap api and store it in cache"""
+        client = self.get_api_client(**input_data)
+        entry = CacheEntry(
+            self.get_entry_data(client.get_data(**input_data), input_data),
+            soft_timeout=int(self.CACHE_TIMEOUT),
+            hard_timeout=int(self.CACHE_HARD_TIMEOUT),
+        )
+        with CACHE_LATENCY.labels('set').time():
             cache.set(
-                cache_key, response, timeout=int(self.CACHE_TIMEOUT), version=int(self.CACHE_VERSION),
+                cache_key, entry, timeout=int(self.CACHE_HARD_TIMEOUT), version=int(self.CACHE_VERSION),
             )
-        return Response(data=response, status=HTTPStatus.OK)
+        return entry
+
+    def refresh_response(self, cache_key, input_data, leases):
+        """
+        Refresh stale cache entry in the background, keep serving the stale entry if the api fails
+
+        Args:
+            cache_key: cache key of the stale entry
+            input_data: validated request data
+            leases: lease of the cache key returned by `single_flight.claim`, released once done
+        """
+        try:
+            # another worker may have refreshed the entry after it was read stale and before its lease was taken
+            entry = cache.get(cache_key, version=self.CACHE_VERSION)
+            if not isinstance(entry, CacheEntry) or entry.is_stale():
+                self.fetch_response(cache_key, input_data)
+        except ExternalAPIError:
+            logger.warning('Could not refresh stale cache entry %s, serving stale data', cache_key)
+        finally:
+            single_flight.release(cache, leases, self.CACHE_VERSION)
 
 
 class WeatherDetailsView(BaseWeatherAPIView):
@@ -77,9 +216,15 @@ class WeatherDetailsView(BaseWeatherAPIView):
 
     CACHE_VERSION = settings.WEATHER_API_CACHE_VERSION
     CACHE_TIMEOUT = settings.WEATHER_RESPONSE_CACHE_TIMEOUT
+    CACHE_HARD_TIMEOUT = settings.WEATHER_RESPONSE_CACHE_HARD_TIMEOUT
+    CACHE_KEY_PREFIXES = ('weather_data:', 'weather_record:', 'weather_body:')
 
     def get_cache_key(self, *args, **kwargs):
         """Generate cache key to store response"""
+        if settings.API_CACHE_ENCODED_RESPONSES:
+            return f"weather_body:{kwargs['language']}:{kwargs['city_id']}"
+        if settings.WEATHER_LANGUAGE_NEUTRAL_CACHE:
+            return f"weather_record:{kwargs['city_id']}"
         return f"weather_data:{kwargs['language']}:{kwargs['city_id']}"
 
     def get_request_data(self, request, **kwargs):
@@ -96,8 +241,255 @@ class WeatherDetailsView(BaseWeatherAPIView):
 
     def get_api_client(self, **kwargs):
         """Get openweathermap api client clas"""
+        if settings.WEATHER_LANGUAGE_NEUTRAL_CACHE:
+            return OpenWeatherMapWeatherRecordClient(api_key=settings.OPEN_WEATHER_API_KEY)
         return OpenWeatherMapWeatherClient(api_key=settings.OPEN_WEATHER_API_KEY, language=kwargs['language'])
 
+    def track_request(self, input_data):
+        """Count the request in the popularity of the city, the pre-warmer keeps popular cities cached"""
+        popularity.track([input_data['city_id']], input_data['language'])
+
+    def get_response_data(self, data, input_data):
+        """Translate language neutral weather record to the requested language"""
+        if settings.WEATHER_LANGUAGE_NEUTRAL_CACHE:
+            return localize_weather_record(data, input_data['language'])
+        return data
+
+    def get_etag(self, entry, input_data):
+        """Language neutral records are translated per request, so their responses differ by language"""
+        if settings.WEATHER_LANGUAGE_NEUTRAL_CACHE and not self.is_encoded(entry):
+            return f'"{entry.etag}-{input_data["language"]}"'
+        return super().get_etag(entry, input_data)
+
+
+class ForecastView(BaseWeatherAPIView):
+    """
+    View to retrieve the 5 day / 3 hour forecast for given city and language using openweathermap forecast api
+
+    One language neutral entry is cached per city, holding its packed Forecast. Hits unpack it, roll the steps
+    up per day and translate it to the requested language.
+    """
+
+    CACHE_VERSION = settings.FORECAST_API_CACHE_VERSION
+    CACHE_TIMEOUT = settings.FORECAST_RESPONSE_CACHE_TIMEOUT
+    CACHE_HARD_TIMEOUT = settings.FORECAST_RESPONSE_CACHE_HARD_TIMEOUT
+    CACHE_KEY_PREFIXES = ('forecast:',)
+
+    def get_cache_key(self, *args, **kwargs):
+        """Generate cache key to store response"""
+        return f"forecast:{kwargs['city_id']}"
+
+    def get_request_data(self, request, **kwargs):
+        """Get request data from url and/or query params"""
+        request_data = kwargs
+        language = request.query_params.get('language')
+        if language:
+            request_data['language'] = language
+        return request_data
+
+    def get_input_serializer_class(self):
+        """Get serializer class to validate api input"""
+        return WeatherAPIInputSerializer
+
+    def get_api_client(self, **kwargs):
+        """Get openweathermap forecast api client"""
+        return OpenWeatherMapForecastClient(api_key=settings.OPEN_WEATHER_API_KEY)
+
+    def get_entry_data(self, data, input_data):
+        """Pack the forecast, also when responses are cached encoded: the entry is shared by all languages"""
+        return data.pack()
+
+    def is_encoded(self, entry):
+        """Entries hold a packed forecast, never a response body"""
+        return False
+
+    def get_response_data(self, data, input_data):
+        """Build the forecast response in the requested language from a packed or api client forecast"""
+        forecast = data if isinstance(data, Forecast) else Forecast.unpack(data)
+        return localize_forecast(forecast, input_data['language'])
+
+    def get_etag(self, entry, input_data):
+        """Entries are translated per request, so their responses differ by language"""
+        return f'"{entry.etag}-{input_data["language"]}"'
+
+
+class WeatherBatchView(WeatherDetailsView):
+    """
+    View to retrieve weather data for many cities in one request using openweathermap group api
+
+    Entries are shared with WeatherDetailsView. All of them are read in one round trip, the misses are fetched
+    in chunks run in parallel and written back in one round trip. Misses and stale refreshes take the lease of
+    every city like SingleFlight does, so concurrent requests fetch a city once. A city that can not be fetched
+    gets an error in the response instead of failing the whole request. Responses without errors get an ETag and
+    Cache-Control header covering all of their cities.
+    """
+
+    def get_request_data(self, request, **kwargs):
+        """Get request data from url and/or query params"""
+        return request.query_params
+
+    def get_input_serializer_class(self):
+        """Get serializer class to validate api input"""
+        return WeatherBatchAPIInputSerializer
+
+    def get_api_client(self, **kwargs):
+        """Get openweathermap group api client class"""
+        if settings.WEATHER_LANGUAGE_NEUTRAL_CACHE:
+            return OpenWeatherMapGroupRecordClient(api_key=settings.OPEN_WEATHER_API_KEY)
+        return OpenWeatherMapGroupClient(api_key=settings.OPEN_WEATHER_API_KEY, language=kwargs['language'])
+
+    def track_request(self, input_data):
+        """Count the request in the popularity of every requested city"""
+        popularity.track(input_data['ids'], input_data['language'])
+
+    def get_response(self, input_data):
+        """Return weather data or error by city id"""
+        cache_keys = {
+            city_id: self.get_cache_key(city_id=city_id, language=input_data['language'])
+            for city_id in input_data['ids']
+        }
+        with CACHE_LATENCY.labels('get_many').time():
+            cached = cache.get_many(list(cache_keys.values()), version=self.CACHE_VERSION)
+
+        entries = {}
+        stale_ids = []
+        for city_id, cache_key in cache_keys.items():
+            entry = cached.get(cache_key)
+            if isinstance(entry, CacheEntry):
+                entries[city_id] = entry
+                if entry.is_stale():
+                    stale_ids.append(city_id)
+        if stale_ids:
+            # only the cities nobody else is refreshing, the ones the api fails for keep serving their stale entry
+            stale_keys = {cache_keys[city_id]: city_id for city_id in stale_ids}
+            leases = single_flight.claim(cache, stale_keys, self.CACHE_VERSION)
+            if leases:
+                background_refresher.submit(
+                    self.refresh_entries, [stale_keys[key] for key in leases], input_data, leases
+                )
+
+        errors = {}
+        missing_ids = [city_id for city_id in cache_keys if city_id not in entries]
+        self.count_cache_status('HIT', len(entries) - len(stale_ids))
+        self.count_cache_status('STALE', len(stale_ids))
+        self.count_cache_status('MISS', len(missing_ids))
+        if missing_ids:
+            fetched, errors = single_flight.do_many(
+                cache,
+                {cache_keys[city_id]: city_id for city_id in missing_ids},
+                self.CACHE_VERSION,
+                lambda city_ids: self.fetch_entries(city_ids, input_data),
+            )
+            entries.update(fetched)
+
+        headers = {}
+        if not errors:
+            # the response is as fresh as its oldest city and changes with any of them
+            headers['ETag'] = '"%s"' % compute_etag(
+                ' '.join(self.get_etag(entries[city_id], input_data) for city_id in input_data['ids']).encode()
+            )
+            headers['Cache-Control'] = get_cache_control(
+                min(entry.soft_expiry for entry in entries.values()),
+                min(entry.hard_expiry for entry in entries.values()),
+            )
+            if etag_matches(self.request.META.get('HTTP_IF_NONE_MATCH'), headers['ETag']):
+                response = HttpResponseNotModified()
+                for name, value in headers.items():
+                    response[name] = value
+                return response
+
+        if settings.API_CACHE_ENCODED_RESPONSES:
+            # splice the cached bodies into the response instead of decoding and encoding them again
+            bodies = [
+                b'"%d":%s' % (
+                    city_id, entries[city_id].data if city_id in entries else self.encode({'error': errors[city_id]})
+                )
+                for city_id in input_data['ids']
+            ]
+            response = HttpResponse(b'{' + b','.join(bodies) + b'}', content_type=self.renderer_classes[0].media_type)
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        found_ids = [city_id for city_id in input_data['ids'] if city_id in entries]
+        found = self.get_response_data_list([entries[city_id].data for city_id in found_ids], input_data)
+        data = dict(zip(found_ids, found))
+        return Response(
+            data={
+                str(city_id): data[city_id] if city_id in data else {'error': errors[city_id]}
+                for city_id in input_data['ids']
+            },
+            status=HTTPStatus.OK,
+            headers=headers,
+        )
+
+    def get_response_data_list(self, records, input_data):
+        """Translate many language neutral weather records to the requested language at once"""
+        if settings.WEATHER_LANGUAGE_NEUTRAL_CACHE:
+            return localize_weather_records(records, input_data['language'])
+        return records
+
+    def get_entry_data_list(self, records, input_data):
+        """Build the data to cache from the api data of many cities at once"""
+        if settings.API_CACHE_ENCODED_RESPONSES:
+            return [self.encode(data) for data in self.get_response_data_list(records, input_data)]
+        return records
+
+    def refresh_entries(self, city_ids, input_data, leases):
+        """Refresh the stale entries of given cities in the background, releasing their leases afterwards"""
+        try:
+            self.fetch_entries(city_ids, input_data)
+        finally:
+            single_flight.release(cache, leases, self.CACHE_VERSION)
+
+    def fetch_entries(self, city_ids, input_data):
+        """
+        Fetch weather data for given cities from openweathermap api and store it in cache
+
+        Args:
+            city_ids: ids of the cities to fetch
+            input_data: validated request data
+        Returns: cache entries by city id, error messages by city id for the cities that could not be fetched
+        """
+        client = self.get_api_client(**input_data)
+        chunk_size = settings.WEATHER_BATCH_CHUNK_SIZE
+        chunks = [city_ids[index:index + chunk_size] for index in range(0, len(city_ids), chunk_size)]
+        futures = [batch_fetcher.submit(client.get_data, city_ids=chunk) for chunk in chunks]
+
+        fetched = {}
+        errors = {}
+        for chunk, future in zip(chunks, futures):
+            try:
+                data = future.result()
+            except ExternalAPIError:
+                logger.error('External API returned invalid response for cities %s', chunk)
+                errors.update((city_id, _('Something went wrong! Please try again later')) for city_id in chunk)
+                continue
+            for city_id in chunk:
+                if city_id in data:
+                    fetched[city_id] = data[city_id]
+                else:
+                    errors[city_id] = _('City not found')
+
+        entries = {
+            city_id: CacheEntry(
+                entry_data, soft_timeout=int(self.CACHE_TIMEOUT), hard_timeout=int(self.CACHE_HARD_TIMEOUT),
+            )
+            for city_id, entry_data in zip(fetched, self.get_entry_data_list(list(fetched.values()), input_data))
+        }
+
+        if entries:
+            with CACHE_LATENCY.labels('set_many').time():
+                cache.set_many(
+                    {
+                        self.get_cache_key(city_id=city_id, language=input_data['language']): entry
+                        for city_id, entry in entries.items()
+                    },
+                    timeout=int(self.CACHE_HARD_TIMEOUT),
+                    version=int(self.CACHE_VERSION),
+                )
+        return entries, errors
+
 
 class CityListView(BaseWeatherAPIView):
     """
@@ -106,10 +498,12 @@ class CityListView(BaseWeatherAPIView):
 
     CACHE_VERSION = settings.CITY_API_CACHE_VERSION
     CACHE_TIMEOUT = settings.CITY_RESPONSE_CACHE_TIMEOUT
+    CACHE_HARD_TIMEOUT = settings.CITY_RESPONSE_CACHE_HARD_TIMEOUT
+    CACHE_KEY_PREFIXES = ('city_list:',)
 
     def get_cache_key(self, *args, **kwargs):
         """Generate cache key to store response"""
-        return f"city_list:{kwargs['language']}:{kwargs['query'].lower()}"
+        return f"city_list:{kwargs['language']}:{normalize_city_name(kwargs['query'])}"
 
     def get_request_data(self, request, **kwargs):
         """Get request data from url and/or query params"""
@@ -121,4 +515,10 @@ class CityListView(BaseWeatherAPIView):
 
     def get_api_client(self, **kwargs):
         """Get openweathermap api client class"""
+        if settings.CITY_LIST_SOURCE == 'local':
+            return LocalCityClient(language=kwargs['language'])
         return OpenWeatherMapCityClient(api_key=settings.OPEN_WEATHER_API_KEY, language=kwargs['language'])
+
+    def should_cache(self):
+        """Local city searches are answered in-process and never cached"""
+        return settings.CITY_LIST_SOURCE != 'local'
@@ -0,0 +1,4 @@
+from weather_finder.api_settings import *  # noqa: F401,F403
+from benchmarks.settings import ALLOWED_HOSTS  # noqa: F401
+from benchmarks.settings import CACHES  # noqa: F401
+from benchmarks.settings import DEBUG  # noqa: F401
@@ -0,0 +1,200 @@
+"""
+Microbenchmarks of the per-request CPU path, one stage at a time and the whole view dispatch
+
+    make bench-baseline  # store the timings of this machine as the new baseline
+    make bench           # fail if a stage got slower than the baseline by more than BENCH_THRESHOLD
+"""
+import pickle
+
+import pytest
+from django.core.cache import cache
+from django.test import Client
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from api.v1.caching import CacheEntry
+from api.v1.forecasts import Forecast
+from api.v1.helpers import get_wind_direction
+from api.v1.helpers import get_wind_directions
+from api.v1.renderers import FastJSONRenderer
+from api.v1.serializers import WeatherAPIInputSerializer
+from api.v1.transformers import WeatherRecordSchema
+from api.v1.transformers import WeatherResponseSchema
+from api.v1.transformers import CityListResponseSchema
+from api.v1.transformers import localize_forecast
+from api.v1.transformers import localize_weather_record
+from api.v1.transformers import localize_weather_records
+from api.v1.transformers import transform_city_list
+from api.v1.transformers import transform_weather_record
+from api.v1.transformers import transform_weather_response
+from weather_finder.metrics import CACHE_LATENCY
+from weather_finder.metrics import CACHE_REQUESTS
+from weather_finder.metrics import RENDER_LATENCY
+from weather_finder import api_settings
+from weather_finder.metrics import REQUEST_LATENCY
+
+OPEN_WEATHER_MAP_RESPONSE = {
+    'coord': {'lon': 55.3, 'lat': 25.26},
+    'weather': [{'id': 801, 'main': 'Clouds', 'description': 'few clouds', 'icon': '02n'}],
+    'main': {'temp': 32, 'feels_like': 38.18, 'temp_min': 32, 'temp_max': 33, 'pressure': 997, 'humidity': 79},
+    'wind': {'speed': 3.1, 'deg': 150},
+    'clouds': {'all': 20},
+    'sys': {'country': 'AE'},
+    'id': 292223,
+    'name': 'Dubai',
+    'cod': 200,
+}
+CITY_LIST = [dict(OPEN_WEATHER_MAP_RESPONSE, id=city_id) for city_id in range(20)]
+WEATHER_RECORD = WeatherRecordSchema().dump(OPEN_WEATHER_MAP_RESPONSE)
+WEATHER_DATA = localize_weather_record(WEATHER_RECORD, 'en')
+FORECAST_RESPONSE = {
+    'list': [
+        dict(OPEN_WEATHER_MAP_RESPONSE, dt=1596564000 + step * 3 * 60 * 60, wind={'speed': 3.1, 'deg': step * 9})
+        for step in range(40)
+    ],
+    'city': {'id': 292223, 'name': 'Dubai', 'country': 'AE', 'timezone': 14400},
+}
+FORECAST = Forecast.from_response(FORECAST_RESPONSE)
+
+
+def bench_input_serializer(benchmark):
+    def validate():
+        serializer = WeatherAPIInputSerializer(data={'city_id': '292223', 'language': 'en'})
+        serializer.is_valid()
+        return serializer.data
+
+    assert benchmark(validate) == {'city_id': 292223, 'language': 'en'}
+
+
+def bench_weather_response_schema(benchmark):
+    benchmark(WeatherResponseSchema().dump, OPEN_WEATHER_MAP_RESPONSE)
+
+
+def bench_weather_record_schema(benchmark):
+    benchmark(WeatherRecordSchema().dump, OPEN_WEATHER_MAP_RESPONSE)
+
+
+def bench_transform_weather_response(benchmark):
+    benchmark(transform_weather_response, OPEN_WEATHER_MAP_RESPONSE)
+
+
+def bench_transform_weather_record(benchmark):
+    benchmark(transform_weather_record, OPEN_WEATHER_MAP_RESPONSE)
+
+
+def bench_city_list_schema(benchmark):
+    benchmark(lambda: CityListResponseSchema().dump(CITY_LIST, many=True))
+
+
+def bench_transform_city_list(benchmark):
+    benchmark(transform_city_list, CITY_LIST)
+
+
+def bench_localize_weather_record(benchmark):
+    benchmark(localize_weather_record, WEATHER_RECORD, 'de')
+
+
+def bench_localize_weather_records(benchmark):
+    benchmark(localize_weather_records, [WEATHER_RECORD] * 20, 'de')
+
+
+def bench_wind_direction(benchmark):
+    assert benchmark(get_wind_direction, 150, 'en') == 'South-southeast'
+
+
+def bench_wind_directions(benchmark):
+    benchmark(get_wind_directions, list(range(0, 360, 18)), 'en')
+
+
+def bench_cache_entry_pickling(benchmark):
+    entry = CacheEntry(WEATHER_RECORD, soft_timeout=600, hard_timeout=3600)
+    # django-redis pickles with the highest protocol
+    benchmark(lambda: pickle.loads(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)))
+
+
+def bench_forecast_from_response(benchmark):
+    benchmark(Forecast.from_response, FORECAST_RESPONSE)
+
+
+def bench_forecast_unpack(benchmark):
+    benchmark(Forecast.unpack, FORECAST.pack())
+
+
+def bench_localize_forecast(benchmark):
+    benchmark(localize_forecast, FORECAST, 'en')
+
+
+def bench_json_renderer(benchmark):
+    benchmark(JSONRenderer().render, WEATHER_DATA)
+
+
+def bench_fast_json_renderer(benchmark):
+    benchmark(FastJSONRenderer().render, WEATHER_DATA)
+
+
+def record_cache_hit_metrics():
+    """Record the metrics of a cached weather request: request and cache latency, cache status, rendering time"""
+    with CACHE_LATENCY.labels('get').time():
+        pass
+    CACHE_REQUESTS.labels('WeatherDetailsView', 'HIT').inc()
+    RENDER_LATENCY.observe(0.00001)
+    REQUEST_LATENCY.labels('api:v1:weather').observe(0.001)
+
+
+def bench_metrics_per_request(benchmark):
+    benchmark(record_cache_hit_metrics)
+
+
+@pytest.fixture
+def local_cache():
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+        cache.clear()
+        yield cache
+
+
+@override_settings(WEATHER_LANGUAGE_NEUTRAL_CACHE=True)
+def bench_weather_view_cache_hit(benchmark, local_cache):
+    local_cache.set('weather_record:292223', CacheEntry(WEATHER_RECORD, soft_timeout=600, hard_timeout=3600), version=1)
+    client = Client()
+    url = reverse('api:v1:weather', kwargs={'city_id': 292223})
+
+    response = benchmark(client.get, url)
+    assert response.status_code == 200
+    assert response['X-Cache'] == 'HIT'
+
+
+@override_settings(
+    MIDDLEWARE=api_settings.MIDDLEWARE, ROOT_URLCONF=api_settings.ROOT_URLCONF, WEATHER_LANGUAGE_NEUTRAL_CACHE=True
+)
+def bench_weather_view_cache_hit_api_stack(benchmark, local_cache):
+    """Same request as bench_weather_view_cache_hit through the middleware chain of the API-only deployment"""
+    local_cache.set('weather_record:292223', CacheEntry(WEATHER_RECORD, soft_timeout=600, hard_timeout=3600), version=1)
+    client = Client()
+    url = reverse('api:v1:weather', kwargs={'city_id': 292223})
+
+    response = benchmark(client.get, url)
+    assert response.status_code == 200
+    assert response['X-Cache'] == 'HIT'
+
+
+@override_settings(API_CACHE_ENCODED_RESPONSES=True)
+def bench_weather_view_encoded_cache_hit(benchmark, local_cache):
+    body = FastJSONRenderer().render(WEATHER_DATA)
+    local_cache.set('weather_body:en:292223', CacheEntry(body, soft_timeout=600, hard_timeout=3600), version=1)
+    client = Client()
+    url = reverse('api:v1:weather', kwargs={'city_id': 292223})
+
+    response = benchmark(client.get, url)
+    assert response.content == body
+    assert response['X-Cache'] == 'HIT'
+
+
+def bench_forecast_view_cache_hit(benchmark, local_cache):
+    local_cache.set('forecast:292223', CacheEntry(FORECAST.pack(), soft_timeout=1800, hard_timeout=10800), version=1)
+    client = Client()
+    url = reverse('api:v1:forecast', kwargs={'city_id': 292223})
+
+    response = benchmark(client.get, url)
+    assert response.status_code == 200
+    assert response['X-Cache'] == 'HIT'
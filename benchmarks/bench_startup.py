@@ -0,0 +1,14 @@
+"""
+Time to first request of a fresh app process, tracked with the microbenchmarks (see benchmarks.importtime)
+
+    make bench  # fail if starting the app got slower than the baseline by more than BENCH_THRESHOLD
+"""
+from benchmarks.importtime import run_first_request
+
+
+def bench_time_to_first_request(benchmark):
+    benchmark.pedantic(run_first_request, rounds=5, warmup_rounds=1)
+
+
+def bench_time_to_first_request_api_settings(benchmark):
+    benchmark.pedantic(run_first_request, args=('benchmarks.api_settings',), rounds=5, warmup_rounds=1)
@@ -0,0 +1,96 @@
+"""
+Import time report and time to first request of a fresh app process
+
+A new interpreter loads the WSGI app, warms it up like the gunicorn workers are and answers one api request
+without network. Its `-X importtime` output is summed per package. Run from the repository root:
+
+    python -m benchmarks.importtime
+    python -m benchmarks.importtime --settings benchmarks.api_settings --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+# prints the seconds spent loading the app, warming it up and answering the first request
+FIRST_REQUEST_SCRIPT = """
+import time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+loaded = time.perf_counter()
+if {warm_up}:
+    from weather_finder.warmup import warm_up
+    warm_up()
+warmed_up = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {{'PATH_INFO': '/api/v1/weather/1/', 'QUERY_STRING': 'language=invalid'}}
+setup_testing_defaults(environ)
+statuses = []
+b''.join(application(environ, lambda status, headers: statuses.append(status)))
+assert statuses == ['400 Bad Request'], statuses
+print(loaded - started, warmed_up - loaded, time.perf_counter() - warmed_up)
+"""
+
+
+def run_first_request(settings='benchmarks.settings', warm_up=True, importtime=False):
+    """
+    Start a fresh interpreter loading the app and answering one request
+
+    Returns: dict of the seconds spent in the process, loading the app, warming up and answering the first
+        request, and the stderr of the process
+    """
+    options = ['-X', 'importtime'] if importtime else []
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-W', 'ignore', *options, '-c', FIRST_REQUEST_SCRIPT.format(warm_up=warm_up)],
+        env={**os.environ, 'DJANGO_SETTINGS_MODULE': settings},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = time.perf_counter() - started
+    load, warm_up, first_request = (float(value) for value in process.stdout.split())
+    return {'total': total, 'load': load, 'warm_up': warm_up, 'first_request': first_request, 'stderr': process.stderr}
+
+
+def parse_importtime(output):
+    """
+    Parse the `-X importtime` output of a process
+
+    Returns: Counter of the microseconds spent importing the modules of each top level package, not counting
+        the modules they import from other packages
+    """
+    packages = Counter()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_time)
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', default='benchmarks.settings')
+    parser.add_argument('--top', type=int, default=15, help='number of packages to show')
+    parser.add_argument('--no-warm-up', dest='warm_up', action='store_false')
+    args = parser.parse_args()
+
+    timings = run_first_request(args.settings, args.warm_up)
+    report = run_first_request(args.settings, args.warm_up, importtime=True)
+    packages = parse_importtime(report['stderr'])
+
+    print(f'time to first request: {timings["total"] * 1000:.0f}ms')
+    print(f'  load app:       {timings["load"] * 1000:.0f}ms')
+    print(f'  warm up:        {timings["warm_up"] * 1000:.0f}ms')
+    print(f'  first request:  {timings["first_request"] * 1000:.1f}ms')
+    print(f'imports: {sum(packages.values()) / 1000:.0f}ms in {len(packages)} packages (with -X importtime)')
+    for name, microseconds in packages.most_common(args.top):
+        print(f'  {name:<30} {microseconds / 1000:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+Load test the weather endpoint at a fixed request rate against the openweathermap stub
+
+Starts the stub and the app, warms the cache if the scenario asks for it, then sends requests on a fixed
+schedule (open loop: slow responses do not slow down the load) and reports latency percentiles, throughput,
+cache hit ratio from the X-Cache header, and the number of calls the stub received. With --proxy the requests go
+through nginx configured like the production stack (nginx must be installed), its micro-cache hits are reported
+from the X-Proxy-Cache header. Run from the repository root:
+
+    python -m benchmarks.loadtest warm --rps 200 --duration 20
+    python -m benchmarks.loadtest brownout --setup asgi --cache redis --workers 2
+    python -m benchmarks.loadtest warm --rps 500 --proxy nginx-nocache
+    python -m benchmarks.loadtest warm --rps 500 --proxy nginx
+
+Scenarios:
+    cold: empty cache, requests spread over 1000 cities with a Zipf distribution
+    warm: same requests once every city is cached
+    hot-key-expiry: every request is for one city whose cache entry expires every 2 seconds
+    brownout: warm cache of 200 cities refreshed every 5 seconds, in the middle of the run the upstream gets
+        slower than the read timeout and fails half of its requests
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.servers import APP_URL
+from benchmarks.servers import PROXY_URL
+from benchmarks.servers import SETUPS
+from benchmarks.servers import STUB_URL
+from benchmarks.servers import get_app_env
+from benchmarks.servers import percentile
+from benchmarks.servers import start_app
+from benchmarks.servers import start_proxy
+from benchmarks.servers import start_stub
+from benchmarks.servers import stop
+from benchmarks.servers import stop_proxy
+
+
+class Scenario:
+    """Cities requested during a load test and what happens to the upstream while it runs"""
+
+    def __init__(self, cities, warm=False, app_env=None, events=()):
+        """
+        Args:
+            cities: number of distinct cities requested, the first ones more often than the others
+            warm: request every city once before the load test starts
+            app_env: environment variables of the app, eg: shorter cache timeouts
+            events: (fraction of the duration, stub config) changes applied while the test runs,
+                a None config restores the config the stub started with
+        """
+        self.cities = cities
+        self.warm = warm
+        self.app_env = app_env or {}
+        self.events = events
+
+
+SCENARIOS = {
+    'cold': Scenario(cities=1000),
+    'warm': Scenario(cities=1000, warm=True),
+    'hot-key-expiry': Scenario(
+        cities=1,
+        warm=True,
+        app_env={'WEATHER_RESPONSE_CACHE_TIMEOUT': '2', 'WEATHER_RESPONSE_CACHE_HARD_TIMEOUT': '2'},
+    ),
+    'brownout': Scenario(
+        cities=200,
+        warm=True,
+        app_env={'WEATHER_RESPONSE_CACHE_TIMEOUT': '5'},
+        events=[(0.25, {'latency': 3, 'error_rate': 0.5}), (0.75, None)],
+    ),
+}
+
+
+class Result:
+    """Outcome of one request"""
+
+    __slots__ = ('sent_at', 'latency', 'status', 'cache', 'proxy_cache')
+
+    def __init__(self, sent_at, latency, status, cache, proxy_cache=None):
+        self.sent_at = sent_at
+        self.latency = latency
+        self.status = status
+        self.cache = cache
+        self.proxy_cache = proxy_cache
+
+
+# nginx answered from its cache, the X-Cache header is the one cached with the response
+PROXY_CACHE_HITS = ('HIT', 'STALE', 'UPDATING', 'REVALIDATED')
+
+
+async def send(client, base_url, city_id, sent_at, results):
+    started = time.perf_counter()
+    try:
+        response = await client.get(f'{base_url}/api/v1/weather/{city_id}/')
+    except httpx.HTTPError:
+        results.append(Result(sent_at, time.perf_counter() - started, None, None))
+    else:
+        results.append(
+            Result(
+                sent_at,
+                time.perf_counter() - started,
+                response.status_code,
+                response.headers.get('X-Cache'),
+                response.headers.get('X-Proxy-Cache'),
+            )
+        )
+
+
+async def warm_up(client, base_url, city_ids, concurrency=50):
+    """Request every city once so that the load test starts with a warm cache"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(city_id):
+        async with semaphore:
+            await client.get(f'{base_url}/api/v1/weather/{city_id}/')
+
+    await asyncio.gather(*[request(city_id) for city_id in city_ids])
+
+
+async def apply_events(client, events, duration, stub_config):
+    """Change the stub config at the scenario event times"""
+    started = time.perf_counter()
+    for fraction, config in events:
+        await asyncio.sleep(max(started + fraction * duration - time.perf_counter(), 0))
+        await client.post(f'{STUB_URL}/_stub/config', json=stub_config if config is None else config)
+
+
+async def run(scenario, rps, duration, stub_config, base_url=APP_URL):
+    """Run the load test, return the results of every request and the stub stats"""
+    first_id = random.randint(1, 10 ** 6) * 1000
+    city_ids = [first_id + index for index in range(scenario.cities)]
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(scenario.cities)]
+    results = []
+
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        if scenario.warm:
+            await warm_up(client, base_url, city_ids)
+        await client.post(f'{STUB_URL}/_stub/reset')
+
+        events = asyncio.ensure_future(apply_events(client, scenario.events, duration, stub_config))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks = []
+        for index, city_id in enumerate(random.choices(city_ids, weights, k=int(rps * duration))):
+            sent_at = index / rps
+            await asyncio.sleep(max(started + sent_at - loop.time(), 0))
+            tasks.append(asyncio.ensure_future(send(client, base_url, city_id, sent_at, results)))
+        await asyncio.gather(*tasks, events)
+        elapsed = loop.time() - started
+        stats = (await client.get(f'{STUB_URL}/_stub/stats')).json()
+    return results, elapsed, stats
+
+
+def summarize(results, elapsed, stats):
+    """Return latency percentiles in ms, throughput, error and cache counts of a load test"""
+    latencies = [result.latency for result in results]
+    proxy_caches = Counter(result.proxy_cache for result in results if result.proxy_cache)
+    caches = Counter(
+        result.cache for result in results if result.cache and result.proxy_cache not in PROXY_CACHE_HITS
+    )
+    cached = sum(caches.values())
+    return {
+        'requests': len(results),
+        'throughput': len(results) / elapsed,
+        'errors': sum(1 for result in results if result.status != 200),
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'cache': dict(caches),
+        'hit_ratio': (caches['HIT'] + caches['STALE']) / cached if cached else 0,
+        'proxy_cache': dict(proxy_caches),
+        'proxy_hit_ratio': sum(proxy_caches[status] for status in PROXY_CACHE_HITS) / len(results) if results else 0,
+        'upstream_calls': stats.get('calls', 0),
+        'upstream_errors': stats.get('errors', 0),
+        'upstream_timeouts': stats.get('timeouts', 0),
+    }
+
+
+def get_timeline(results):
+    """Return request count, errors and p99 latency in ms for each second of the load test"""
+    seconds = {}
+    for result in results:
+        seconds.setdefault(int(result.sent_at), []).append(result)
+    return [
+        {
+            'second': second,
+            'requests': len(group),
+            'errors': sum(1 for result in group if result.status != 200),
+            'p99': percentile([result.latency for result in group], 99) * 1000,
+        }
+        for second, group in sorted(seconds.items())
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', choices=list(SCENARIOS))
+    parser.add_argument('--rps', type=float, default=100, help='requests sent per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds')
+    parser.add_argument('--setup', choices=list(SETUPS), default='wsgi')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--cache', choices=['locmem', 'redis'], default='locmem', help='use redis with --workers > 1')
+    parser.add_argument('--latency', type=float, default=0.2, help='median upstream latency in seconds')
+    parser.add_argument('--latency-distribution', choices=['fixed', 'uniform', 'exponential', 'lognormal'],
+                        default='lognormal')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--proxy', choices=['none', 'nginx', 'nginx-nocache'], default='none',
+                        help='send the requests through nginx, with or without its api micro-cache')
+    parser.add_argument('--timeline', action='store_true', help='print requests, errors and p99 of every second')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    scenario = SCENARIOS[args.scenario]
+    stub_config = {
+        'latency': args.latency,
+        'latency_distribution': args.latency_distribution,
+        'error_rate': args.error_rate,
+        'timeout_rate': 0,
+    }
+    env = get_app_env(
+        args.cache,
+        OWM_STUB_LATENCY=str(args.latency),
+        OWM_STUB_LATENCY_DISTRIBUTION=args.latency_distribution,
+        OWM_STUB_ERROR_RATE=str(args.error_rate),
+        **scenario.app_env,
+    )
+    stub = start_stub(env)
+    try:
+        server = start_app(args.setup, env, workers=args.workers, threads=args.threads)
+        proxy = None
+        try:
+            if args.proxy != 'none':
+                proxy = start_proxy(cache=args.proxy == 'nginx')
+            base_url = APP_URL if proxy is None else PROXY_URL
+            results, elapsed, stats = asyncio.run(run(scenario, args.rps, args.duration, stub_config, base_url))
+        finally:
+            if proxy is not None:
+                stop_proxy(*proxy)
+            stop(server)
+    finally:
+        stop(stub)
+
+    report = summarize(results, elapsed, stats)
+    print(
+        f'{args.scenario}: {args.setup} x{args.workers}, proxy {args.proxy}, '
+        f'{args.rps:g} req/s for {args.duration:g}s'
+    )
+    print(f"throughput  {report['throughput']:.1f} req/s, {report['errors']} errors in {report['requests']} requests")
+    print(f"latency     p50 {report['p50']:.1f} ms, p95 {report['p95']:.1f} ms, p99 {report['p99']:.1f} ms")
+    print(f"cache       {report['hit_ratio']:.1%} hits {report['cache']}")
+    if args.proxy != 'none':
+        print(f"proxy cache {report['proxy_hit_ratio']:.1%} hits {report['proxy_cache']}")
+    print(
+        f"upstream    {report['upstream_calls']} calls, {report['upstream_errors']} errors, "
+        f"{report['upstream_timeouts']} timeouts"
+    )
+    timeline = get_timeline(results)
+    if args.timeline:
+        for second in timeline:
+            print(f"{second['second']:>4}s {second['requests']:>6} req {second['errors']:>5} errors "
+                  f"p99 {second['p99']:>8.1f} ms")
+    if args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump(
+                dict(report, scenario=args.scenario, setup=args.setup, proxy=args.proxy, timeline=timeline),
+                report_file,
+                indent=2,
+            )
+
+
+if __name__ == '__main__':
+    main()
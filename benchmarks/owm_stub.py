@@ -0,0 +1,170 @@
+"""
+Openweathermap stand-in for benchmarks and load tests
+
+Serves the `weather`, `group`, `find` and `forecast` apis with the shape of the real responses. Latency, error rate and
+timeouts are set with environment variables at start and can be changed while it runs:
+
+    OWM_STUB_LATENCY=0.2 OWM_STUB_LATENCY_DISTRIBUTION=lognormal uvicorn benchmarks.owm_stub:app --port 9100
+
+    curl -X POST localhost:9100/_stub/config -d '{"error_rate": 0.5, "latency": 3}'
+    curl localhost:9100/_stub/stats
+    curl -X POST localhost:9100/_stub/reset
+
+Config:
+    latency: median latency in seconds
+    latency_distribution: fixed, uniform (0 to 2x latency), exponential or lognormal (heavy tail)
+    latency_sigma: shape of the lognormal distribution
+    error_rate: fraction of requests answered with a 500 error
+    timeout_rate: fraction of requests that hang for `timeout` seconds before being answered
+    timeout: seconds a hanging request waits, above the read timeout of the app
+"""
+import asyncio
+import json
+import math
+import os
+import random
+from collections import Counter
+from urllib.parse import parse_qs
+
+CONFIG = {
+    'latency': float(os.environ.get('OWM_STUB_LATENCY', 0.2)),
+    'latency_distribution': os.environ.get('OWM_STUB_LATENCY_DISTRIBUTION', 'fixed'),
+    'latency_sigma': float(os.environ.get('OWM_STUB_LATENCY_SIGMA', 0.5)),
+    'error_rate': float(os.environ.get('OWM_STUB_ERROR_RATE', 0)),
+    'timeout_rate': float(os.environ.get('OWM_STUB_TIMEOUT_RATE', 0)),
+    'timeout': float(os.environ.get('OWM_STUB_TIMEOUT', 30)),
+}
+STATS = Counter()
+
+
+def get_latency():
+    """Return latency of the next response drawn from the configured distribution"""
+    latency = CONFIG['latency']
+    distribution = CONFIG['latency_distribution']
+    if distribution == 'uniform':
+        return random.uniform(0, 2 * latency)
+    if distribution == 'exponential':
+        return random.expovariate(1 / latency) if latency > 0 else 0
+    if distribution == 'lognormal':
+        return random.lognormvariate(math.log(latency), CONFIG['latency_sigma']) if latency > 0 else 0
+    return latency
+
+
+def get_weather(city_id):
+    """Return weather api response for given city, shaped like the real one"""
+    return {
+        'coord': {'lon': 55.3, 'lat': 25.26},
+        'weather': [{'id': 801, 'main': 'Clouds', 'description': 'few clouds', 'icon': '02n'}],
+        'main': {'temp': 32, 'feels_like': 38.18, 'temp_min': 32, 'temp_max': 33, 'pressure': 997, 'humidity': 79},
+        'wind': {'speed': 3.1, 'deg': city_id % 360},
+        'clouds': {'all': 20},
+        'sys': {'country': 'AE'},
+        'id': city_id,
+        'name': f'City {city_id}',
+        'cod': 200,
+    }
+
+
+def get_forecast(city_id):
+    """Return forecast api response for given city: 40 steps of 3 hours, shaped like the real one"""
+    steps = [
+        {
+            'dt': 1596564000 + step * 3 * 60 * 60,
+            'main': {'temp': 28 + step % 8, 'feels_like': 31.2, 'temp_min': 28, 'temp_max': 35, 'pressure': 997,
+                     'humidity': 70 + step % 10},
+            'weather': [{'id': 801, 'main': 'Clouds', 'description': 'few clouds', 'icon': '02n'}],
+            'clouds': {'all': 20},
+            'wind': {'speed': 3.1, 'deg': (city_id + step * 9) % 360},
+            'visibility': 10000,
+            'pop': 0,
+            'sys': {'pod': 'n'},
+        }
+        for step in range(40)
+    ]
+    return {
+        'cod': '200',
+        'message': 0,
+        'cnt': len(steps),
+        'list': steps,
+        'city': {'id': city_id, 'name': f'City {city_id}', 'country': 'AE', 'timezone': 14400},
+    }
+
+
+def get_response(endpoint, query):
+    """Return status and body for given api endpoint and query params"""
+    if endpoint == 'weather':
+        return 200, get_weather(int(query['id'][0]))
+    if endpoint == 'group':
+        cities = [get_weather(int(city_id)) for city_id in query['id'][0].split(',')]
+        return 200, {'cnt': len(cities), 'list': cities}
+    if endpoint == 'forecast':
+        return 200, get_forecast(int(query['id'][0]))
+    if endpoint == 'find':
+        name = query.get('q', ['Dubai'])[0]
+        cities = [dict(get_weather(city_id), name=name) for city_id in range(1, 6)]
+        return 200, {'message': 'accurate', 'cod': '200', 'count': len(cities), 'list': cities}
+    return 404, {'cod': '404', 'message': 'Internal error'}
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, status, data):
+    body = json.dumps(data).encode()
+    await send(
+        {
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        }
+    )
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def control(path, receive, send):
+    """Answer requests to the /_stub/ control endpoints"""
+    if path == '/_stub/config':
+        body = await read_body(receive)
+        if body:
+            CONFIG.update(json.loads(body))
+        return await send_json(send, 200, CONFIG)
+    if path == '/_stub/stats':
+        return await send_json(send, 200, STATS)
+    if path == '/_stub/reset':
+        STATS.clear()
+        return await send_json(send, 200, STATS)
+    return await send_json(send, 404, {'message': 'Not found'})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            await send({'type': message['type'] + '.complete'})
+            if message['type'] == 'lifespan.shutdown':
+                return
+
+    path = scope['path'].rstrip('/')
+    if path.startswith('/_stub/'):
+        return await control(path, receive, send)
+
+    endpoint = path.rsplit('/', 1)[-1]
+    STATS['calls'] += 1
+    STATS[f'calls_{endpoint}'] += 1
+    if random.random() < CONFIG['timeout_rate']:
+        STATS['timeouts'] += 1
+        await asyncio.sleep(CONFIG['timeout'])
+    else:
+        await asyncio.sleep(get_latency())
+
+    if random.random() < CONFIG['error_rate']:
+        STATS['errors'] += 1
+        return await send_json(send, 500, {'cod': 500, 'message': 'Internal server error'})
+    status, data = get_response(endpoint, parse_qs(scope['query_string'].decode()))
+    await send_json(send, status, data)
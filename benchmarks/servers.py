@@ -0,0 +1,141 @@
+"""Helpers starting the openweathermap stub and the app for benchmarks"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+STUB_PORT = 9100
+APP_PORT = 9200
+PROXY_PORT = 9300
+STUB_URL = f'http://127.0.0.1:{STUB_PORT}'
+APP_URL = f'http://127.0.0.1:{APP_PORT}'
+PROXY_URL = f'http://127.0.0.1:{PROXY_PORT}'
+NGINX_CONF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docker/prod/nginx/nginx.conf')
+
+# nginx.conf of the production stack is included in the http block of this config
+NGINX_MAIN_CONF = """
+daemon off;
+worker_processes 1;
+pid {workdir}/nginx.pid;
+error_log {workdir}/error.log warn;
+events {{ worker_connections 4096; }}
+http {{
+    access_log off;
+    client_body_temp_path {workdir}/client_body;
+    proxy_temp_path {workdir}/proxy;
+    fastcgi_temp_path {workdir}/fastcgi;
+    uwsgi_temp_path {workdir}/uwsgi;
+    scgi_temp_path {workdir}/scgi;
+    include {workdir}/weather_finder.conf;
+}}
+"""
+
+# gunicorn command and environment of each way to serve the app
+SETUPS = {
+    'wsgi': (
+        'gunicorn --workers={workers} --threads={threads} --worker-class=gthread weather_finder.wsgi:application',
+        {'API_ASYNC_VIEWS': '0'},
+    ),
+    'asgi': (
+        'gunicorn --workers={workers} --worker-class=uvicorn.workers.UvicornWorker weather_finder.asgi:application',
+        {'API_ASYNC_VIEWS': '1'},
+    ),
+}
+
+
+def get_app_env(cache='locmem', **env):
+    """Return environment variables pointing the app at the stub"""
+    return {
+        'DJANGO_SETTINGS_MODULE': 'benchmarks.settings',
+        'BENCHMARK_CACHE': cache,
+        'OPEN_WEATHER_API_BASE_URL': f'{STUB_URL}/data/2.5/',
+        'OPEN_WEATHER_API_KEY': 'benchmark',
+        **env,
+    }
+
+
+def wait_for_port(port, timeout=30):
+    """Wait until something listens on given local port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f'Nothing is listening on port {port} after {timeout}s')
+
+
+def start(command, env):
+    """Start a server in the background, sharing the environment of the benchmark"""
+    return subprocess.Popen(command.split(), env={**os.environ, **env}, stdout=subprocess.DEVNULL)
+
+
+def stop(process, timeout=10):
+    """Stop a server, killing it if it does not finish its in-flight work in time"""
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def start_stub(env):
+    """Start the openweathermap stub and wait until it accepts requests"""
+    process = start(f'{sys.executable} -m uvicorn benchmarks.owm_stub:app --port {STUB_PORT} --log-level warning', env)
+    wait_for_port(STUB_PORT)
+    return process
+
+
+def start_app(setup, env, workers=2, threads=4):
+    """Start the app served the given way and wait until it accepts requests"""
+    command, setup_env = SETUPS[setup]
+    command = command.format(workers=workers, threads=threads)
+    process = start(f'{command} --bind 127.0.0.1:{APP_PORT} --log-level warning', {**env, **setup_env})
+    wait_for_port(APP_PORT)
+    return process
+
+
+def start_proxy(cache=True):
+    """
+    Start nginx with the config of the production stack in front of the app
+
+    Args:
+        cache: False to turn off the api micro-cache and only keep proxying, gzip and keepalive
+    Returns: nginx process and its working directory, to pass to stop_proxy
+    """
+    nginx = shutil.which('nginx')
+    if nginx is None:
+        raise RuntimeError('nginx is not installed, it is needed to load test through the proxy')
+    workdir = tempfile.mkdtemp(prefix='weather-finder-nginx-')
+    with open(NGINX_CONF) as conf_file:
+        conf = conf_file.read()
+    conf = (
+        conf.replace('server web:8000;', f'server 127.0.0.1:{APP_PORT};')
+        # a single app serves both the api and the pages
+        .replace('server api:8000;', f'server 127.0.0.1:{APP_PORT};')
+        .replace('listen 80;', f'listen {PROXY_PORT};')
+        .replace('/var/cache/nginx/api', f'{workdir}/cache')
+    )
+    if not cache:
+        conf = conf.replace('proxy_cache api;', 'proxy_cache off;')
+    with open(os.path.join(workdir, 'weather_finder.conf'), 'w') as conf_file:
+        conf_file.write(conf)
+    with open(os.path.join(workdir, 'nginx.conf'), 'w') as conf_file:
+        conf_file.write(NGINX_MAIN_CONF.format(workdir=workdir))
+    process = start(f'{nginx} -p {workdir} -c {workdir}/nginx.conf', {})
+    wait_for_port(PROXY_PORT)
+    return process, workdir
+
+
+def stop_proxy(process, workdir):
+    stop(process)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
@@ -0,0 +1,13 @@
+from weather_finder.settings import *  # noqa: F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+# per-process memory cache unless the benchmark is asked to use the redis cache of the app
+if os.environ.get('BENCHMARK_CACHE', 'locmem') == 'locmem':  # noqa: F405
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
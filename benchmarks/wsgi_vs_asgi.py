@@ -0,0 +1,86 @@
+"""
+Compare the sync views served by gunicorn gthread workers with the async views served by uvicorn workers
+
+Both setups run against the openweathermap stub and only see cache misses (a new city id for every request),
+so each request waits on the slow upstream. Run from the repository root:
+
+    python -m benchmarks.wsgi_vs_asgi --requests 2000 --concurrency 500 --latency 0.5
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+from benchmarks.servers import APP_URL
+from benchmarks.servers import SETUPS
+from benchmarks.servers import get_app_env
+from benchmarks.servers import percentile
+from benchmarks.servers import start_app
+from benchmarks.servers import start_stub
+from benchmarks.servers import stop
+
+
+async def run_load(requests, concurrency):
+    """Send `requests` requests for distinct cities, `concurrency` at a time, return latencies and error count"""
+    semaphore = asyncio.Semaphore(concurrency)
+    first_id = random.randint(1, 10 ** 9)
+    latencies = []
+    errors = 0
+
+    async def send(client, city_id):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.get(f'{APP_URL}/api/v1/weather/{city_id}/')
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[send(client, first_id + index) for index in range(requests)])
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.5, help='upstream latency in seconds')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--cache', choices=['locmem', 'redis'], default='locmem')
+    parser.add_argument('--setups', nargs='+', choices=list(SETUPS), default=list(SETUPS))
+    args = parser.parse_args()
+
+    env = get_app_env(args.cache, OWM_STUB_LATENCY=str(args.latency))
+    stub = start_stub(env)
+    try:
+        print(f'{args.requests} requests, concurrency {args.concurrency}, upstream latency {args.latency}s')
+        print(f"{'setup':<6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name in args.setups:
+            server = start_app(name, env, workers=args.workers, threads=args.threads)
+            try:
+                latencies, errors, elapsed = asyncio.run(run_load(args.requests, args.concurrency))
+            finally:
+                stop(server)
+            if not latencies:
+                print(f'{name:<6}{"-":>10}{"-":>10}{"-":>10}{"-":>10}{errors:>8}')
+                continue
+            print(
+                f'{name:<6}{len(latencies) / elapsed:>10.1f}{percentile(latencies, 50) * 1000:>10.0f}'
+                f'{percentile(latencies, 95) * 1000:>10.0f}{percentile(latencies, 99) * 1000:>10.0f}{errors:>8}'
+            )
+    finally:
+        stop(stub)
+
+
+if __name__ == '__main__':
+    main()
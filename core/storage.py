@@ -0,0 +1,18 @@
+from django.contrib.staticfiles import storage
+
+
+class ManifestStaticFilesStorage(storage.ManifestStaticFilesStorage):
+    """
+    Static files storage adding a content hash to collected file names, so they can be cached forever
+
+    The theme stylesheet refers to images that are not shipped with it, those references are kept as they are
+    instead of failing collectstatic.
+    """
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None:
+                raise
+            return name
@@ -0,0 +1,28 @@
+import os
+import re
+import tempfile
+from io import StringIO
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from django.test import override_settings
+
+
+class ManifestStaticFilesStorageTestCase(SimpleTestCase):
+    """Tests for ManifestStaticFilesStorage"""
+
+    def test_collectstatic_add_content_hash_to_file_names(self):
+        """collectstatic: collect hashed copies of the static files, keeping references to missing images"""
+        with tempfile.TemporaryDirectory() as static_root:
+            with override_settings(
+                STATIC_ROOT=static_root, STATICFILES_STORAGE='core.storage.ManifestStaticFilesStorage', DEBUG=False
+            ):
+                # when
+                call_command('collectstatic', interactive=False, stdout=StringIO())
+                url = staticfiles_storage.url('css/style.css')
+            # then
+            self.assertRegex(url, r'^/staticfiles/css/style\.[0-9a-f]{12}\.css$')
+            with open(os.path.join(static_root, url[len('/staticfiles/'):])) as stylesheet:
+                self.assertIn('url("../images/arrow.png")', stylesheet.read())
+            self.assertTrue(any(re.match(r'app\.[0-9a-f]{12}\.js$', name) for name in os.listdir(static_root + '/js')))
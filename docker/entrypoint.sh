@@ -1,8 +1,24 @@
 #!/bin/sh
 
-python manage.py flush --no-input
-python manage.py migrate
-python manage.py compilemessages
-python manage.py collectstatic --noinput
+# stateless nodes (api, prewarmer) set SETUP_DATABASE=0, they start without touching the database and leave the
+# cache versions to the web node. The city catalog is kept, the database is only emptied with FLUSH_DATABASE=1
+if [ "$SETUP_DATABASE" != "0" ]; then
+    if [ "$FLUSH_DATABASE" = "1" ]; then
+        python manage.py flush --no-input
+    fi
+    python manage.py migrate
+    python manage.py sync_cache_versions
+fi
+
+# static files are collected in the image, copy them to the volume nginx serves them from
+if [ -n "$STATIC_EXPORT_DIR" ]; then
+    cp -a "$APP_HOME/staticfiles/." "$STATIC_EXPORT_DIR/"
+fi
+
+# metrics files of previous runs would be aggregated with the new ones
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
 
 exec "$@"
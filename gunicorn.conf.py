@@ -0,0 +1,20 @@
+"""
+gunicorn hooks, read from the working directory by every gunicorn command of the app
+
+Workers are warmed up before serving their first request: by the master before forking them with --preload,
+so they share the loaded modules copy-on-write, otherwise each worker after loading the app.
+"""
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        from weather_finder.warmup import warm_up
+
+        warm_up()
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        from weather_finder.warmup import warm_up
+
+        warm_up()
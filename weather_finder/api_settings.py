@@ -0,0 +1,25 @@
+"""
+Settings of the API-only deployment: /api/ is served through a minimal middleware chain
+
+The weather and city apis do not use sessions, CSRF, users, messages or the language of the request, so their
+middlewares are left out. Serve weather_finder.api_wsgi (or api_asgi) for /api/ behind the proxy, the admin
+and the core pages keep being served by weather_finder.wsgi with the full stack.
+"""
+from weather_finder.settings import *  # noqa: F401,F403
+
+MIDDLEWARE = [
+    'weather_finder.metrics.MetricsMiddleware',
+    'weather_finder.profiling.ProfilingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'weather_finder.api_urls'
+
+# the admin, auth, sessions and messages apps are not loaded, DRF has no user to set on api requests
+INSTALLED_APPS = [
+    'rest_framework',
+    'api',
+    'weather_finder',
+]
+REST_FRAMEWORK = dict(REST_FRAMEWORK, UNAUTHENTICATED_USER=None)  # noqa: F405
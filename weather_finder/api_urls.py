@@ -0,0 +1,12 @@
+"""URL configuration of the API-only deployment, see weather_finder.api_settings"""
+from django.urls import include
+from django.urls import path
+
+from weather_finder.metrics import metrics_view
+from weather_finder.profiling import profile_view
+
+urlpatterns = [
+    path('api/', include(('api.urls', 'api'), namespace='api')),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/<str:profile_id>', profile_view, name='profile'),
+]
@@ -0,0 +1,13 @@
+"""
+WSGI config of the API-only deployment, see weather_finder.api_settings
+
+It exposes the WSGI callable as a module-level variable named ``application``.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weather_finder.api_settings')
+
+application = get_wsgi_application()
@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.base import BaseCache
+
+from weather_finder.metrics import L1_CACHE_EVICTIONS
+from weather_finder.metrics import L1_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class _LocalStore:
+    """In-process LRU storage shared by the backend instances of all threads, like LocMemCache does"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.listener_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class TwoTierCache(BaseCache):
+    """
+    Cache backend keeping a bounded in-process LRU (L1) in front of another cache alias (L2)
+
+    LOCATION is the alias of the L2 cache, eg: the redis cache. Reads are served from L1 while the entry is fresh,
+    L1 entries never outlive the L2 entry and expire with a random jitter so that workers do not all go back to
+    L2 at the same moment. Writes and deletes go to both tiers; atomic operations (add, incr) go to L2 only.
+
+    OPTIONS:
+        MAX_ENTRIES: maximum number of entries kept in L1 per process
+        L1_TIMEOUT: maximum lifetime of an L1 entry in seconds
+        L1_JITTER: fraction of the lifetime randomly cut from each L1 entry
+        INVALIDATION_CHANNEL: redis pub/sub channel used to drop L1 entries in every worker
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = location
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self._l1_jitter = float(options.get('L1_JITTER', 0.1))
+        self._channel = options.get('INVALIDATION_CHANNEL')
+        with _stores_lock:
+            self._store = _stores.setdefault(location, _LocalStore())
+        self._lock = self._store.lock
+        self._l1 = self._store.entries
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _redis_client(self):
+        """Return django-redis client of L2 if it is a redis cache, None otherwise"""
+        client = getattr(self.l2, 'client', None)
+        if client is None or not hasattr(client, 'get_client'):
+            return None
+        return client
+
+    def _l1_key(self, key, version):
+        # L2 formats the version into its keys, so 1 and '1' are the same entry there and must be here too
+        return key, str(self.version if version is None else version)
+
+    def _timeout(self, timeout):
+        """Return timeout in seconds the value is stored with in L2, None if it never expires"""
+        if timeout is DEFAULT_TIMEOUT:
+            return self.l2.default_timeout
+        return timeout
+
+    def _l1_expiry(self, timeout, ttl=None):
+        """Return L1 expiry time for an entry stored with given L2 timeout and remaining L2 ttl"""
+        lifetime = self._l1_timeout
+        for limit in (timeout, ttl):
+            if limit is not None and limit > 0:
+                lifetime = min(lifetime, limit)
+        return time.monotonic() + lifetime * (1 - random.random() * self._l1_jitter)
+
+    def _l1_get(self, l1_key):
+        with self._lock:
+            item = self._l1.get(l1_key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._l1[l1_key]
+                return None
+            self._l1.move_to_end(l1_key)
+            return item
+
+    def _l1_set(self, l1_key, value, expiry):
+        with self._lock:
+            self._l1[l1_key] = (expiry, value)
+            self._l1.move_to_end(l1_key)
+            while len(self._l1) > self._max_entries:
+                self._l1.popitem(last=False)
+                self._store.evictions += 1
+                L1_CACHE_EVICTIONS.inc()
+
+    def _l1_delete(self, l1_key):
+        with self._lock:
+            self._l1.pop(l1_key, None)
+
+    def _fetch(self, keys, version):
+        """Fetch keys from L2 with their remaining ttl in one round trip"""
+        client = self._redis_client()
+        if client is None:
+            return {key: (value, None) for key, value in self.l2.get_many(keys, version=version).items()}
+
+        pipeline = client.get_client(write=False).pipeline()
+        for key in keys:
+            redis_key = client.make_key(key, version=version)
+            pipeline.get(redis_key)
+            pipeline.ttl(redis_key)
+        results = pipeline.execute()
+        found = {}
+        for index, key in enumerate(keys):
+            value, ttl = results[index * 2], results[index * 2 + 1]
+            if value is not None:
+                found[key] = (client.decode(value), ttl)
+        return found
+
+    def get(self, key, default=None, version=None):
+        self._ensure_listener()
+        l1_key = self._l1_key(key, version)
+        item = self._l1_get(l1_key)
+        if item is not None:
+            self._store.hits += 1
+            L1_CACHE_REQUESTS.labels('hit').inc()
+            return item[1]
+
+        self._store.misses += 1
+        L1_CACHE_REQUESTS.labels('miss').inc()
+        found = self._fetch([key], version)
+        if key not in found:
+            return default
+        value, ttl = found[key]
+        self._l1_set(l1_key, value, self._l1_expiry(None, ttl))
+        return value
+
+    def get_many(self, keys, version=None):
+        self._ensure_listener()
+        values = {}
+        missing = []
+        for key in keys:
+            item = self._l1_get(self._l1_key(key, version))
+            if item is None:
+                missing.append(key)
+            else:
+                values[key] = item[1]
+        self._store.hits += len(values)
+        self._store.misses += len(missing)
+        L1_CACHE_REQUESTS.labels('hit').inc(len(values))
+        L1_CACHE_REQUESTS.labels('miss').inc(len(missing))
+        if missing:
+            for key, (value, ttl) in self._fetch(missing, version).items():
+                self._l1_set(self._l1_key(key, version), value, self._l1_expiry(None, ttl))
+                values[key] = value
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout=timeout, version=version)
+        self._l1_set(self._l1_key(key, version), value, self._l1_expiry(self._timeout(timeout)))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = self.l2.set_many(data, timeout=timeout, version=version) or []
+        expiry = self._l1_expiry(self._timeout(timeout))
+        for key, value in data.items():
+            if key not in failed_keys:
+                self._l1_set(self._l1_key(key, version), value, expiry)
+        return failed_keys
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.add(key, value, timeout=timeout, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        return self.l2.incr(key, delta=delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self._l1_get(self._l1_key(key, version)) is not None or self.l2.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self._l1_key(key, version))
+        return self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self._l1_key(key, version))
+        self.l2.delete_many(keys, version=version)
+
+    def clear(self):
+        self.clear_local()
+        self.l2.clear()
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+    def clear_local(self, prefix=''):
+        """Drop L1 entries of this process whose key starts with prefix"""
+        with self._lock:
+            for l1_key in [l1_key for l1_key in self._l1 if l1_key[0].startswith(prefix)]:
+                del self._l1[l1_key]
+
+    def invalidate(self, prefix=''):
+        """Drop L1 entries whose key starts with prefix in every worker subscribed to the invalidation channel"""
+        self.clear_local(prefix)
+        client = self._redis_client()
+        if client is not None and self._channel:
+            client.get_client(write=True).publish(self._channel, json.dumps({'prefix': prefix}))
+
+    def get_stats(self):
+        """Return L1 hit/miss/eviction counters for this process, also exported as prometheus metrics"""
+        with self._lock:
+            size = len(self._l1)
+        return {
+            'hits': self._store.hits, 'misses': self._store.misses, 'evictions': self._store.evictions, 'size': size
+        }
+
+    def _ensure_listener(self):
+        """Start the invalidation listener thread once per process"""
+        if self._store.listener_pid == os.getpid() or not self._channel or self._redis_client() is None:
+            return
+        with self._lock:
+            if self._store.listener_pid == os.getpid():
+                return
+            self._store.listener_pid = os.getpid()
+            # entries inherited from a parent process may have missed invalidations
+            self._l1.clear()
+        threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis_client().get_client(write=False).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    self.clear_local(json.loads(message['data'])['prefix'])
+            except Exception:
+                logger.exception('Cache invalidation listener failed, reconnecting')
+                # anything cached while disconnected may have missed an invalidation
+                self.clear_local()
+                time.sleep(1)
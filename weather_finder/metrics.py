@@ -0,0 +1,145 @@
+import asyncio
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import Http404
+from django.http import HttpResponse
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# cache operations and rendering take microseconds, requests and upstream calls milliseconds to seconds
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+SLOW_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class NoopMetric:
+    """Stand-in for the prometheus metrics when prometheus_client is not installed or METRICS_ENABLED is off"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+    @contextmanager
+    def time(self):
+        yield
+
+
+def is_enabled():
+    """Return True if metrics are collected"""
+    return prometheus_client is not None and settings.METRICS_ENABLED
+
+
+def cache_labels(metric):
+    """Memoize the children of a metric, `labels` validates its arguments and takes a lock on every call"""
+    if metric._labelnames:
+        metric.labels = functools.lru_cache(maxsize=None)(metric.labels)
+    return metric
+
+
+def histogram(name, documentation, labelnames=(), buckets=SLOW_BUCKETS):
+    """Create a histogram, a no-op one if metrics are not collected"""
+    if not is_enabled():
+        return NoopMetric()
+    return cache_labels(prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets))
+
+
+def counter(name, documentation, labelnames=()):
+    """Create a counter, a no-op one if metrics are not collected"""
+    if not is_enabled():
+        return NoopMetric()
+    return cache_labels(prometheus_client.Counter(name, documentation, labelnames))
+
+
+REQUEST_LATENCY = histogram('weather_finder_request_duration_seconds', 'Time spent answering requests', ['view'])
+UPSTREAM_LATENCY = histogram(
+    'weather_finder_upstream_duration_seconds', 'Duration of openweathermap calls', ['endpoint']
+)
+CACHE_LATENCY = histogram(
+    'weather_finder_cache_duration_seconds', 'Duration of cache operations of the api views', ['operation'],
+    buckets=FAST_BUCKETS,
+)
+RENDER_LATENCY = histogram(
+    'weather_finder_render_duration_seconds', 'Time spent rendering JSON response bodies', buckets=FAST_BUCKETS
+)
+CACHE_REQUESTS = counter(
+    'weather_finder_cache_requests_total', 'Cached api data served, by cache status', ['view', 'status']
+)
+L1_CACHE_REQUESTS = counter(
+    'weather_finder_l1_cache_requests_total', 'Reads of the in-process tier of TwoTierCache, by result', ['result']
+)
+L1_CACHE_EVICTIONS = counter(
+    'weather_finder_l1_cache_evictions_total', 'Entries evicted from the in-process tier of TwoTierCache when full'
+)
+UPSTREAM_ERRORS = counter('weather_finder_upstream_errors_total', 'Failed openweathermap calls', ['cause'])
+UPSTREAM_CONNECTIONS = counter(
+    'weather_finder_upstream_connections_total',
+    'Requests to openweathermap of the pooled sessions, by opened or reused connection',
+    ['state'],
+)
+COALESCED_REQUESTS = counter(
+    'weather_finder_coalesced_requests_total', 'Cache misses served by the fetch of another request', ['scope']
+)
+
+
+class MetricsMiddleware:
+    """
+    Time every request by view name, in sync and async middleware chains
+
+    Async chains are kept async so that the async views are not run in a thread because of this middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # mark the instance as a coroutine function for django, like async views are marked
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, started)
+        return response
+
+    def observe(self, request, started):
+        """Record the duration of a request under the name of the view that answered it"""
+        match = request.resolver_match
+        REQUEST_LATENCY.labels(match.view_name if match else '<unresolved>').observe(time.perf_counter() - started)
+
+
+def metrics_view(request):
+    """
+    Serve the metrics in the prometheus text format
+
+    With PROMETHEUS_MULTIPROC_DIR set, the metrics of every worker sharing the directory are aggregated.
+    """
+    if not is_enabled():
+        raise Http404
+    registry = prometheus_client.REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -0,0 +1,253 @@
+import asyncio
+import glob
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseForbidden
+from django.http import JsonResponse
+
+PROFILE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+def get_frame_name(frame):
+    """Return the name of the function of a frame in profiles: module:function"""
+    return f"{frame.f_globals.get('__name__', frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def collapse(frame):
+    """Return the stack of a frame in the collapsed format: outermost function first, separated by ;"""
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """
+    Statistical profiler of one thread, a background thread records its stack every interval
+
+    Each stack is weighted by the time elapsed since the previous sample. A thread running python code only
+    gives up the GIL every sys.getswitchinterval(), so shorter intervals than that do not make CPU bound code
+    sampled more often.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        # seconds spent per collapsed stack
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def run(self):
+        sampled_at = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.stacks[collapse(frame)] += now - sampled_at
+            sampled_at = now
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def get_collapsed(self):
+        """Return the samples in the collapsed stack format, weighted in microseconds"""
+        return format_collapsed({stack: round(seconds * 1000000) for stack, seconds in self.stacks.items()})
+
+
+def format_collapsed(stacks):
+    """Return the collapsed stack format of a dict of stacks to weights"""
+    return ''.join(f'{stack} {weight}\n' for stack, weight in sorted(stacks.items()) if weight)
+
+
+def parse_collapsed(text):
+    """Return a Counter of the weights per stack of a profile in the collapsed stack format"""
+    stacks = Counter()
+    for line in text.splitlines():
+        if line:
+            stack, weight = line.rsplit(' ', 1)
+            stacks[stack] += int(weight)
+    return stacks
+
+
+def to_speedscope(name, stacks):
+    """
+    Convert stacks to a speedscope profile
+
+    Args:
+        name: name of the profile
+        stacks: dict of collapsed stacks to their weight in microseconds
+    """
+    frames = {}
+    samples = []
+    weights = []
+    for stack, weight in stacks.items():
+        samples.append([frames.setdefault(frame, len(frames)) for frame in stack.split(';')])
+        weights.append(weight)
+    return {
+        '$schema': SPEEDSCOPE_SCHEMA,
+        'name': name,
+        'exporter': 'weather_finder',
+        'shared': {'frames': [{'name': frame} for frame in frames]},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'microseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+def get_profile_path(view, profile_id, directory=None):
+    """Return the path of the profile file of a request answered by given view"""
+    view = re.sub(r'[^\w.-]', '.', view)
+    return os.path.join(directory or settings.PROFILING_DIR, f'{view}--{profile_id}.collapsed')
+
+
+def write_profile(view, profile_id, collapsed):
+    """Write a profile to PROFILING_DIR, atomically so that a merge never reads a partial file"""
+    path = get_profile_path(view, profile_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w') as profile_file:
+        profile_file.write(collapsed)
+    os.replace(f'{path}.tmp', path)
+
+
+def find_profiles(directory=None):
+    """
+    Find the profile files of a directory
+
+    Returns: dict of view file names to the paths of their profiles
+    """
+    profiles = {}
+    for path in sorted(glob.glob(os.path.join(directory or settings.PROFILING_DIR, '*--*.collapsed'))):
+        view = os.path.basename(path).rsplit('--', 1)[0]
+        profiles.setdefault(view, []).append(path)
+    return profiles
+
+
+def is_profile_key(key):
+    """Return True if given key is the PROFILING_KEY"""
+    return bool(key and settings.PROFILING_KEY) and hmac.compare_digest(key.encode(), settings.PROFILING_KEY.encode())
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests to the api with a sampling profiler, in sync and async middleware chains
+
+    PROFILING_SAMPLE_RATE of the requests under PROFILING_PATH_PREFIX are sampled every PROFILING_INTERVAL
+    seconds, requests sending the PROFILING_KEY in an X-Profile-Key header every PROFILING_FULL_INTERVAL seconds
+    and answered with the X-Profile-Id of their profile. The middleware is not used when both are disabled.
+
+    Only the thread of the request is sampled: profiles of async views also show the coroutines running on the
+    event loop meanwhile and miss the code run in thread pools.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not (settings.PROFILING_SAMPLE_RATE or settings.PROFILING_KEY):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # mark the instance as a coroutine function for django, like async views are marked
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        requested = self.is_requested(request)
+        if not requested and not self.is_sampled(request):
+            return self.get_response(request)
+        sampler = self.start_sampler(requested)
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        self.save(request, response, sampler, requested)
+        return response
+
+    async def __acall__(self, request):
+        requested = self.is_requested(request)
+        if not requested and not self.is_sampled(request):
+            return await self.get_response(request)
+        sampler = self.start_sampler(requested)
+        try:
+            response = await self.get_response(request)
+        finally:
+            sampler.stop()
+        self.save(request, response, sampler, requested)
+        return response
+
+    def is_requested(self, request):
+        """Return True if the request asks for a full profile with the PROFILING_KEY"""
+        return request.path.startswith(settings.PROFILING_PATH_PREFIX) and is_profile_key(
+            request.META.get('HTTP_X_PROFILE_KEY')
+        )
+
+    def is_sampled(self, request):
+        """Return True if the request is one of the PROFILING_SAMPLE_RATE profiled requests"""
+        return random.random() < settings.PROFILING_SAMPLE_RATE and request.path.startswith(
+            settings.PROFILING_PATH_PREFIX
+        )
+
+    def start_sampler(self, requested):
+        """Start sampling the thread of the request"""
+        interval = settings.PROFILING_FULL_INTERVAL if requested else settings.PROFILING_INTERVAL
+        return Sampler(threading.get_ident(), interval).start()
+
+    def save(self, request, response, sampler, requested):
+        """Write the profile of a request, requests that were not sampled once are skipped unless requested"""
+        if not sampler.stacks and not requested:
+            return
+        match = request.resolver_match
+        profile_id = uuid.uuid4().hex
+        write_profile(match.view_name if match else '<unresolved>', profile_id, sampler.get_collapsed())
+        if requested:
+            response['X-Profile-Id'] = profile_id
+
+
+def profile_view(request, profile_id):
+    """
+    Serve the profile of a request in the speedscope format, or collapsed with ?format=collapsed
+
+    Needs the PROFILING_KEY in an X-Profile-Key header.
+    """
+    if not settings.PROFILING_KEY:
+        raise Http404
+    if not is_profile_key(request.META.get('HTTP_X_PROFILE_KEY')):
+        return HttpResponseForbidden()
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        raise Http404
+    paths = glob.glob(os.path.join(settings.PROFILING_DIR, f'*--{profile_id}.collapsed'))
+    if not paths:
+        raise Http404
+    with open(paths[0]) as profile_file:
+        collapsed = profile_file.read()
+    if request.GET.get('format') == 'collapsed':
+        return HttpResponse(collapsed, content_type='text/plain')
+    return JsonResponse(to_speedscope(profile_id, parse_collapsed(collapsed)))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 from django.utils.translation import ugettext_lazy as _
 
@@ -24,7 +25,7 @@ BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
 SECRET_KEY = os.environ.get('SECRET_KEY', 'zxjji+263&u=f0nd!xj1x3i90gj%5&dm#o8t^##j-rj9_ghi7=')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = os.environ.get('DEBUG', True)
+DEBUG = os.environ.get('DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', ['*'])
 
@@ -44,6 +45,8 @@ INSTALLED_APPS = [
     'weather_finder',
 ]
 MIDDLEWARE = [
+    'weather_finder.metrics.MetricsMiddleware',
+    'weather_finder.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -75,6 +78,8 @@ TEMPLATES = [
 
 STATIC_URL = "/staticfiles/"
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
+# core.storage.ManifestStaticFilesStorage adds a content hash to file names, nginx caches those forever
+STATICFILES_STORAGE = os.environ.get('STATICFILES_STORAGE', 'django.contrib.staticfiles.storage.StaticFilesStorage')
 
 WSGI_APPLICATION = 'weather_finder.wsgi.application'
 
@@ -94,6 +99,36 @@ CACHES = {
     }
 }
 
+# Optional in-process LRU in front of redis, see weather_finder.cache.TwoTierCache
+CACHE_L1_ENABLED = os.environ.get('CACHE_L1_ENABLED', '0') == '1'
+if CACHE_L1_ENABLED:
+    CACHES['redis'] = CACHES['default']
+    CACHES['default'] = {
+        "BACKEND": "weather_finder.cache.TwoTierCache",
+        "LOCATION": "redis",
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get('CACHE_L1_MAX_ENTRIES', 2048)),
+            "L1_TIMEOUT": float(os.environ.get('CACHE_L1_TIMEOUT', 5)),
+            "L1_JITTER": 0.2,
+            "INVALIDATION_CHANNEL": "cache-invalidation",
+        },
+    }
+
+
+# Prometheus metrics served on /metrics, needs prometheus_client. Point PROMETHEUS_MULTIPROC_DIR to an empty
+# directory shared by the gunicorn workers to aggregate their metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# Sampling profiler: PROFILING_SAMPLE_RATE of the requests under PROFILING_PATH_PREFIX are sampled every
+# PROFILING_INTERVAL seconds, requests sending the PROFILING_KEY in an X-Profile-Key header every
+# PROFILING_FULL_INTERVAL seconds. Profiles are written to PROFILING_DIR, see `manage.py merge_profiles`
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_KEY = os.environ.get('PROFILING_KEY', '')
+PROFILING_INTERVAL = float(os.environ.get('PROFILING_INTERVAL', 0.005))
+PROFILING_FULL_INTERVAL = float(os.environ.get('PROFILING_FULL_INTERVAL', 0.001))
+PROFILING_PATH_PREFIX = '/api/v1/'
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'weather_finder_profiles'))
+
 
 LOGGING = {
     'version': 1,
@@ -110,7 +145,7 @@ LOGGING = {
 }
 
 
-REST_FRAMEWORK = {'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer']}
+REST_FRAMEWORK = {'DEFAULT_RENDERER_CLASSES': ['api.v1.renderers.FastJSONRenderer']}
 
 
 # Password validation
@@ -149,10 +184,93 @@ LOCALE_PATHS = (
 )
 
 # Openweather API config
-OPEN_WEATHER_API_BASE_URL = 'http://api.openweathermap.org/data/2.5/'
+OPEN_WEATHER_API_BASE_URL = os.environ.get('OPEN_WEATHER_API_BASE_URL', 'http://api.openweathermap.org/data/2.5/')
 OPEN_WEATHER_API_KEY = os.environ.get('OPEN_WEATHER_API_KEY')
 OPEN_WEATHER_API_TIMEOUT = 2
+OPEN_WEATHER_CITY_LIST_URL = 'http://bulk.openweathermap.org/sample/city.list.json.gz'
+OPEN_WEATHER_API_CONNECT_TIMEOUT = float(os.environ.get('OPEN_WEATHER_API_CONNECT_TIMEOUT', OPEN_WEATHER_API_TIMEOUT))
+OPEN_WEATHER_API_READ_TIMEOUT = float(os.environ.get('OPEN_WEATHER_API_READ_TIMEOUT', OPEN_WEATHER_API_TIMEOUT))
+OPEN_WEATHER_API_POOL_SIZE = int(os.environ.get('OPEN_WEATHER_API_POOL_SIZE', 8))
+OPEN_WEATHER_API_POOL_CONNECTIONS = int(os.environ.get('OPEN_WEATHER_API_POOL_CONNECTIONS', 2))
+OPEN_WEATHER_API_KEEP_ALIVE = os.environ.get('OPEN_WEATHER_API_KEEP_ALIVE', '1') == '1'
+# Read timeouts follow twice the p99 latency of the last upstream calls of the process, down to
+# OPEN_WEATHER_API_MIN_READ_TIMEOUT. Calls that did not reach openweathermap or got a 502, 503 or 504 are retried
+OPEN_WEATHER_API_ADAPTIVE_TIMEOUT = os.environ.get('OPEN_WEATHER_API_ADAPTIVE_TIMEOUT', '1') == '1'
+OPEN_WEATHER_API_MIN_READ_TIMEOUT = float(os.environ.get('OPEN_WEATHER_API_MIN_READ_TIMEOUT', 0.5))
+OPEN_WEATHER_API_LATENCY_MIN_SAMPLES = 20
+OPEN_WEATHER_API_RETRIES = int(os.environ.get('OPEN_WEATHER_API_RETRIES', 1))
+OPEN_WEATHER_API_RETRY_BACKOFF = 0.1
+# Circuit breaker shared in redis: OPEN_WEATHER_API_BREAKER_FAILURES failures within OPEN_WEATHER_API_BREAKER_WINDOW
+# seconds fail every call for OPEN_WEATHER_API_BREAKER_OPEN_TIMEOUT seconds, then one call probes the api
+OPEN_WEATHER_API_CIRCUIT_BREAKER = os.environ.get('OPEN_WEATHER_API_CIRCUIT_BREAKER', '1') == '1'
+OPEN_WEATHER_API_BREAKER_FAILURES = int(os.environ.get('OPEN_WEATHER_API_BREAKER_FAILURES', 5))
+OPEN_WEATHER_API_BREAKER_WINDOW = int(os.environ.get('OPEN_WEATHER_API_BREAKER_WINDOW', 10))
+OPEN_WEATHER_API_BREAKER_OPEN_TIMEOUT = int(os.environ.get('OPEN_WEATHER_API_BREAKER_OPEN_TIMEOUT', 15))
+# Async views: serve the weather and city endpoints with native async views, only under the ASGI app
+API_ASYNC_VIEWS = os.environ.get('API_ASYNC_VIEWS', '0') == '1'
+OPEN_WEATHER_API_ASYNC_MAX_CONNECTIONS = int(os.environ.get('OPEN_WEATHER_API_ASYNC_MAX_CONNECTIONS', 1000))
 WEATHER_RESPONSE_CACHE_TIMEOUT = os.environ.get('WEATHER_RESPONSE_CACHE_TIMEOUT', 10*60)
 CITY_RESPONSE_CACHE_TIMEOUT = os.environ.get('CITY_RESPONSE_CACHE_TIMEOUT', 30*24*60*60)
+# Stale responses are served and refreshed in the background until the hard timeout
+WEATHER_RESPONSE_CACHE_HARD_TIMEOUT = os.environ.get('WEATHER_RESPONSE_CACHE_HARD_TIMEOUT', 60*60)
+CITY_RESPONSE_CACHE_HARD_TIMEOUT = os.environ.get('CITY_RESPONSE_CACHE_HARD_TIMEOUT', 60*24*60*60)
+# Forecasts: one language neutral entry per city holding its packed forecast, updated every 3 hours upstream
+FORECAST_API_CACHE_VERSION = os.environ.get('FORECAST_API_CACHE_VERSION', 1)
+FORECAST_RESPONSE_CACHE_TIMEOUT = os.environ.get('FORECAST_RESPONSE_CACHE_TIMEOUT', 30*60)
+FORECAST_RESPONSE_CACHE_HARD_TIMEOUT = os.environ.get('FORECAST_RESPONSE_CACHE_HARD_TIMEOUT', 3*60*60)
+CACHE_REFRESH_WORKERS = int(os.environ.get('CACHE_REFRESH_WORKERS', 2))
 WEATHER_API_CACHE_VERSION = os.environ.get('WEATHER_API_CACHE_VERSION', 1)
+# Cache one language neutral weather record per city and translate it per request, changes the weather cache keys
+WEATHER_LANGUAGE_NEUTRAL_CACHE = os.environ.get('WEATHER_LANGUAGE_NEUTRAL_CACHE', '0') == '1'
+# Cache the rendered JSON body of weather and city responses per language, hits are returned without
+# decoding or encoding. Takes precedence over WEATHER_LANGUAGE_NEUTRAL_CACHE for the cached entries
+API_CACHE_ENCODED_RESPONSES = os.environ.get('API_CACHE_ENCODED_RESPONSES', '0') == '1'
+# Batch weather requests: misses are fetched from the openweathermap group api in chunks of
+# WEATHER_BATCH_CHUNK_SIZE ids (20 at most), WEATHER_BATCH_WORKERS chunks at a time
+WEATHER_BATCH_MAX_IDS = int(os.environ.get('WEATHER_BATCH_MAX_IDS', 100))
+WEATHER_BATCH_CHUNK_SIZE = 20
+WEATHER_BATCH_WORKERS = int(os.environ.get('WEATHER_BATCH_WORKERS', 4))
+# Pre-warmer (manage.py prewarm_weather): weather requests are counted per city and language in redis, every
+# WEATHER_PREWARM_INTERVAL seconds the WEATHER_PREWARM_TOP most requested cities whose entry goes stale within
+# WEATHER_PREWARM_LEAD_TIME seconds are refreshed, with at most WEATHER_PREWARM_RATE_SHARE of the
+# OPEN_WEATHER_API_CALLS_PER_MINUTE allowed by the openweathermap plan
+OPEN_WEATHER_API_CALLS_PER_MINUTE = int(os.environ.get('OPEN_WEATHER_API_CALLS_PER_MINUTE', 60))
+WEATHER_POPULARITY_TRACKING = os.environ.get('WEATHER_POPULARITY_TRACKING', '1') == '1'
+WEATHER_POPULARITY_FLUSH_INTERVAL = 10
+# requests count half as much after this many seconds
+WEATHER_POPULARITY_HALF_LIFE = int(os.environ.get('WEATHER_POPULARITY_HALF_LIFE', 60*60))
+WEATHER_POPULARITY_MAX_CITIES = 10000
+WEATHER_PREWARM_INTERVAL = int(os.environ.get('WEATHER_PREWARM_INTERVAL', 30))
+WEATHER_PREWARM_TOP = int(os.environ.get('WEATHER_PREWARM_TOP', 200))
+WEATHER_PREWARM_LEAD_TIME = int(os.environ.get('WEATHER_PREWARM_LEAD_TIME', 60))
+WEATHER_PREWARM_RATE_SHARE = float(os.environ.get('WEATHER_PREWARM_RATE_SHARE', 0.2))
+# the lease of a cycle expires this many seconds before the next cycle starts
+WEATHER_PREWARM_LEASE_MARGIN = 2
+# Call budget: openweathermap calls take a token of a bucket in redis shared by all workers, holding
+# at most OPEN_WEATHER_API_BURST tokens and refilled at OPEN_WEATHER_API_CALLS_PER_MINUTE, no 60 seconds ever
+# allow more than OPEN_WEATHER_API_CALLS_PER_MINUTE calls. A call is only made if it leaves the reserve of its
+# priority (share of the bucket) for the higher priorities
+OPEN_WEATHER_API_RATE_BUDGET = os.environ.get('OPEN_WEATHER_API_RATE_BUDGET', '1') == '1'
+OPEN_WEATHER_API_BURST = int(os.environ.get('OPEN_WEATHER_API_BURST', 10))
+OPEN_WEATHER_API_PRIORITY_RESERVES = {
+    'weather': 0,
+    'autocomplete': float(os.environ.get('OPEN_WEATHER_API_AUTOCOMPLETE_RESERVE', 0.2)),
+    'prewarm': float(os.environ.get('OPEN_WEATHER_API_PREWARM_RESERVE', 0.5)),
+}
 CITY_API_CACHE_VERSION = os.environ.get('CITY_API_CACHE_VERSION', 1)
+# 'local' answers city searches from the city catalog loaded with `manage.py load_cities`
+CITY_LIST_SOURCE = os.environ.get('CITY_LIST_SOURCE', 'openweathermap')
+CITY_SEARCH_LIMIT = 10
+# Fuzzy city search: trigram posting lists longer than CITY_SEARCH_MAX_POSTINGS are skipped when collecting
+# candidates, the CITY_SEARCH_CANDIDATES sharing most trigrams are ranked by similarity
+CITY_SEARCH_MAX_POSTINGS = 5000
+CITY_SEARCH_CANDIDATES = 100
+CITY_SEARCH_MIN_SIMILARITY = 0.25
+# Prebuilt city index files written by `manage.py build_city_index`, checked for replacement every interval
+CITY_INDEX_PATH = os.environ.get('CITY_INDEX_PATH', os.path.join(BASE_DIR, 'data', 'city_index.{language}.bin'))
+CITY_INDEX_CHECK_INTERVAL = 30
+
+# Cache miss coalescing: one process refreshes a key while the others wait up to CACHE_LEASE_WAIT seconds
+CACHE_LEASE_TIMEOUT = int(os.environ.get('CACHE_LEASE_TIMEOUT', 5))
+CACHE_LEASE_WAIT = float(os.environ.get('CACHE_LEASE_WAIT', 2))
+CACHE_LEASE_POLL_INTERVAL = 0.05
@@ -4,6 +4,12 @@ DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DI
 
 WEATHER_API_CACHE_VERSION = 1
 WEATHER_RESPONSE_CACHE_TIMEOUT = 600
+WEATHER_RESPONSE_CACHE_HARD_TIMEOUT = 3600
 CITY_API_CACHE_VERSION = 1
 CITY_RESPONSE_CACHE_TIMEOUT = 600
+CITY_RESPONSE_CACHE_HARD_TIMEOUT = 3600
 LANGUAGES = [('en', 'English')]
+WEATHER_POPULARITY_TRACKING = False
+OPEN_WEATHER_API_RATE_BUDGET = False
+OPEN_WEATHER_API_CIRCUIT_BREAKER = False
+OPEN_WEATHER_API_RETRIES = 0
@@ -0,0 +1,29 @@
+from django.test import SimpleTestCase
+from django.test import override_settings
+
+from weather_finder import api_settings
+
+
+@override_settings(
+    MIDDLEWARE=api_settings.MIDDLEWARE,
+    ROOT_URLCONF=api_settings.ROOT_URLCONF,
+    INSTALLED_APPS=api_settings.INSTALLED_APPS,
+    REST_FRAMEWORK=api_settings.REST_FRAMEWORK,
+)
+class APISettingsTestCase(SimpleTestCase):
+    """Tests for the API-only deployment"""
+
+    def test_serve_api_without_session(self):
+        """api: answer api requests without setting a session or CSRF cookie"""
+        # when
+        response = self.client.get('/api/v1/weather/1/', {'language': 'invalid'})
+        # then
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.cookies, {})
+        self.assertNotIn('X-Frame-Options', response)
+
+    def test_do_not_serve_admin_and_core_pages(self):
+        """urls: leave the admin and the core pages to the full deployment"""
+        # when/then
+        self.assertEqual(self.client.get('/admin/').status_code, 404)
+        self.assertEqual(self.client.get('/en/').status_code, 404)
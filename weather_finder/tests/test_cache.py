@@ -0,0 +1,156 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+from django.test import override_settings
+from prometheus_client import REGISTRY
+
+from weather_finder.cache import TwoTierCache
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'l2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'l2'},
+}
+
+
+@override_settings(CACHES=CACHES)
+class TwoTierCacheTestCase(SimpleTestCase):
+    """Tests for TwoTierCache"""
+
+    def setUp(self):
+        self.l2 = caches['l2']
+        self.l2.clear()
+        patcher = mock.patch.dict('weather_finder.cache._stores', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = TwoTierCache('l2', {'OPTIONS': {'MAX_ENTRIES': 2, 'L1_TIMEOUT': 5, 'L1_JITTER': 0}})
+
+    def test_get_return_value_from_l1_without_l2_round_trip(self):
+        """get: serve values from the in-process cache once they were read from L2"""
+        # given
+        self.l2.set('weather_record:1', {'city': 'Berlin'})
+        self.cache.get('weather_record:1')
+        self.l2.delete('weather_record:1')
+        # when
+        actual = self.cache.get('weather_record:1')
+        # then
+        self.assertEqual(actual, {'city': 'Berlin'})
+        self.assertEqual(self.cache.get_stats(), {'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1})
+
+    def test_get_return_default_for_missing_key(self):
+        """get: return default if the key is in neither tier"""
+        # when/then
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+
+    def test_set_write_both_tiers(self):
+        """set: store the value in L2 and L1"""
+        # when
+        self.cache.set('weather_record:1', {'city': 'Berlin'}, timeout=60, version=2)
+        # then
+        self.assertEqual(self.l2.get('weather_record:1', version=2), {'city': 'Berlin'})
+        self.assertEqual(self.cache.get('weather_record:1', version=2), {'city': 'Berlin'})
+        self.assertEqual(self.cache.get_stats()['hits'], 1)
+
+    def test_get_return_value_set_with_int_version_for_str_version(self):
+        """get: read the L1 entry written with the same version given as int or str, like L2 does"""
+        # given
+        self.cache.set('weather_record:1', {'city': 'Berlin'}, version=1)
+        self.cache.get('weather_record:1', version='1')
+        # when
+        self.cache.set('weather_record:1', {'city': 'Munich'}, version=1)
+        # then
+        self.assertEqual(self.cache.get('weather_record:1', version='1'), {'city': 'Munich'})
+        self.assertEqual(self.cache.get_stats()['size'], 1)
+
+    @mock.patch('weather_finder.cache.time.monotonic')
+    def test_get_never_serve_l1_entry_longer_than_l2_timeout(self, mock_monotonic):
+        """get: expire L1 entries no later than the timeout they were stored with"""
+        # given
+        mock_monotonic.return_value = 100
+        self.cache.set('weather_record:1', {'city': 'Berlin'}, timeout=1)
+        self.l2.delete('weather_record:1')
+        mock_monotonic.return_value = 101
+        # when/then
+        self.assertIsNone(self.cache.get('weather_record:1'))
+
+    def test_set_evict_least_recently_used_entry(self):
+        """set: evict the least recently used entry once MAX_ENTRIES is reached"""
+        # given
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        # when
+        self.cache.set('c', 3)
+        # then
+        self.assertEqual(self.cache.get_stats()['size'], 2)
+        self.assertEqual(self.cache.get_stats()['evictions'], 1)
+        self.l2.clear()
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_get_many_read_missing_keys_from_l2(self):
+        """get_many: combine L1 hits and L2 values"""
+        # given
+        self.cache.set('a', 1)
+        self.l2.set('b', 2)
+        # when
+        actual = self.cache.get_many(['a', 'b', 'c'])
+        # then
+        self.assertEqual(actual, {'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get_stats()['hits'], 1)
+
+    def test_get_export_l1_hits_and_misses(self):
+        """get: count L1 hits and misses in the prometheus metrics"""
+        # given
+        before = {
+            result: REGISTRY.get_sample_value('weather_finder_l1_cache_requests_total', {'result': result}) or 0
+            for result in ('hit', 'miss')
+        }
+        self.cache.set('a', 1)
+        # when
+        self.cache.get('a')
+        self.cache.get_many(['a', 'b'])
+        # then
+        for result, count in (('hit', 2), ('miss', 1)):
+            self.assertEqual(
+                REGISTRY.get_sample_value('weather_finder_l1_cache_requests_total', {'result': result}),
+                before[result] + count,
+            )
+
+    def test_l1_shared_between_backend_instances(self):
+        """TwoTierCache: share L1 between the backend instances django creates per thread"""
+        # given
+        other_thread_cache = TwoTierCache('l2', {})
+        self.cache.set('a', 1)
+        self.l2.clear()
+        # when/then
+        self.assertEqual(other_thread_cache.get('a'), 1)
+
+    def test_add_use_l2_only(self):
+        """add: go to L2 so that the operation stays atomic across workers"""
+        # given
+        self.l2.set('lease', 'other-worker')
+        # when/then
+        self.assertFalse(self.cache.add('lease', 'token'))
+
+    def test_delete_remove_both_tiers(self):
+        """delete: remove the value from L1 and L2"""
+        # given
+        self.cache.set('a', 1)
+        # when
+        self.cache.delete('a')
+        # then
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.l2.get('a'))
+
+    def test_clear_local_drop_entries_with_prefix(self):
+        """clear_local: drop only L1 entries whose key starts with prefix"""
+        # given
+        self.cache.set('weather_record:1', 1)
+        self.cache.set('city_list:en:berlin', 2)
+        self.l2.clear()
+        # when
+        self.cache.clear_local('weather_record:')
+        # then
+        self.assertIsNone(self.cache.get('weather_record:1'))
+        self.assertEqual(self.cache.get('city_list:en:berlin'), 2)
@@ -0,0 +1,104 @@
+import asyncio
+from unittest import mock
+
+import prometheus_client
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test import SimpleTestCase
+from django.test import override_settings
+from django.urls import resolve
+
+from weather_finder.metrics import CACHE_REQUESTS
+from weather_finder.metrics import MetricsMiddleware
+from weather_finder.metrics import NoopMetric
+from weather_finder.metrics import counter
+from weather_finder.metrics import histogram
+
+
+def get_request_count(view):
+    return prometheus_client.REGISTRY.get_sample_value(
+        'weather_finder_request_duration_seconds_count', {'view': view}
+    ) or 0
+
+
+class MetricsTestCase(SimpleTestCase):
+    """Tests for metrics helpers"""
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_metrics_are_noop_if_disabled(self):
+        """histogram/counter: return no-op metrics if metrics are disabled"""
+        # when/then
+        self.assertIsInstance(histogram('disabled_histogram', 'Disabled', ['label']), NoopMetric)
+        self.assertIsInstance(counter('disabled_counter', 'Disabled'), NoopMetric)
+
+    def test_labels_return_same_child(self):
+        """labels: memoize the children of labeled metrics"""
+        # when/then
+        self.assertIs(CACHE_REQUESTS.labels('View', 'HIT'), CACHE_REQUESTS.labels('View', 'HIT'))
+
+
+class MetricsMiddlewareTestCase(SimpleTestCase):
+    """Tests for MetricsMiddleware"""
+
+    def setUp(self):
+        self.request = RequestFactory().get('/api/v1/weather/1/')
+        self.request.resolver_match = resolve('/api/v1/weather/1/')
+
+    def test_call_record_request_duration_by_view(self):
+        """__call__: time the request under the name of its view"""
+        # given
+        middleware = MetricsMiddleware(lambda request: HttpResponse())
+        before = get_request_count('api:v1:weather')
+        # when
+        middleware(self.request)
+        # then
+        self.assertEqual(get_request_count('api:v1:weather'), before + 1)
+
+    def test_call_stay_async_in_async_chain(self):
+        """__call__: await async views without running them in a thread"""
+        # given
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = MetricsMiddleware(get_response)
+        before = get_request_count('api:v1:weather')
+        # when
+        response = async_to_sync(middleware)(self.request)
+        # then
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_request_count('api:v1:weather'), before + 1)
+
+
+class MetricsViewTestCase(SimpleTestCase):
+    """Tests for metrics_view"""
+
+    def test_get_return_prometheus_metrics(self):
+        """get: return the metrics of the process in the prometheus text format"""
+        # given
+        self.client.get('/api/v1/weather/1/', {'language': 'invalid'})
+        # when
+        response = self.client.get('/metrics')
+        # then
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], prometheus_client.CONTENT_TYPE_LATEST)
+        self.assertIn(b'weather_finder_request_duration_seconds_count{view="api:v1:weather"}', response.content)
+
+    @mock.patch('weather_finder.metrics.multiprocess.MultiProcessCollector')
+    def test_get_aggregate_metrics_of_all_workers(self, mock_collector):
+        """get: collect the metrics of every worker in multiprocess mode"""
+        # when
+        with mock.patch.dict('os.environ', {'PROMETHEUS_MULTIPROC_DIR': '/tmp/metrics'}):
+            response = self.client.get('/metrics')
+        # then
+        self.assertEqual(response.status_code, 200)
+        mock_collector.assert_called_once()
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_get_return_not_found_if_disabled(self):
+        """get: return 404 if metrics are disabled"""
+        # when
+        response = self.client.get('/metrics')
+        # then
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,195 @@
+import asyncio
+import sys
+import tempfile
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test import SimpleTestCase
+from django.test import override_settings
+from django.urls import resolve
+
+from weather_finder.profiling import ProfilingMiddleware
+from weather_finder.profiling import Sampler
+from weather_finder.profiling import collapse
+from weather_finder.profiling import find_profiles
+from weather_finder.profiling import get_profile_path
+from weather_finder.profiling import parse_collapsed
+from weather_finder.profiling import to_speedscope
+from weather_finder.profiling import write_profile
+
+
+def busy(seconds=0.03):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilingTestCase(SimpleTestCase):
+    """Tests for profiling helpers"""
+
+    def test_collapse(self):
+        """collapse: return the stack of a frame, outermost function first"""
+        # when
+        stack = collapse(sys._getframe())
+        # then
+        self.assertTrue(stack.endswith(f'{__name__}:test_collapse'))
+        self.assertGreater(stack.count(';'), 1)
+
+    def test_parse_collapsed(self):
+        """parse_collapsed: sum the weights of each stack"""
+        # when
+        stacks = parse_collapsed('a;b 10\na;c 5\na;b 2\n')
+        # then
+        self.assertEqual(stacks, {'a;b': 12, 'a;c': 5})
+
+    def test_to_speedscope(self):
+        """to_speedscope: convert stacks to a sampled speedscope profile sharing frames"""
+        # when
+        profile = to_speedscope('view', {'a;b': 12, 'a;c': 5})
+        # then
+        self.assertEqual(profile['shared']['frames'], [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}])
+        self.assertEqual(profile['profiles'][0]['samples'], [[0, 1], [0, 2]])
+        self.assertEqual(profile['profiles'][0]['weights'], [12, 5])
+        self.assertEqual(profile['profiles'][0]['endValue'], 17)
+
+    def test_sampler_record_stacks_of_thread(self):
+        """Sampler: record the time spent in the stacks of the sampled thread"""
+        # given
+        sampler = Sampler(threading.get_ident(), 0.001).start()
+        # when
+        busy()
+        sampler.stop()
+        # then
+        self.assertTrue(any(stack.endswith(f'{__name__}:busy') for stack in sampler.stacks))
+        self.assertLess(sum(sampler.stacks.values()), 0.1)
+
+
+class ProfilingMiddlewareTestCase(SimpleTestCase):
+    """Tests for ProfilingMiddleware"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            PROFILING_DIR=directory.name, PROFILING_KEY='secret', PROFILING_SAMPLE_RATE=0, PROFILING_INTERVAL=0.001
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.request_factory = RequestFactory()
+
+    def get_request(self, path='/api/v1/weather/1/', **headers):
+        request = self.request_factory.get(path, **headers)
+        request.resolver_match = resolve(path)
+        return request
+
+    def get_response(self, request):
+        busy(0.01)
+        return HttpResponse()
+
+    @override_settings(PROFILING_SAMPLE_RATE=0, PROFILING_KEY='')
+    def test_init_raise_not_used_if_disabled(self):
+        """__init__: leave the middleware out of the chain if profiling is disabled"""
+        # when/then
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(self.get_response)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_call_write_profile_of_sampled_request(self):
+        """__call__: write the profile of sampled requests under the name of their view"""
+        # when
+        response = ProfilingMiddleware(self.get_response)(self.get_request())
+        # then
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list(find_profiles()), ['api.v1.weather'])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_call_skip_other_paths(self):
+        """__call__: only profile requests to the api"""
+        # when
+        ProfilingMiddleware(self.get_response)(self.get_request('/metrics'))
+        # then
+        self.assertEqual(find_profiles(), {})
+
+    def test_call_profile_request_with_key(self):
+        """__call__: profile requests sending the profiling key and return the id of their profile"""
+        # when
+        response = ProfilingMiddleware(self.get_response)(self.get_request(HTTP_X_PROFILE_KEY='secret'))
+        # then
+        self.assertEqual(
+            find_profiles(), {'api.v1.weather': [get_profile_path('api:v1:weather', response['X-Profile-Id'])]}
+        )
+
+    def test_call_ignore_wrong_key(self):
+        """__call__: do not profile requests sending a wrong key"""
+        # when
+        response = ProfilingMiddleware(self.get_response)(self.get_request(HTTP_X_PROFILE_KEY='wrong'))
+        # then
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(find_profiles(), {})
+
+    def test_call_stay_async_in_async_chain(self):
+        """__call__: profile async views without running them in a thread"""
+        # given
+        async def get_response(request):
+            busy(0.01)
+            return HttpResponse()
+
+        middleware = ProfilingMiddleware(get_response)
+        # when
+        response = async_to_sync(middleware)(self.get_request(HTTP_X_PROFILE_KEY='secret'))
+        # then
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertIn('X-Profile-Id', response)
+
+
+class ProfileViewTestCase(SimpleTestCase):
+    """Tests for profile_view"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PROFILING_DIR=directory.name, PROFILING_KEY='secret')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.profile_id = 'a' * 32
+        write_profile('api:v1:weather', self.profile_id, 'main;view 120\nmain;render 30\n')
+
+    def test_get_return_speedscope_profile(self):
+        """get: return a captured profile in the speedscope format"""
+        # when
+        response = self.client.get(f'/profiles/{self.profile_id}', HTTP_X_PROFILE_KEY='secret')
+        # then
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['profiles'][0]['weights'], [120, 30])
+
+    def test_get_return_collapsed_profile(self):
+        """get: return a captured profile in the collapsed stack format"""
+        # when
+        response = self.client.get(f'/profiles/{self.profile_id}', {'format': 'collapsed'}, HTTP_X_PROFILE_KEY='secret')
+        # then
+        self.assertEqual(response.content, b'main;view 120\nmain;render 30\n')
+
+    def test_get_return_forbidden_without_key(self):
+        """get: return 403 if the profiling key is missing or wrong"""
+        # when
+        response = self.client.get(f'/profiles/{self.profile_id}', HTTP_X_PROFILE_KEY='wrong')
+        # then
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_return_not_found(self):
+        """get: return 404 for unknown or invalid profile ids"""
+        # when/then
+        self.assertEqual(self.client.get(f'/profiles/{"b" * 32}', HTTP_X_PROFILE_KEY='secret').status_code, 404)
+        self.assertEqual(self.client.get('/profiles/*', HTTP_X_PROFILE_KEY='secret').status_code, 404)
+
+    @override_settings(PROFILING_KEY='')
+    def test_get_return_not_found_if_disabled(self):
+        """get: return 404 if no profiling key is configured"""
+        # when
+        response = self.client.get(f'/profiles/{self.profile_id}', HTTP_X_PROFILE_KEY='')
+        # then
+        self.assertEqual(response.status_code, 404)
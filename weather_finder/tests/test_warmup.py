@@ -0,0 +1,27 @@
+import gc
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from weather_finder.warmup import warm_up
+
+
+class WarmUpTestCase(SimpleTestCase):
+    """Tests for warm_up"""
+
+    def setUp(self):
+        self.addCleanup(gc.unfreeze)
+
+    @mock.patch('weather_finder.warmup.get_wind_direction_table')
+    @mock.patch('weather_finder.warmup.get_city_index')
+    @mock.patch('weather_finder.warmup.os.path.exists')
+    def test_warm_up(self, mock_exists, mock_get_city_index, mock_get_wind_direction_table):
+        """warm_up: load the prebuilt city indexes and wind directions, freeze the loaded objects"""
+        # given
+        mock_exists.return_value = True
+        # when
+        warm_up()
+        # then
+        mock_get_city_index.assert_called_once_with('en')
+        mock_get_wind_direction_table.assert_called_once_with('en')
+        self.assertGreater(gc.get_freeze_count(), 0)
@@ -18,10 +18,15 @@ from django.contrib import admin
 from django.urls import include
 from django.urls import path
 
+from weather_finder.metrics import metrics_view
+from weather_finder.profiling import profile_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(('api.urls', 'api'), namespace='api')),
     path('api-auth/', include('rest_framework.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/<str:profile_id>', profile_view, name='profile'),
 ]
 
 urlpatterns += i18n_patterns(
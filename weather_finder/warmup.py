@@ -0,0 +1,44 @@
+import gc
+import logging
+import os
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.urls import get_resolver
+from django.utils import translation
+
+from api.v1.cities import get_city_index
+from api.v1.cities import get_city_index_path
+from api.v1.helpers import get_wind_direction_table
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    Load what the first requests of a worker would otherwise load: urls and views, translation catalogs, wind
+    direction tables and the prebuilt city index files
+
+    Called by the gunicorn master before forking the workers with --preload (see gunicorn.conf.py), the workers
+    then share these pages copy-on-write. Nothing here may open a connection or start a thread. The loaded
+    objects are frozen out of the garbage collector so that collections in the workers do not write to them.
+    """
+    started = time.perf_counter()
+    get_resolver().url_patterns
+    if settings.API_ASYNC_VIEWS:
+        # loaded on first use by the async views
+        import_module('httpx')
+        import_module('redis.asyncio')
+    for language, name in settings.LANGUAGES:
+        # activating a language loads its catalogs
+        with translation.override(language):
+            pass
+    get_wind_direction_table(settings.LANGUAGE_CODE)
+    for language, name in settings.LANGUAGES:
+        # without a prebuilt file the index is built from the database, on first use in the worker
+        if os.path.exists(get_city_index_path(language)):
+            get_city_index(language)
+    gc.collect()
+    gc.freeze()
+    logger.info('Warmed up in %.3fs, %s objects frozen', time.perf_counter() - started, gc.get_freeze_count())